@@ -1,11 +1,286 @@
+import argparse
+import sys
+
+from libs.lazy import import_report
 from libs.Overture2STL import (
     bbox_size_meters,
     map_types_default,
     map_types_all,
+    engines,
+    heightmap_faces_default,
+    heightmap_resolution_default,
+    point_sections_default,
+    output_formats,
     overture_to_stl,
 )
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert Overture map data to an STL model.")
+    parser.add_argument(
+        "--import-report",
+        action="store_true",
+        help="print the time spent importing dependencies when done",
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="update the cached GeoJSON files in the working directory to the release (see --release), fetching only added and changed features, and exit",
+    )
+    parser.add_argument(
+        "--format",
+        choices=output_formats,
+        default="stl",
+        help="output format of the model (stl)",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="CSV or JSON file with jobs to run without prompting",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of manifest jobs to run at the same time (1)",
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="run concurrent manifest jobs in worker processes instead of threads",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="maximum number of rows per record batch when downloading",
+    )
+    parser.add_argument(
+        "--batch-readahead",
+        type=int,
+        help="number of record batches to read ahead within a file when downloading",
+    )
+    parser.add_argument(
+        "--fragment-readahead",
+        type=int,
+        help="number of files to read ahead when downloading",
+    )
+    parser.add_argument(
+        "--single-threaded-scan",
+        action="store_true",
+        help="download without using the pyarrow thread pool",
+    )
+    parser.add_argument(
+        "--max-buffer-mb",
+        type=float,
+        help="maximum MB of downloaded record batches waiting to be written",
+    )
+    parser.add_argument(
+        "--storage",
+        help="where to read Overture data: s3://bucket[/prefix], http(s)://host/path or a local directory with the layout of the Overture bucket (the public Overture bucket)",
+    )
+    parser.add_argument(
+        "--release",
+        help="Overture release to read",
+    )
+    parser.add_argument(
+        "--s3-region",
+        help="region of an s3:// storage",
+    )
+    parser.add_argument(
+        "--s3-endpoint",
+        help="URL of an S3-compatible server for an s3:// storage",
+    )
+    parser.add_argument(
+        "--overlay",
+        nargs="?",
+        const="",
+        help="cut overlapping features before extrusion so the model is manifold, optionally with comma-separated types from highest priority (buildings, then roads, then water, ...)",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        type=int,
+        const=20,
+        metavar="N",
+        help="record the time spent on each feature and list the N most expensive ones (20)",
+    )
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="estimate the cost of a model before downloading anything, and ask whether to continue",
+    )
+    parser.add_argument(
+        "--max-faces",
+        type=int,
+        help="reject manifest jobs estimated to have more faces",
+    )
+    parser.add_argument(
+        "--max-output-mb",
+        type=float,
+        help="reject manifest jobs estimated to write larger files",
+    )
+    parser.add_argument(
+        "--max-minutes",
+        type=float,
+        help="reject manifest jobs estimated to take longer",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=engines,
+        default="mesh",
+        help="extrude every feature (mesh), or rasterize all features into one surface (heightmap), which is faster for large areas",
+    )
+    parser.add_argument(
+        "--heightmap-resolution",
+        type=float,
+        default=heightmap_resolution_default,
+        help=f"distance between heightmap samples in the printed model in mm (chosen for about {heightmap_faces_default} faces)",
+    )
+    parser.add_argument(
+        "--simplify",
+        type=float,
+        default=0.0,
+        metavar="MM",
+        help="simplify geometries with a tolerance in mm in the printed model (0)",
+    )
+    parser.add_argument(
+        "--min-feature-size",
+        type=float,
+        default=0.0,
+        metavar="MM",
+        help="leave out polygons and lines smaller than a size in mm in the printed model (0)",
+    )
+    parser.add_argument(
+        "--point-sections",
+        type=int,
+        default=point_sections_default,
+        help=f"number of sections of the cylinders of points ({point_sections_default})",
+    )
+    parser.add_argument(
+        "--weld",
+        nargs="?",
+        type=float,
+        const=0.001,
+        default=0.0,
+        metavar="MM",
+        help="merge vertices closer than a distance in mm (0.001) and drop duplicate faces",
+    )
+    parser.add_argument(
+        "--join-parts",
+        action="store_true",
+        help="with --weld, join touching parts and the base into one closed shell",
+    )
+    parser.add_argument(
+        "--face-budget",
+        type=int,
+        help="choose the level of detail of each type to make at most this many faces",
+    )
+    parser.add_argument(
+        "--size-budget-mb",
+        type=float,
+        help="choose the level of detail of each type to make a file of at most this size",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="download and parse the next types, and clip and project features, while meshing in parallel",
+    )
+    args = parser.parse_args()
+
+    overlay_priority = None
+    if args.overlay is not None:
+        overlay_priority = [t.strip() for t in args.overlay.split(",") if t.strip()]
+
+    # Storage, only set up if changed to not import pyarrow before it's needed
+    storage = None
+    if args.storage or args.release or args.s3_region or args.s3_endpoint:
+        from libs import core
+
+        storage = core.Storage.from_uri(
+            args.storage or f"s3://{core.s3_bucket}",
+            args.release or core.release,
+            args.s3_region or core.s3_region,
+            args.s3_endpoint,
+        )
+        core.set_storage(storage)
+
+    size_budget = None
+    if args.size_budget_mb is not None:
+        size_budget = int(args.size_budget_mb * 1024 * 1024)
+
+    # Download tuning, the pyarrow defaults are used for options not given
+    scan_options = {}
+    if args.batch_size is not None:
+        scan_options["batch_size"] = args.batch_size
+    if args.batch_readahead is not None:
+        scan_options["batch_readahead"] = args.batch_readahead
+    if args.fragment_readahead is not None:
+        scan_options["fragment_readahead"] = args.fragment_readahead
+    if args.single_threaded_scan:
+        scan_options["use_threads"] = False
+    if args.max_buffer_mb is not None:
+        scan_options["max_buffer_bytes"] = int(args.max_buffer_mb * 1024 * 1024)
+
+    if args.refresh_cache:
+        from libs import core
+        from libs.refresh import format_result, refresh_directory
+
+        release = core.get_storage().release
+        results = refresh_directory(".")
+        for path, result in results:
+            print(format_result(path, result, release))
+        print(f"Refreshed {len(results)} cached files.")
+        sys.exit(0)
+
+    if args.manifest:
+        from libs.batch import read_manifest, run_batch
+
+        try:
+            jobs = read_manifest(args.manifest)
+        except (ValueError, OSError) as e:
+            print(f"Could not read the manifest '{args.manifest}': {e}")
+            sys.exit(1)
+        for job in jobs:
+            job.setdefault("scan_options", scan_options)
+            job.setdefault("output_format", args.format)
+            job.setdefault("engine", args.engine)
+            job.setdefault("heightmap_resolution", args.heightmap_resolution)
+            job.setdefault("pipeline", args.pipeline)
+            job.setdefault("simplify_tolerance", args.simplify)
+            job.setdefault("min_feature_size", args.min_feature_size)
+            job.setdefault("point_sections", args.point_sections)
+            job.setdefault("weld_tolerance", args.weld)
+            job.setdefault("join_parts", args.join_parts)
+            if args.face_budget is not None:
+                job.setdefault("face_budget", args.face_budget)
+            if size_budget is not None:
+                job.setdefault("size_budget", size_budget)
+            if overlay_priority is not None:
+                job.setdefault("overlay_priority", overlay_priority)
+        limits = {}
+        if args.max_faces is not None:
+            limits["max_faces"] = args.max_faces
+        if args.max_output_mb is not None:
+            limits["max_output_bytes"] = int(args.max_output_mb * 1024 * 1024)
+        if args.max_minutes is not None:
+            limits["max_seconds"] = args.max_minutes * 60.0
+        results = run_batch(jobs, args.jobs, args.processes, storage, limits)
+        failed = 0
+        for output, error, seconds in results:
+            if error is None:
+                print(f"'{output}': done in {seconds:.1f} s")
+            else:
+                failed += 1
+                print(f"'{output}': failed after {seconds:.1f} s: {error}")
+        print(f"{len(results) - failed} of {len(results)} jobs succeeded.")
+        if args.import_report:
+            print(import_report())
+        sys.exit(1 if failed else 0)
+
+    profile = None
+    if args.profile is not None:
+        from libs.profiling import FeatureProfile
+
+        profile = FeatureProfile(args.profile)
+
     # Bounding box
     input_bbox = input(
         "Enter bounding box (long west, lat south, long east, lat north): "
@@ -125,6 +400,24 @@ if __name__ == "__main__":
         float(input_base_margin) if input_base_margin != "" else base_margin_default
     )
 
+    # Estimated cost, before anything is downloaded. Only asks whether to continue
+    # when run interactively, so that piped answers keep their order.
+    if args.estimate:
+        from libs.estimate import estimate, format_estimate
+
+        try:
+            for line in format_estimate(estimate(bbox, overture_types, args.format)):
+                print(line)
+        except Exception as e:
+            print(f"Could not estimate the cost: {e}")
+        if sys.stdin.isatty():
+            try:
+                answer = input("Continue (y/n) (y): ")
+            except EOFError:
+                answer = ""
+            if answer.strip().lower() in ["n", "no"]:
+                sys.exit(0)
+
     # File name for STL and GeoJSON files
     input_outputfile = input(
         "File name for generated files without extension: "
@@ -145,6 +438,23 @@ if __name__ == "__main__":
             base_margin,
             base_height,
             input_outputfile,
+            scan_options=scan_options,
+            output_format=args.format,
+            overlay_priority=overlay_priority,
+            profile=profile,
+            engine=args.engine,
+            heightmap_resolution=args.heightmap_resolution,
+            pipeline=args.pipeline,
+            simplify_tolerance=args.simplify,
+            min_feature_size=args.min_feature_size,
+            point_sections=args.point_sections,
+            weld_tolerance=args.weld,
+            join_parts=args.join_parts,
+            face_budget=args.face_budget,
+            size_budget=size_budget,
         )
     else:
         print("Missing a file path!")
+
+    if args.import_report:
+        print(import_report())
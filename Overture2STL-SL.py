@@ -1,6 +1,7 @@
 # TODO Separate bounding box for STL from bounding box for map (completely separate)
 
 import streamlit as st
+import streamlit.components.v1 as components
 from streamlit_folium import st_folium
 import folium
 from folium.plugins import Draw
@@ -10,8 +11,13 @@ from libs.Overture2STL import (
     bbox_size_meters,
     map_types_default,
     map_types_all,
+    engines,
+    heightmap_resolution_default,
+    output_formats,
     overture_to_stl,
 )
+from libs.progress import progress_fraction
+from libs.session import Session
 
 # Must be called first
 st.set_page_config(page_title="Overture to STL", page_icon="🗺", layout="centered", initial_sidebar_state="collapsed")
@@ -188,32 +194,162 @@ st.header("Output")
 outputfile = st.text_input(
     "File name for generated files (without extension)", value=""
 )
+output_format = st.selectbox(
+    "Output format (3MF and PLY files are much smaller than STL)",
+    output_formats,
+    index=0,
+)
+engine = st.selectbox(
+    "Engine (heightmap is faster for large areas, but less detailed)",
+    engines,
+    index=0,
+)
+heightmap_resolution = heightmap_resolution_default
+if engine == "heightmap":
+    heightmap_resolution = st.number_input(
+        "Heightmap resolution (mm, 0 chooses it from the size of the print)",
+        min_value=0.0,
+        value=heightmap_resolution_default,
+        step=0.05,
+    )
+
+face_budget = st.number_input(
+    "Maximum number of triangles, lowering the detail to fit (0 for no limit)",
+    min_value=0,
+    value=0,
+    step=10000,
+)
+
+
+# Parsed GeoJSON is kept between runs of a user, so that the full model made after a
+# preview doesn't parse it again. Each user has a session of their own, with a small
+# cache, as the server is shared.
+session_cache_bytes = 256 * 1024 * 1024
+
+
+def user_session():
+    if "overture_session" not in st.session_state:
+        st.session_state["overture_session"] = Session(cache_bytes=session_cache_bytes)
+    return st.session_state["overture_session"]
+
+
+# Estimates are reused while the selection doesn't change
+@st.cache_data(show_spinner="Estimating...")
+def cached_estimate(bbox, overture_types, output_format):
+    from libs.estimate import estimate
 
-if "perform" in st.session_state and st.session_state["perform"]:   
-    with st.spinner("Generating STL...", show_time=True):
+    return estimate(list(bbox), list(overture_types), output_format)
+
+
+# --- Estimate, before anything is downloaded ---
+if st.button("Estimate cost") and bbox and selected_types:
+    from libs.estimate import format_estimate
+
+    try:
+        cost = cached_estimate(tuple(bbox), tuple(selected_types), output_format)
+        st.info("  \n".join(format_estimate(cost)))
+    except Exception as e:
+        st.error(f"Could not estimate the cost: {e}")
+
+# --- Preview, coarse but quick ---
+if st.button("Preview") and bbox and selected_types:
+    from libs.preview import glb_bytes, model_viewer_html, preview_model
+
+    with st.spinner("Generating preview...", show_time=True):
         try:
-            overture_to_stl(
+            preview = preview_model(
                 bbox,
-                selected_types,
-                polygon_height_mode,
-                polygon_height,
-                polygon_height_flat,
-                line_width,
-                line_height,
-                point_width,
-                point_height,
-                scale_percent,
-                base_margin,
-                base_height,
-                outputfile,
+                overture_types=selected_types,
+                polygon_height_mode=polygon_height_mode,
+                polygon_height_default=polygon_height,
+                polygon_height_flat_default=polygon_height_flat,
+                line_width_default=line_width,
+                line_height_default=line_height,
+                point_width_default=point_width,
+                point_height_default=point_height,
+                scale_percent=scale_percent,
+                base_margin=base_margin,
+                base_height=base_height,
+                session=user_session(),
             )
-
-            st.success(f"'{outputfile}.stl' was generated successfully.")
-            st.info("Check your working directory for the file.")
+            components.html(model_viewer_html(glb_bytes(preview)), height=500)
         except Exception as e:
-            st.error(f"Something went wrong when generating the STL file: {e}")
+            st.error(f"Something went wrong when generating the preview: {e}")
+
+if "perform" in st.session_state and st.session_state["perform"]:
+    # Clicking the button makes Streamlit interrupt the generation at its next
+    # progress update, which removes its partial files, and rerun with the button
+    # reporting the click
+    if st.button("Cancel"):
+        st.session_state["perform"] = False
+        st.warning("Generation was cancelled.")
+    else:
+        progress_bar = st.progress(0.0, text="Starting...")
+
+        def show_progress(event):
+            text = event["stage"].capitalize()
+            if "type" in event:
+                text += f" {event['type']}"
+            if event["stage"] == "process":
+                text += f" ({event['done']} of {event['total']} features)"
+            progress_bar.progress(progress_fraction(event), text=text)
+
+        with st.spinner("Generating STL...", show_time=True):
+            try:
+                result = overture_to_stl(
+                    bbox,
+                    selected_types,
+                    polygon_height_mode,
+                    polygon_height,
+                    polygon_height_flat,
+                    line_width,
+                    line_height,
+                    point_width,
+                    point_height,
+                    scale_percent,
+                    base_margin,
+                    base_height,
+                    outputfile,
+                    output_format=output_format,
+                    session=user_session(),
+                    progress=show_progress,
+                    engine=engine,
+                    heightmap_resolution=heightmap_resolution,
+                    in_memory=True,
+                    face_budget=face_budget or None,
+                )
+
+                # Kept for the download buttons, as clicking one reruns the app
+                st.session_state["download"] = {
+                    "name": outputfile,
+                    "format": output_format,
+                    "model": result.to_bytes(),
+                    "log": result.log_csv(),
+                }
+                st.success(f"'{outputfile}.{output_format}' was generated successfully.")
+            except Exception as e:
+                st.error(f"Something went wrong when generating the STL file: {e}")
+
+            st.session_state["perform"] = False
 
-        st.session_state["perform"] = False 
+# --- Download the last generated model ---
+if "download" in st.session_state:
+    download = st.session_state["download"]
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            f"Download '{download['name']}.{download['format']}'",
+            download["model"],
+            file_name=f"{download['name']}.{download['format']}",
+            mime="application/octet-stream",
+        )
+    with col2:
+        st.download_button(
+            f"Download feature log '{download['name']}.csv'",
+            download["log"],
+            file_name=f"{download['name']}.csv",
+            mime="text/csv",
+        )
 
 # --- Generate STL Button ---
 if st.button("Generate STL"):
@@ -8,24 +8,62 @@
 # https://github.com/OvertureMaps/schema
 # https://github.com/OvertureMaps/schema/tree/dev/schema/buildings
 
-import geojson
-from shapely.geometry import shape, box, Polygon
-from shapely.ops import unary_union, transform
-from shapely.validation import explain_validity
-from pyproj import Transformer
-import numpy as np
-import trimesh
-from shapely.geometry import LineString, Polygon
-from shapely.affinity import rotate as shapely_rotate
 import csv
 import os
-from libs.cli import download
-
-transformer = None
+import time
+from libs.lazy import lazy_import
+
+# Heavy dependencies are only imported by the stage that needs them, so that e.g.
+# bbox_size_meters doesn't have to wait for trimesh and pyarrow to load
+np = lazy_import("numpy")
+trimesh = lazy_import("trimesh")
+shapely = lazy_import("shapely")
+shapely_geometry = lazy_import("shapely.geometry")
+shapely_ops = lazy_import("shapely.ops")
+shapely_validation = lazy_import("shapely.validation")
+shapely_affinity = lazy_import("shapely.affinity")
+cli = lazy_import("libs.cli")
+mesh = lazy_import("libs.mesh")
+session_module = lazy_import("libs.session")
+rules = lazy_import("libs.rules")
+export = lazy_import("libs.export")
+progress_module = lazy_import("libs.progress")
+dedup = lazy_import("libs.dedup")
+overlay = lazy_import("libs.overlay")
+heightmap = lazy_import("libs.heightmap")
+cache = lazy_import("libs.cache")
+core = lazy_import("libs.core")
+pipeline_module = lazy_import("libs.pipeline")
+repair = lazy_import("libs.repair")
+result_module = lazy_import("libs.result")
+budget = lazy_import("libs.budget")
+refresh = lazy_import("libs.refresh")
 
 # Default map types to use
 map_types_default = ["building", "building_part", "infrastructure", "segment", "water"]
 
+# Supported output formats. STL repeats the vertices of every triangle, while 3MF
+# (zip-compressed) and binary PLY store each vertex once.
+output_formats = ["stl", "3mf", "ply"]
+
+# Mesh generators. "mesh" extrudes every feature, "heightmap" rasterizes all features
+# into one grid surface with cells of heightmap_resolution mm in the printed model.
+# Without a resolution (0), it is chosen from the size of the print to make about
+# heightmap_faces_default faces, for a quick overview, but no finer than
+# heightmap_resolution_min, a common nozzle width.
+engines = ["mesh", "heightmap"]
+heightmap_resolution_default = 0.0
+heightmap_faces_default = 200_000
+heightmap_resolution_min = 0.4
+
+# Level of detail. Projected geometries can be simplified with a tolerance, and
+# features smaller than a size left out (both in mm in the printed model), and
+# points are cylinders with a number of sections.
+point_sections_default = 24
+
+# Number of features clipped, repaired and projected together
+prepare_batch_size = 256
+
 # All possible map types
 map_types_all = [
     "address",
@@ -46,59 +84,6 @@ map_types_all = [
 ]
 
 
-# Widths of roads in meters
-# https://github.com/OvertureMaps/schema/blob/dev/schema/transportation/segment.yaml
-road_widths = {
-    "motorway": 20.0,
-    "primary": 12.0,
-    "secondary": 8.0,
-    "tertiary": 6.0,
-    "residential": 4.0,
-    "living_street": 4.0,
-    "trunk": 2.0,
-    "unclassified": 2.0,
-    "service": 2.0,
-    "pedestrian": 2.0,
-    "footway": 2.0,
-    "steps": 2.0,
-    "path": 2.0,
-    "track": 2.0,
-    "cycleway": 2.0,
-    "bridleway": 2.0,
-    "unknown": 2.0,
-}
-
-# Polygons to be considered flat areas
-polygon_flat = [
-    # Infrastructure
-    # https://github.com/OvertureMaps/schema/blob/dev/schema/base/infrastructure.yaml
-    "barrier",
-    "pier",
-    "transit",
-    # Water
-    # https://github.com/OvertureMaps/schema/blob/dev/schema/base/water.yaml
-    "canal",
-    "human_made",
-    "lake",
-    "ocean",
-    "physical",
-    "pond",
-    "reservoir",
-    "river",
-    "spring",
-    "stream",
-    "wastewater",
-    "water",
-]
-
-# Points that are relevant to include
-point_relevant = [
-    "transit/bus_stop",
-    # "barrier/bollard",
-    # "barrier/gate"
-]
-
-
 # Convert bounding box values to a string
 def bbox_string(bbox):
     return ",".join(str(num) for num in bbox)
@@ -109,7 +94,7 @@ def bbox_size_meters(bbox):
 
     # Get UTM zone for center of bbox
     epsg_code = get_utm_epsg_code(min_lon, min_lat, max_lon, max_lat)
-    transformer = Transformer.from_crs("EPSG:4326", f"EPSG:{epsg_code}", always_xy=True)
+    transformer = get_transformer(epsg_code)
 
     # Project lower-left and lower-right for width
     x1, y1 = transformer.transform(min_lon, min_lat)
@@ -123,56 +108,81 @@ def bbox_size_meters(bbox):
     return width_m, height_m
 
 
-# Project geographic geometry to projected coordinate system.
-def project_geom(geom):
-    global transformer
-
-    return transform(transformer.transform, geom)
+# Project geographic geometry to projected coordinate system. Without a transformer
+# the geometry is taken to be projected already.
+def project_geom(geom, transformer):
+    if transformer is None:
+        return geom
+    return shapely_ops.transform(transformer.transform, geom)
 
 
 # Convert a Polygon to a 3D mesh with height.
-def polygon_to_extruded_mesh(polygon, height):
-    projected_poly = project_geom(polygon)
+def polygon_to_extruded_mesh(polygon, height, transformer):
+    projected_poly = project_geom(polygon, transformer)
+    return footprint_to_extruded_mesh(projected_poly, height)
+
+
+# Convert a projected Polygon to a 3D mesh with height.
+def footprint_to_extruded_mesh(footprint, height):
     # Use trimesh's robust extrusion
-    mesh_obj = trimesh.creation.extrude_polygon(projected_poly, height)
+    mesh_obj = trimesh.creation.extrude_polygon(footprint, height)
     if mesh_obj:
         return mesh_obj.vertices, mesh_obj.faces
     else:
         return None, None
 
 
-# Convert a LineString into a 3D extruded corridor mesh of width and height in meters.
-def line_to_extruded_mesh(line, width, height):
-    projected_line = project_geom(line)
+# Projected corridor polygon of a LineString with a width in meters, None if it
+# can't be made. Problems are recorded in diagnostics (see libs/repair.py), or
+# printed without.
+def line_to_footprint(line, width, transformer, diagnostics=None):
+    projected_line = project_geom(line, transformer)
     corridor_poly = projected_line.buffer(width / 2.0, cap_style=2, join_style=2)
 
     # Check for validity
     if corridor_poly.is_empty:
-        print("Warning: Buffer produced an empty polygon for line:", list(line.coords))
-        return None, None
+        repair.warn(diagnostics, "line buffer", "empty polygon", list(line.coords))
+        return None
 
     if not corridor_poly.is_valid:
-        print("Warning: Buffer polygon invalid:", explain_validity(corridor_poly))
+        repair.warn(
+            diagnostics, "line buffer", "invalid polygon", shapely_validation.explain_validity(corridor_poly)
+        )
         # Try to fix with buffer(0)
         corridor_poly = corridor_poly.buffer(0)
         if corridor_poly.is_empty or not corridor_poly.is_valid:
-            print("Failed to fix invalid buffer polygon.")
-            return None, None
+            repair.warn(diagnostics, "line buffer", "failed to fix invalid polygon")
+            return None
+
+    return corridor_poly
+
+
+# Convert a LineString into a 3D extruded corridor mesh of width and height in meters.
+def line_to_extruded_mesh(line, width, height, transformer, diagnostics=None):
+    corridor_poly = line_to_footprint(line, width, transformer, diagnostics)
+    if corridor_poly is None:
+        return None, None
 
     # Extrude using trimesh
     try:
         mesh_obj = trimesh.creation.extrude_polygon(corridor_poly, height)
         if mesh_obj.vertices.shape[0] == 0 or mesh_obj.faces.shape[0] == 0:
-            print("Extrusion resulted in empty mesh.")
+            repair.warn(diagnostics, "line extrusion", "empty mesh")
             return None, None
         return mesh_obj.vertices, mesh_obj.faces
     except Exception as e:
-        print("Extrusion failed:", e)
+        repair.warn(diagnostics, "line extrusion", "failed", e)
         return None, None
 
 
-def point_to_cylinder_mesh(point, width, height, sections=24):
-    projected_point = project_geom(point)
+# Projected polygon approximating the cross-section of the cylinder of a point
+def point_to_footprint(point, width, transformer, sections=point_sections_default):
+    projected_point = project_geom(point, transformer)
+    return projected_point.buffer(width / 2.0, quad_segs=max(sections // 4, 1))
+
+
+def point_to_cylinder_mesh(point, width, height, transformer, sections=point_sections_default):
+    projected_point = project_geom(point, transformer)
     x, y = projected_point.x, projected_point.y
     transform = trimesh.transformations.translation_matrix([x, y, height / 2.0])
     mesh_obj = trimesh.creation.cylinder(
@@ -184,6 +194,20 @@ def point_to_cylinder_mesh(point, width, height, sections=24):
         return None, None
 
 
+# Bounds of the base in the frame of the finished model, where the projected bbox is
+# rotated by -convergence_angle around the centroid to align north-up, expanded by
+# a margin
+def base_bounds(projected_bbox_poly, centroid, convergence_angle, margin):
+    rotated_bbox_poly = shapely_affinity.rotate(
+        projected_bbox_poly,
+        -convergence_angle,
+        origin=(centroid.x, centroid.y),
+        use_radians=False,
+    )
+    min_x, min_y, max_x, max_y = rotated_bbox_poly.bounds
+    return min_x - margin, min_y - margin, max_x + margin, max_y + margin
+
+
 def get_utm_epsg_code(minx, miny, maxx, maxy):
     avg_lon = (minx + maxx) / 2.0
     avg_lat = (miny + maxy) / 2.0
@@ -195,6 +219,12 @@ def get_utm_epsg_code(minx, miny, maxx, maxy):
     return epsg_code
 
 
+# Return a transformer from WGS84 to the given EPSG code, cached for the thread by
+# the default session.
+def get_transformer(epsg_code):
+    return session_module.default_session().transformer(epsg_code)
+
+
 # Return the longitude of the central meridian for a given UTM EPSG code.
 def get_utm_central_meridian(epsg_code):
     if 32601 <= epsg_code <= 32660:
@@ -219,61 +249,245 @@ def get_convergence_angle(lon, lat, epsg_code):
     return np.rad2deg(gamma)
 
 
-# Helper to rotate vertices around Z axis
-def rotate_vertices(vertices, angle_deg):
-    angle_rad = np.deg2rad(angle_deg)
-    R = np.array(
-        [
-            [np.cos(angle_rad), -np.sin(angle_rad), 0],
-            [np.sin(angle_rad), np.cos(angle_rad), 0],
-            [0, 0, 1],
-        ]
-    )
-    return vertices @ R.T
-
-
 # Download Overture data for a given type and bbox, save to file if not cached
 # Use Overture Maps CLI executable for downloading data
 def get_overture_geojson(type_name, bbox, cache_prefix):
     filename = f"{bbox_string(bbox)}-{type_name}.geojson"
 
-    # Use cached GeoJSON file if it exists
-    if os.path.exists(filename):
+    # Use cached GeoJSON file if it's complete
+    if cache.is_valid(filename, type=type_name, bbox=bbox_string(bbox)):
         print(f"Using cached '{filename}'")
         return filename
 
-    # Fetch GeoJSON, assuming OvertureMaps is installed
-    print(f"Fetching '{filename}'")
-    # {bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]}
-    command = f'overturemaps download --bbox={bbox_string(bbox)} -f geojson --type="{type_name}" -o "{filename}"'
-    result = os.system(command)
-    if result == 0:
-        return filename
-    else:
-        print(f"Failed fetching '{filename}': {result}")
-        return None
+    with cache.FileLock(filename):
+        if cache.is_valid(filename, type=type_name, bbox=bbox_string(bbox)):
+            print(f"Using cached '{filename}'")
+            return filename
+
+        # Fetch GeoJSON, assuming OvertureMaps is installed
+        print(f"Fetching '{filename}'")
+        temp_filename = cache.temp_path(filename)
+        # {bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]}
+        command = f'overturemaps download --bbox={bbox_string(bbox)} -f geojson --type="{type_name}" -o "{temp_filename}"'
+        try:
+            result = os.system(command)
+            if result == 0:
+                cache.commit(temp_filename, filename, type=type_name, bbox=bbox_string(bbox))
+                return filename
+            else:
+                print(f"Failed fetching '{filename}': {result}")
+                return None
+        finally:
+            cache.remove(temp_filename)
 
 
 # Download Overture data for a given type and bbox, save to file if not cached
-# Use Overture Maps CLI source for downloading data
-def get_overture_geojson_direct(type_name, bbox, cache_prefix):
+# Use Overture Maps CLI source for downloading data, reusing the dataset of a session.
+# scan_options are passed to libs.core.record_batch_reader, and the download stops
+# if the cancel token is cancelled. The file is written under another name and
+# renamed when complete, and only one thread or process fetches a file while
+# others wait for it (see libs/cache.py). A file cached for another release is
+# refreshed to the release of the storage (see libs/refresh.py).
+def get_overture_geojson_direct(
+    type_name, bbox, cache_prefix, session=None, scan_options=None, cancel=None
+):
     filename = f"{bbox_string(bbox)}-{type_name}.geojson"
+    storage = session.storage if session is not None else None
+    storage = storage or core.get_storage()
+    entry = {"type": type_name, "bbox": bbox_string(bbox)}
 
-    # Use cached GeoJSON file if it exists
-    if os.path.exists(filename):
+    # Use cached GeoJSON file if it's complete
+    if cache.is_valid(filename, release=storage.release, **entry):
         print(f"Using cached '{filename}'")
         return filename
 
-    # Fetch GeoJSON
-    print(f"Fetching '{filename}'")
-    try:
-        download(bbox, "geojson", filename, type_name)
-        return filename
-    except Exception as e:
-        print(f"Failed fetching '{filename}': {e}")
-        return None
-
+    # Fetch only the features that changed since the release it was cached for
+    if cache.is_valid(filename, **entry):
+        try:
+            result = refresh.refresh_file(filename, storage, cancel)
+            if result is not None:
+                print(refresh.format_result(filename, result, storage.release))
+        except progress_module.Cancelled:
+            raise
+        except Exception as e:
+            print(f"Failed refreshing '{filename}': {e}")
+        if cache.is_valid(filename, release=storage.release, **entry):
+            return filename
+
+    with cache.FileLock(filename, cancel):
+        # Fetched by someone else while waiting for the lock
+        if cache.is_valid(filename, release=storage.release, **entry):
+            print(f"Using cached '{filename}'")
+            return filename
+
+        # Fetch GeoJSON
+        print(f"Fetching '{filename}'")
+        temp_filename = cache.temp_path(filename)
+        try:
+            dataset = session.dataset(type_name) if session is not None else None
+            cli.download(
+                bbox, "geojson", temp_filename, type_name, dataset, cancel, **(scan_options or {})
+            )
 
+            # The release lets libs/refresh.py update the file to a later one
+            cache.commit(temp_filename, filename, release=storage.release, **entry)
+            return filename
+        except progress_module.Cancelled:
+            raise
+        except Exception as e:
+            print(f"Failed fetching '{filename}': {e}")
+            return None
+        finally:
+            # Don't leave a partial file behind
+            cache.remove(temp_filename)
+
+
+# Download or load the cached GeoJSON of each type, yielding (type, path) of those
+# that could be fetched
+def fetch_types(overture_types, bbox, cache_prefix, session, scan_options, progress, cancel):
+    for type_index, type_name in enumerate(overture_types):
+        progress_module.report(
+            progress, cancel, "download", type=type_name, done=type_index, total=len(overture_types)
+        )
+        geojson_file = get_overture_geojson_direct(
+            type_name, bbox, cache_prefix, session, scan_options, cancel
+        )
+        if geojson_file is not None:
+            yield type_name, geojson_file
+
+
+# Parse fetched GeoJSON files, yielding (type, path, features)
+def parse_types(fetched, session):
+    for type_name, path in fetched:
+        yield type_name, path, session.load_features(path)
+
+
+# Decide which of buildings and building parts to keep where both represent the same
+# building (see libs/dedup.py), yielding (type, path, features, keep) where keep is
+# a mask of the features to keep, or None for other types. The first of the two
+# types to be parsed is held back until the other one has been.
+def deduplicate_types(parsed, prefer_parts):
+    held = {}
+    for type_name, path, features in parsed:
+        if type_name not in ("building", "building_part"):
+            yield type_name, path, features, None
+            continue
+
+        held[type_name] = (path, features)
+        if len(held) < 2:
+            continue
+        keep_buildings, keep_parts = dedup.building_representation(
+            held["building"][1], held["building_part"][1], prefer_parts=prefer_parts
+        )
+        print(
+            f"Skipping {len(keep_buildings) - keep_buildings.sum()} building footprints "
+            f"and {len(keep_parts) - keep_parts.sum()} building parts that overlap the other representation."
+        )
+        keep = {"building": keep_buildings, "building_part": keep_parts}
+        for held_type, (held_path, held_features) in held.items():
+            yield held_type, held_path, held_features, keep[held_type]
+        held = {}
+
+    # Only one of them could be fetched
+    for held_type, (held_path, held_features) in held.items():
+        yield held_type, held_path, held_features, None
+
+
+# Simplify projected geometries with a tolerance in meters, if given, and find the
+# polygons of at least min_area square meters and lines of at least min_length
+# meters. Returns the geometries and a mask of those to keep.
+def reduce_detail(projected_geoms, simplify_tolerance=0.0, min_area=0.0, min_length=0.0):
+    if simplify_tolerance:
+        projected_geoms = shapely.simplify(projected_geoms, simplify_tolerance, preserve_topology=True)
+
+    # Leave out small polygons and short lines
+    type_ids = shapely.get_type_id(projected_geoms)
+    kept = np.ones(len(projected_geoms), dtype=bool)
+    if min_area:
+        polygonal = np.isin(type_ids, [3, 6])
+        kept &= ~(polygonal & (shapely.area(projected_geoms) < min_area))
+    if min_length:
+        linear = np.isin(type_ids, [1, 5])
+        kept &= ~(linear & (shapely.length(projected_geoms) < min_length))
+    return projected_geoms, kept
+
+
+# Clip features to the bounding box and project them, yielding (index, type of the
+# clipped geometry, projected geometry, clip seconds, project seconds) of those
+# inside it. Features that keep is False for are skipped. Projected geometries are
+# reduced in detail by reduce_detail().
+# Features are handled batch_size at a time with shapely's array functions, which
+# repair invalid geometries first (see libs/repair.py), and the seconds of a batch
+# are divided evenly between its features.
+def prepare_features(
+    features,
+    keep,
+    bbox_poly,
+    session,
+    epsg_code,
+    simplify_tolerance=0.0,
+    min_area=0.0,
+    min_length=0.0,
+    diagnostics=None,
+    batch_size=prepare_batch_size,
+):
+    # Transformers are per thread, so get it in the thread that iterates
+    transformer = session.transformer(epsg_code)
+
+    def project(coordinates):
+        x, y = transformer.transform(coordinates[:, 0], coordinates[:, 1])
+        return np.column_stack([x, y])
+
+    for start in range(0, len(features), batch_size):
+        indices = np.arange(start, min(start + batch_size, len(features)))
+        if keep is not None:
+            indices = indices[keep[start : start + batch_size]]
+        if len(indices) == 0:
+            continue
+
+        # Clip geometries to bounding box, after repairing invalid ones
+        clip_start = time.perf_counter()
+        geoms = np.empty(len(indices), dtype=object)
+        geoms[:] = [shapely_geometry.shape(features[i]["geometry"]) for i in indices]
+        geoms = repair.repair_geometries(geoms, diagnostics, "input geometry")
+        clipped_geoms = shapely.intersection(geoms, bbox_poly)
+        inside = ~shapely.is_empty(clipped_geoms)  # Skip features outside the area
+        indices = indices[inside]
+        clipped_geoms = clipped_geoms[inside]
+        if len(indices) == 0:
+            continue
+
+        # Use clipped geometry for further processing, projected once
+        project_start = time.perf_counter()
+        projected_geoms, kept = reduce_detail(
+            shapely.transform(clipped_geoms, project), simplify_tolerance, min_area, min_length
+        )
+        end = time.perf_counter()
+
+        clip_seconds = (project_start - clip_start) / len(indices)
+        project_seconds = (end - project_start) / len(indices)
+        for i, clipped_geom, projected_geom in zip(
+            indices[kept].tolist(), clipped_geoms[kept], projected_geoms[kept]
+        ):
+            yield i, clipped_geom.geom_type, projected_geom, clip_seconds, project_seconds
+
+
+# Reduce the detail of a list of the results of prepare_features() like it would
+# have itself, yielding the same tuples with the reduced geometries
+def reduce_prepared(prepared, simplify_tolerance=0.0, min_area=0.0, min_length=0.0):
+    if not prepared:
+        return
+    geoms = np.empty(len(prepared), dtype=object)
+    geoms[:] = [projected_geom for _, _, projected_geom, _, _ in prepared]
+    geoms, kept = reduce_detail(geoms, simplify_tolerance, min_area, min_length)
+    for (i, clipped_type, _, clip_seconds, project_seconds), geom, keep in zip(prepared, geoms, kept):
+        if keep:
+            yield i, clipped_type, geom, clip_seconds, project_seconds
+
+
+# Generate a model of the Overture data of the given types in a bounding box, and
+# return it as a trimesh mesh. With in_memory, no files are written and a
+# libs.result.ModelResult with the mesh and the feature log is returned instead.
 def overture_to_stl(
     bbox=None,
     overture_types=map_types_default,
@@ -288,346 +502,625 @@ def overture_to_stl(
     base_margin=10.0,
     base_height=2.0,
     output_stl_path="",
+    mesh_buffer_dir=None,
+    session=None,
+    dimension_rules=None,
+    scan_options=None,
+    output_format="stl",
+    weld_tolerance=0.0,
+    join_parts=False,
+    progress=None,
+    cancel=None,
+    deduplicate_buildings=True,
+    overlay_priority=None,
+    profile=None,
+    engine="mesh",
+    heightmap_resolution=heightmap_resolution_default,
+    pipeline=False,
+    simplify_tolerance=0.0,
+    min_feature_size=0.0,
+    point_sections=point_sections_default,
+    diagnostics=None,
+    in_memory=False,
+    face_budget=None,
+    size_budget=None,
 ):
 
-    global transformer
-
-    # Log of geometries
-    csv_file = open(output_stl_path + ".csv", mode="w", newline="")
-    csv_writer = csv.writer(csv_file, delimiter=",", lineterminator="\n")
-    csv_writer.writerow(
-        [
-            "type",
-            "subtype",
-            "class",
-            "poly_height",
-            "line_width",
-            "line_height",
-            "point_width",
-            "point_height",
-        ]
-    )
-
-    # How much to scale the model
-    scale_factor = scale_percent / 100.0    
-
-    # Use manual bounding box
-    if bbox is None:
-        raise ValueError("Manual bounding box must be provided.")
-
-    bbox_poly = box(*bbox)
-
-    # Get the EPSG code
-    epsg_code = get_utm_epsg_code(*bbox)
-    transformer = Transformer.from_crs("EPSG:4326", f"EPSG:{epsg_code}", always_xy=True)
-
-    # Get the convergence angle
-    minx, miny, maxx, maxy = bbox
-    center_lon = (minx + maxx) / 2.0
-    center_lat = (miny + maxy) / 2.0
-    convergence_angle = get_convergence_angle(center_lon, center_lat, epsg_code)
+    # Files written by this run, removed again if it fails or is cancelled, and stages
+    # running in the background with pipeline (see libs/pipeline.py)
+    csv_file = None
+    accumulator = None
+    output_paths = []
+    stages = []
+    try:
+        # Log of geometries
+        if in_memory:
+            csv_writer = result_module.FeatureLog()
+        else:
+            output_paths.append(output_stl_path + ".csv")
+            csv_file = open(output_stl_path + ".csv", mode="w", newline="")
+            csv_writer = csv.writer(csv_file, delimiter=",", lineterminator="\n")
+        csv_writer.writerow(
+            [
+                "type",
+                "subtype",
+                "class",
+                "poly_height",
+                "line_width",
+                "line_height",
+                "point_width",
+                "point_height",
+            ]
+        )
 
-    all_vertices = []
-    all_faces = []
-    vertex_offset = 0
+        # Defaults used by the dimension rules (see libs/rules.py), which can be replaced
+        # by passing other dimension_rules
+        dimension_parameters = {
+            "polygon_height_default": polygon_height_default,
+            "polygon_height_flat_default": polygon_height_flat_default,
+            "line_width_default": line_width_default,
+            "line_height_default": line_height_default,
+            "point_width_default": point_width_default,
+            "point_height_default": point_height_default,
+        }
+
+        # How much to scale the model
+        scale_factor = scale_percent / 100.0    
+
+        if output_format not in output_formats:
+            raise ValueError(f"Unsupported output format: {output_format}")
+
+        if engine not in engines:
+            raise ValueError(f"Unsupported engine: {engine}")
+
+        # Use manual bounding box
+        if bbox is None:
+            raise ValueError("Manual bounding box must be provided.")
+
+        # Transformers, datasets and parsed files are reused from the session, or
+        # transformers and datasets from the default session of the process
+        if session is None:
+            session = session_module.default_session()
+
+        # Repaired and skipped geometries, summarized at the end (see libs/repair.py)
+        if diagnostics is None:
+            diagnostics = repair.Diagnostics()
+
+        bbox_poly = shapely_geometry.box(*bbox)
+
+        # Get the EPSG code
+        epsg_code = get_utm_epsg_code(*bbox)
+        transformer = session.transformer(epsg_code)
+
+        # Get the convergence angle
+        minx, miny, maxx, maxy = bbox
+        center_lon = (minx + maxx) / 2.0
+        center_lat = (miny + maxy) / 2.0
+        convergence_angle = get_convergence_angle(center_lon, center_lat, epsg_code)
+
+        # Meshes are accumulated relative to the projected center of the bounding box
+        projected_bbox_poly = project_geom(bbox_poly, transformer)
+        centroid = projected_bbox_poly.centroid
+        accumulator = mesh.MeshAccumulator(
+            origin=(centroid.x, centroid.y, 0.0), buffer_dir=mesh_buffer_dir
+        )
 
-    # Download or load cached geojson for each type
-    geojson_files = []
-    for type_name in overture_types:
-        geojson_file = get_overture_geojson_direct(type_name, bbox, output_stl_path)
-        if geojson_file is not None:
-            geojson_files.append(geojson_file)
-
-    for input_geojson_path in geojson_files:
-        print("Processing " + input_geojson_path)
-        with open(input_geojson_path, "r") as f:
-            gj = geojson.load(f)
-
-        # Process each feature
-        for feature in gj["features"]:
-            # Shape
-            geom = shape(feature["geometry"])
-
-            # Clip geometry to bounding box
-            clipped_geom = geom.intersection(bbox_poly)
-            if clipped_geom.is_empty:
-                continue  # Skip features outside the area
-
-            # Properties
-            props = feature.get("properties", {})
-            props_subtype = props.get("subtype", "").lower()
-            props_class = props.get("class", "").lower()
-
-            # Start and compare values for polygon dimensions
-            if props_subtype in polygon_flat:
-                polygon_height = polygon_height_flat_default
-                polygon_height_compare = polygon_height_flat_default
-            else:
-                polygon_height = polygon_height_default
-                polygon_height_compare = polygon_height_default
-
-            # Height mode other than 'f': explicit height if it exists
-            if polygon_height_mode != "f":
-                height_gen = props.get("height")
-                height_m = props.get("height_m")
-                height_ft = props.get("height_ft")
-                height_floors = props.get("num_floors")
-                if height_gen is not None:
-                    polygon_height = float(height_gen)
-                elif height_m is not None:
-                    polygon_height = float(height_m)
-                elif height_ft is not None:
-                    polygon_height = float(height_ft) * 0.3048
-                elif height_floors is not None:
-                    polygon_height = float(height_floors) * 3.0 + 3.0
-
-                # Height mode 'l': adjust if explicit height too low
-                if polygon_height_mode == "l":
-                    if polygon_height < polygon_height_compare:
-                        polygon_height = polygon_height_compare
-
-                # Height mode 'h': adjust if explicit height too high
-                if polygon_height_mode == "h":
-                    if polygon_height > polygon_height_compare:
-                        polygon_height = polygon_height_compare
-
-            polygon_height = (
-                polygon_height_flat_default
-                if polygon_height < polygon_height_flat_default
-                else polygon_height
+        # Download or load cached geojson for each type, all before processing them,
+        # or in the background while processing the ones already fetched
+        if pipeline:
+            parsed = pipeline_module.threaded(
+                parse_types(
+                    fetch_types(overture_types, bbox, output_stl_path, session, scan_options, None, cancel),
+                    session,
+                ),
+                pipeline_module.file_queue_size,
+                cancel=cancel,
             )
-
-            # Start values for line dimensions
-            line_height = line_height_default
-            if props_subtype == "road" and props_class in road_widths:
-                line_width = road_widths[props_class]
-                if line_width < line_width_default:
-                    line_width = line_width_default
-            else:
-                line_width = line_width_default
-
-            # Start values for point dimensions
-            if f"{props_subtype}/{props_class}" in point_relevant:
-                point_width = point_width_default
-                point_height = point_height_default
-            else:
-                point_width = 0.0
-                point_height = 0.0
-
-            csv_writer.writerow(
-                [
-                    clipped_geom.geom_type,
-                    props_subtype,
-                    props_class,
-                    polygon_height,
-                    line_width,
-                    line_height,
-                    point_width,
-                    point_height,
-                ]
+            stages.append(parsed)
+            type_count = len(overture_types)
+        else:
+            fetched = list(
+                fetch_types(overture_types, bbox, output_stl_path, session, scan_options, progress, cancel)
             )
+            parsed = parse_types(fetched, session)
+            type_count = len(fetched)
 
-            # Use clipped geometry for further processing
-            type = clipped_geom.geom_type
-            match type:
-                # Polygon
-                case "Polygon" | "MultiPolygon":
-                    if polygon_height > 0.0:
-                        if type == "Polygon":
-                            geoms = [clipped_geom]
-                        else:
-                            geoms = clipped_geom.geoms
-
-                        for poly in geoms:
-                            vertices, faces = polygon_to_extruded_mesh(
-                                poly, polygon_height
-                            )
-                            if vertices is not None and faces is not None:
-                                faces += vertex_offset
-                                all_vertices.append(vertices)
-                                all_faces.append(faces)
-                                vertex_offset += len(vertices)
-
-                # Line string
-                case "LineString" | "MultiLineString":
-                    if line_width > 0.0 and line_height > 0.0:
-                        if type == "LineString":
-                            geoms = [clipped_geom]
-                        else:
-                            geoms = clipped_geom.geoms
-
-                        for line in geoms:
-                            vertices, faces = line_to_extruded_mesh(
-                                line, line_width, line_height
-                            )
-                            if vertices is not None and faces is not None:
-                                faces += vertex_offset
-                                all_vertices.append(vertices)
-                                all_faces.append(faces)
-                                vertex_offset += len(vertices)
-
-                # Point
-                case "Point" | "MultiPoint":
-                    if point_width > 0.0 and point_height > 0.0:
-                        if type == "Point":
-                            geoms = [clipped_geom]
-                        else:
-                            geoms = clipped_geom.geoms
-
-                        for point in geoms:
-                            vertices, faces = point_to_cylinder_mesh(
-                                point, point_width, point_height
-                            )
-                            if vertices is not None and faces is not None:
-                                faces += vertex_offset
-                                all_vertices.append(vertices)
-                                all_faces.append(faces)
-                                vertex_offset += len(vertices)
-
-                case "Point":
-                    # TODO TBA
-                    pass
-
-                case "GeometryCollection":
-                    # TODO TBA
-                    pass
-
-                case _:
-                    print(
-                        f"Skipping unsupported geometry type: " + clipped_geom.geom_type
+        # Keep either the footprint or the parts of buildings that have both
+        if deduplicate_buildings:
+            parsed = deduplicate_types(parsed, prefer_parts=polygon_height_mode != "f")
+        else:
+            parsed = ((type_name, path, features, None) for type_name, path, features in parsed)
+
+        # With an overlay priority (types from highest priority, or empty for the
+        # default order in libs/overlay.py), footprints are collected as (type,
+        # height, projected polygon) and cut so they don't overlap before extrusion.
+        # The heightmap engine collects them to rasterize them instead.
+        footprints = [] if overlay_priority is not None or engine == "heightmap" else None
+
+        # With a budget of faces, or of bytes of output, the level of detail of each
+        # type is chosen to fit it (see libs/budget.py), which needs all types parsed,
+        # clipped and projected first. The prepared features are then meshed as they
+        # are, with less detail where needed.
+        max_faces = face_budget
+        if size_budget is not None:
+            size_faces = budget.faces_for_size(size_budget, output_format)
+            max_faces = size_faces if max_faces is None else min(max_faces, size_faces)
+        type_levels = {}
+        geometries = {}
+        prepared_types = {}
+        if max_faces is not None and engine == "mesh":
+            parsed = list(parsed)
+            for type_name, _, features, keep in parsed:
+                prepared_types[type_name] = list(
+                    prepare_features(
+                        features,
+                        keep,
+                        bbox_poly,
+                        session,
+                        epsg_code,
+                        diagnostics=diagnostics,
+                        batch_size=1 if profile is not None else prepare_batch_size,
                     )
+                )
+                dimensions = rules.resolve_dimensions(
+                    rules.feature_columns(features), dimension_parameters, polygon_height_mode, dimension_rules
+                )
+                geometries[type_name] = budget.type_geometry(prepared_types[type_name], dimensions)
+            has_base = base_height > 0 and base_margin >= 0
+            type_levels, estimated_faces = budget.plan(
+                geometries, max_faces, scale_factor, budget.base_faces if has_base else 0
+            )
+            print(
+                f"Levels of detail for a budget of {max_faces} faces: "
+                + ", ".join(
+                    f"{type_name} {'left out' if level == budget.left_out else level}"
+                    for type_name, level in type_levels.items()
+                )
+                + f", about {estimated_faces} faces."
+            )
+            if estimated_faces > max_faces:
+                print("Even the coarsest levels of detail don't fit the budget.")
+
+        for file_index, (type_name, input_geojson_path, features, keep) in enumerate(parsed):
+            print("Processing " + input_geojson_path)
+            progress_counters = {"type": type_name, "index": file_index, "types": type_count}
+            progress_module.report(
+                progress, cancel, "process", done=0, total=len(features), **progress_counters
+            )
 
-    csv_file.close()
-
-    if not all_vertices:
-        raise ValueError("No polygon features found in the GeoJSON.")
-
-    # Concatenate all vertices and faces
-    model_vertices = np.vstack(all_vertices)
-    model_faces = np.vstack(all_faces)
-
-    # Rotate mesh so that north is up in STL
-    print(f"Rotating mesh by {-convergence_angle:.6f} degrees to align north-up.")
-    model_vertices = rotate_vertices(model_vertices, -convergence_angle)
-
-    # Apply scaling before adding the base
-    if scale_factor != 1.0:
-        print(f"Scaling model by {scale_percent}% (factor {scale_factor})")
-        model_vertices *= scale_factor
-
-    # Add base under the map
-    if base_height > 0 and base_margin >= 0:
-        print(f"Adding base with height: {base_height} mm and margin: {base_margin} mm")
-        projected_bbox_poly = project_geom(bbox_poly)
-        centroid = projected_bbox_poly.centroid
+            # Resolve the dimensions of all features of the file at once
+            columns = rules.feature_columns(features)
+            dimensions = rules.resolve_dimensions(
+                columns, dimension_parameters, polygon_height_mode, dimension_rules
+            )
+            subtypes = columns["subtype"].tolist()
+            classes = columns["class"].tolist()
+            polygon_heights = dimensions["polygon_height"].tolist()
+            line_widths = dimensions["line_width"].tolist()
+            line_heights = dimensions["line_height"].tolist()
+            point_widths = dimensions["point_width"].tolist()
+            point_heights = dimensions["point_height"].tolist()
+
+            # Level of detail of the type in meters, coarser if needed for the budget
+            type_simplify_tolerance = simplify_tolerance / scale_factor
+            type_min_feature_size = min_feature_size / scale_factor
+            type_point_sections = point_sections
+            if type_name in type_levels:
+                detail = geometries[type_name].detail(type_levels[type_name], scale_factor)
+                if detail is None:
+                    print(f"Leaving out {type_name} to fit the budget.")
+                    prepared_types.pop(type_name, None)
+                    continue
+                tolerance, size, sections = detail
+                type_simplify_tolerance = max(type_simplify_tolerance, tolerance)
+                type_min_feature_size = max(type_min_feature_size, size)
+                type_point_sections = min(type_point_sections, sections)
+
+            # Clipped and projected features, in the background with pipeline
+            if type_name in prepared_types:
+                prepared = reduce_prepared(
+                    prepared_types.pop(type_name),
+                    type_simplify_tolerance,
+                    type_min_feature_size**2,
+                    type_min_feature_size,
+                )
+            else:
+                prepared = prepare_features(
+                    features,
+                    keep,
+                    bbox_poly,
+                    session,
+                    epsg_code,
+                    type_simplify_tolerance,
+                    type_min_feature_size**2,
+                    type_min_feature_size,
+                    diagnostics,
+                    # Profiles time features one by one
+                    1 if profile is not None else prepare_batch_size,
+                )
+            if pipeline:
+                prepared = pipeline_module.threaded(
+                    prepared,
+                    pipeline_module.feature_queue_size,
+                    pipeline_module.feature_batch_size,
+                    cancel,
+                )
+                stages.append(prepared)
+
+            # Process each feature
+            next_report = progress_module.feature_interval
+            for i, clipped_type, projected_geom, clip_seconds, project_seconds in prepared:
+                if i >= next_report:
+                    progress_module.report(
+                        progress, cancel, "process", done=i, total=len(features), **progress_counters
+                    )
+                    next_report = i - i % progress_module.feature_interval + progress_module.feature_interval
+
+                # Dimensions
+                props_subtype = subtypes[i]
+                props_class = classes[i]
+                polygon_height = polygon_heights[i]
+                line_width = line_widths[i]
+                line_height = line_heights[i]
+                point_width = point_widths[i]
+                point_height = point_heights[i]
+
+                csv_writer.writerow(
+                    [
+                        clipped_type,
+                        props_subtype,
+                        props_class,
+                        polygon_height,
+                        line_width,
+                        line_height,
+                        point_width,
+                        point_height,
+                    ]
+                )
 
-        # Compensate that height and margin should be considered to be in mm, not m
-        base_height_adjusted = base_height / scale_factor
-        base_margin_adjusted = base_margin / scale_factor
+                extrude_start = time.perf_counter()
+
+                # Costs of the feature, extrusion is added when done
+                profile_row = None
+                if profile is not None:
+                    feature = features[i]
+                    profile_row = profile.record(
+                        (feature.get("properties") or {}).get("id") or feature.get("id"),
+                        type_name,
+                        props_subtype,
+                        props_class,
+                        clip=clip_seconds,
+                        project=project_seconds,
+                    )
+                    vertex_count = accumulator.vertex_count
+                    face_count = accumulator.face_count
+
+                type = projected_geom.geom_type
+                match type:
+                    # Polygon
+                    case "Polygon" | "MultiPolygon":
+                        if polygon_height > 0.0:
+                            if type == "Polygon":
+                                geoms = [projected_geom]
+                            else:
+                                geoms = projected_geom.geoms
+
+                            for poly in geoms:
+                                if footprints is not None:
+                                    footprints.append((type_name, polygon_height, poly, profile_row))
+                                    continue
+                                vertices, faces = polygon_to_extruded_mesh(
+                                    poly, polygon_height, None
+                                )
+                                if vertices is not None and faces is not None:
+                                    accumulator.add(vertices, faces)
+
+                    # Line string
+                    case "LineString" | "MultiLineString":
+                        if line_width > 0.0 and line_height > 0.0:
+                            if type == "LineString":
+                                geoms = [projected_geom]
+                            else:
+                                geoms = projected_geom.geoms
+
+                            for line in geoms:
+                                if footprints is not None:
+                                    footprint = line_to_footprint(line, line_width, None, diagnostics)
+                                    if footprint is not None:
+                                        footprints.append((type_name, line_height, footprint, profile_row))
+                                    continue
+                                vertices, faces = line_to_extruded_mesh(
+                                    line, line_width, line_height, None, diagnostics
+                                )
+                                if vertices is not None and faces is not None:
+                                    accumulator.add(vertices, faces)
+
+                    # Point
+                    case "Point" | "MultiPoint":
+                        if point_width > 0.0 and point_height > 0.0:
+                            if type == "Point":
+                                geoms = [projected_geom]
+                            else:
+                                geoms = projected_geom.geoms
+
+                            for point in geoms:
+                                if footprints is not None:
+                                    footprints.append(
+                                        (
+                                            type_name,
+                                            point_height,
+                                            point_to_footprint(point, point_width, None, type_point_sections),
+                                            profile_row,
+                                        )
+                                    )
+                                    continue
+                                vertices, faces = point_to_cylinder_mesh(
+                                    point, point_width, point_height, None, type_point_sections
+                                )
+                                if vertices is not None and faces is not None:
+                                    accumulator.add(vertices, faces)
+
+                    case "Point":
+                        # TODO TBA
+                        pass
+
+                    case "GeometryCollection":
+                        # TODO TBA
+                        pass
+
+                    case _:
+                        diagnostics.record("geometry", f"skipped unsupported type {clipped_type}")
+
+                if profile is not None:
+                    profile.add(
+                        profile_row,
+                        extrude=time.perf_counter() - extrude_start,
+                        vertices=accumulator.vertex_count - vertex_count,
+                        faces=accumulator.face_count - face_count,
+                    )
 
-        # Rotate projected bbox by -convergence_angle (to match model)
-        rotated_bbox_poly = shapely_rotate(
-            projected_bbox_poly,
-            -convergence_angle,
-            origin=(centroid.x, centroid.y),
-            use_radians=False,
-        )
+            # The background stage has finished with the file
+            if pipeline:
+                stages.remove(prepared)
 
-        # Get bounds, expand by margin
-        min_x, min_y, max_x, max_y = rotated_bbox_poly.bounds
-        min_x -= base_margin_adjusted
-        min_y -= base_margin_adjusted
-        max_x += base_margin_adjusted
-        max_y += base_margin_adjusted
-
-        # Create base polygon in rotated frame
-        base_poly_rotated = box(min_x, min_y, max_x, max_y)
-
-        # Rotate base polygon BACK by +convergence_angle to projected frame
-        base_poly_projected = shapely_rotate(
-            base_poly_rotated,
-            convergence_angle,
-            origin=(centroid.x, centroid.y),
-            use_radians=False,
-        )
+        if csv_file is not None:
+            csv_file.close()
 
-        # Extrude base polygon
-        try:
-            base_mesh_obj = trimesh.creation.extrude_polygon(
-                base_poly_projected, base_height_adjusted
+        # Rasterize the footprints into one heightmap on the base
+        if engine == "heightmap" and footprints:
+            # The grid is aligned with the base in the rotated frame of the model, with
+            # samples far enough apart for the budget
+            bounds = base_bounds(
+                projected_bbox_poly, centroid, convergence_angle, max(base_margin, 0.0) / scale_factor
             )
-            if (
-                base_mesh_obj
-                and base_mesh_obj.vertices.shape[0] > 0
-                and base_mesh_obj.faces.shape[0] > 0
-            ):
-                base_vertices_raw = base_mesh_obj.vertices
-                base_faces_raw = base_mesh_obj.faces
-
-                # Shift base so its top is at Z=0
-                base_vertices_transformed = base_vertices_raw.copy()
-                base_vertices_transformed[:, 2] -= base_height_adjusted
-
-                # Rotate base mesh by -convergence_angle (same as model)
-                base_vertices_rotated = rotate_vertices(
-                    base_vertices_transformed, -convergence_angle
+            if not heightmap_resolution:
+                heightmap_resolution = max(
+                    heightmap_resolution_min,
+                    budget.heightmap_resolution(
+                        bounds, max_faces if max_faces is not None else heightmap_faces_default, scale_factor
+                    ),
                 )
-
-                # Apply scaling to base as well
-                if scale_factor != 1.0:
-                    base_vertices_rotated *= scale_factor
-
-                # Combine
-                base_faces_offset = base_faces_raw + len(model_vertices)
-                final_vertices = np.vstack([model_vertices, base_vertices_rotated])
-                final_faces = np.vstack([model_faces, base_faces_offset])
-                print(
-                    f"Base added. Vertices before base: {len(model_vertices)}, Vertices after base: {len(final_vertices)}"
+                print(f"Heightmap resolution of {heightmap_resolution:.3f} mm chosen for the size of the print.")
+            elif max_faces is not None:
+                heightmap_resolution = max(
+                    heightmap_resolution, budget.heightmap_resolution(bounds, max_faces, scale_factor)
                 )
-            else:
+            cell = heightmap.capped_cell(bounds, heightmap_resolution / scale_factor)
+            if cell > heightmap_resolution / scale_factor:
                 print(
-                    "Warning: Base mesh extrusion resulted in an empty or invalid mesh. Skipping base."
+                    f"Warning: heightmap resolution coarsened from {heightmap_resolution} mm to "
+                    f"{cell * scale_factor:.3f} mm to stay within {heightmap.samples_max} samples."
                 )
-                final_vertices = model_vertices
-                final_faces = model_faces
-        except Exception as e:
-            print(f"Error creating base: {e}. Skipping base.")
-            final_vertices = model_vertices
-            final_faces = model_faces
-    else:
-        final_vertices = model_vertices
-        final_faces = model_faces
-
-    if final_vertices.shape[0] == 0 or final_faces.shape[0] == 0:
-        raise RuntimeError("No geometry generated for STL export.")
+            thickness = base_height / scale_factor if base_height > 0 else cell
+            rotated_footprints = [
+                shapely_affinity.rotate(
+                    footprint, -convergence_angle, origin=(centroid.x, centroid.y), use_radians=False
+                )
+                for _, _, footprint, _ in footprints
+            ]
+            grid = heightmap.rasterize(
+                rotated_footprints, [height for _, height, _, _ in footprints], bounds, cell
+            )
+            vertices, faces = heightmap.grid_mesh(grid, bounds, -thickness, origin=(centroid.x, centroid.y))
+            print(f"Heightmap of {grid.shape[1]} x {grid.shape[0]} samples at most {cell:.3f} m apart.")
+
+            # Back to the projected frame, as the model is rotated north-up below
+            angle = np.deg2rad(convergence_angle)
+            x = vertices[:, 0].copy()
+            y = vertices[:, 1].copy()
+            vertices[:, 0] = x * np.cos(angle) - y * np.sin(angle)
+            vertices[:, 1] = x * np.sin(angle) + y * np.cos(angle)
+            accumulator.add(vertices, faces, relative=True)
+
+        # Cut overlapping footprints by those of higher priority, and extrude them
+        elif footprints:
+            layers, heights, polygons, profile_rows = zip(*footprints)
+            # The gap must survive welding once the model is scaled
+            gap = overlay.gap_default
+            if weld_tolerance:
+                gap = max(gap, 2.0 * weld_tolerance / scale_factor)
+            parts, part_index, cut_count = overlay.resolve_overlaps(
+                layers, heights, polygons, overlay_priority or None, gap=gap
+            )
+            print(
+                f"Overlay cut {cut_count} of {len(footprints)} footprints into {len(parts)} polygons."
+            )
+            for part, index in zip(parts, part_index.tolist()):
+                extrude_start = time.perf_counter()
+                vertices, faces = footprint_to_extruded_mesh(part, heights[index])
+                if vertices is not None and faces is not None:
+                    accumulator.add(vertices, faces)
+                    if profile is not None:
+                        profile.add(
+                            profile_rows[index],
+                            extrude=time.perf_counter() - extrude_start,
+                            vertices=len(vertices),
+                            faces=len(faces),
+                        )
+
+        if accumulator.vertex_count == 0:
+            raise ValueError("No polygon features found in the GeoJSON.")
+
+        model_vertex_count = accumulator.vertex_count
+        progress_module.report(progress, cancel, "assemble")
+
+        # Add base under the map, which the heightmap already has
+        if engine != "heightmap" and base_height > 0 and base_margin >= 0:
+            print(f"Adding base with height: {base_height} mm and margin: {base_margin} mm")
+
+            # Compensate that height and margin should be considered to be in mm, not m
+            base_height_adjusted = base_height / scale_factor
+            base_margin_adjusted = base_margin / scale_factor
+
+            # Bounds in the rotated frame of the model, expanded by margin
+            min_x, min_y, max_x, max_y = base_bounds(
+                projected_bbox_poly, centroid, convergence_angle, base_margin_adjusted
+            )
 
-    print(
-        f"Total vertices: {final_vertices.shape[0]}, Total faces: {final_faces.shape[0]}"
-    )
+            # Create base polygon in rotated frame
+            base_poly_rotated = shapely_geometry.box(min_x, min_y, max_x, max_y)
 
-    # Create mesh
-    mesh_obj = trimesh.Trimesh(
-        vertices=final_vertices, faces=final_faces, process=False
-    )
+            # Rotate base polygon BACK by +convergence_angle to projected frame
+            base_poly_projected = shapely_affinity.rotate(
+                base_poly_rotated,
+                convergence_angle,
+                origin=(centroid.x, centroid.y),
+                use_radians=False,
+            )
 
-    # Validate mesh
-    print("Checking if mesh is watertight...")
-    if not mesh_obj.is_watertight:
-        print("Mesh is not watertight. Attempting to fill holes...")
-        mesh_obj.fill_holes()
-        if not mesh_obj.is_watertight:
-            print("Failed to make mesh watertight. Proceeding with current mesh.")
-        else:
-            print("Mesh successfully filled to be watertight.")
-    else:
-        print("Mesh is watertight.")
+            # Extrude base polygon
+            try:
+                base_mesh_obj = trimesh.creation.extrude_polygon(
+                    base_poly_projected, base_height_adjusted
+                )
+                if (
+                    base_mesh_obj
+                    and base_mesh_obj.vertices.shape[0] > 0
+                    and base_mesh_obj.faces.shape[0] > 0
+                ):
+                    # Shift base so its top is at Z=0. It's then rotated and scaled
+                    # together with the model below.
+                    base_vertices = base_mesh_obj.vertices.copy()
+                    base_vertices[:, 2] -= base_height_adjusted
+                    accumulator.add(base_vertices, base_mesh_obj.faces)
+                    print(
+                        f"Base added. Vertices before base: {model_vertex_count}, Vertices after base: {accumulator.vertex_count}"
+                    )
+                else:
+                    print(
+                        "Warning: Base mesh extrusion resulted in an empty or invalid mesh. Skipping base."
+                    )
+            except Exception as e:
+                print(f"Error creating base: {e}. Skipping base.")
+
+        # Rotate mesh so that north is up in STL
+        print(f"Rotating mesh by {-convergence_angle:.6f} degrees to align north-up.")
+        accumulator.rotate_z(-convergence_angle)
+
+        # Apply scaling
+        if scale_factor != 1.0:
+            print(f"Scaling model by {scale_percent}% (factor {scale_factor})")
+            accumulator.scale(scale_factor)
+
+        final_vertices = accumulator.vertices
+        final_faces = accumulator.faces
+
+        # Merge coincident vertices of touching parts and the base, and drop
+        # duplicate and degenerate faces. With join_parts, the walls between
+        # touching parts are also removed so they become one closed shell, which
+        # adds faces, as the parts are cut out of the top of the base.
+        if weld_tolerance:
+            vertex_count = final_vertices.shape[0]
+            face_count = final_faces.shape[0]
+            final_vertices, final_faces = accumulator.weld(weld_tolerance, join_parts)
+            print(
+                f"Welding merged {vertex_count - final_vertices.shape[0]} vertices, "
+                f"{face_count} faces became {final_faces.shape[0]}."
+            )
+            # The welded arrays are copies, so the buffers are no longer needed
+            accumulator.close()
 
-    # Check and fix normals
-    if not mesh_obj.is_winding_consistent:
-        print("Fixing mesh normals for consistency...")
-        mesh_obj.fix_normals()
+        if final_vertices.shape[0] == 0 or final_faces.shape[0] == 0:
+            raise RuntimeError("No geometry generated for STL export.")
 
-    # Export to STL
-    print(f"Exporting mesh...")
-    mesh_obj.export(output_stl_path + ".stl")
-    print("Done.")
+        print(
+            f"Total vertices: {final_vertices.shape[0]}, Total faces: {final_faces.shape[0]}"
+        )
+        if max_faces is not None:
+            print(f"{final_faces.shape[0]} faces of a budget of {max_faces}.")
+
+        # Validate mesh on the compact buffers
+        print("Checking if mesh is watertight...")
+        watertight, winding_consistent = mesh.check_edges(final_faces)
+        if watertight:
+            print("Mesh is watertight.")
+
+        # A trimesh is only made to repair the mesh, or to export STL or keep the
+        # model in memory. 3MF and PLY are otherwise written straight from the
+        # compact buffers.
+        mesh_obj = None
+        if in_memory or output_format == "stl" or not (watertight and winding_consistent):
+            # Widened to the float64 vertices and int64 faces of trimesh. The
+            # compact buffers are released before the mesh is repaired and
+            # exported, so the full model is not held twice from here on.
+            mesh_vertices = np.asarray(final_vertices, dtype=np.float64)
+            mesh_faces = np.asarray(final_faces, dtype=np.int64)
+            final_vertices = final_faces = None
+            accumulator.close()
+            mesh_obj = trimesh.Trimesh(vertices=mesh_vertices, faces=mesh_faces, process=False)
+            del mesh_vertices, mesh_faces
+
+            if not watertight:
+                print("Mesh is not watertight. Attempting to fill holes...")
+                mesh_obj.fill_holes()
+                if not mesh_obj.is_watertight:
+                    print("Failed to make mesh watertight. Proceeding with current mesh.")
+                else:
+                    print("Mesh successfully filled to be watertight.")
+
+            # Check and fix normals
+            if not mesh_obj.is_winding_consistent:
+                print("Fixing mesh normals for consistency...")
+                mesh_obj.fix_normals()
+            final_vertices, final_faces = mesh_obj.vertices, mesh_obj.faces
+
+        # Export to STL, or an indexed format that stores each vertex once, unless
+        # kept in memory to be serialized by the caller. The trimesh is returned
+        # when there is one.
+        progress_module.report(progress, cancel, "export")
+        if in_memory:
+            result = result_module.ModelResult(mesh_obj, csv_writer.table(), output_format)
+        else:
+            output_path = f"{output_stl_path}.{output_format}"
+            output_paths.append(output_path)
+            print(f"Exporting mesh to '{output_path}'...")
+            if output_format == "3mf":
+                export.write_3mf(output_path, final_vertices, final_faces)
+            elif output_format == "ply":
+                export.write_ply(output_path, final_vertices, final_faces)
+            else:
+                mesh_obj.export(output_path)
+            if size_budget is not None:
+                print(f"{os.path.getsize(output_path)} bytes of a budget of {size_budget}.")
+            result = mesh_obj
+        accumulator.close()
+        print(diagnostics.report())
+        if profile is not None:
+            print(profile.report())
+        print("Done.")
+        progress_module.report(progress, None, "done")
+        return result
+    except BaseException:
+        # Stop background stages, and remove partial outputs when cancelled or failing
+        for stage in stages:
+            stage.close()
+        if csv_file is not None:
+            csv_file.close()
+        if accumulator is not None:
+            accumulator.close()
+        for path in output_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        raise
@@ -1,3 +1,10 @@
-from .core import record_batch_reader, get_all_overture_types
-
 from .Overture2STL import bbox_size_meters, map_types_default, map_types_all, overture_to_stl
+
+
+# The pyarrow-based functions are only imported when used, to keep startup fast
+def __getattr__(name):
+    if name in ("record_batch_reader", "get_all_overture_types"):
+        from . import core
+
+        return getattr(core, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
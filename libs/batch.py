@@ -0,0 +1,157 @@
+# Non-interactive generation of several models from a manifest.
+#
+# A manifest is a CSV file with a header row, or a JSON file with a list of
+# objects. Each row/object is one job, with keys named like the parameters of
+# overture_to_stl. bbox and output_stl_path are required; the other parameters
+# fall back to the defaults of overture_to_stl. In CSV files bbox is given as a
+# quoted "west,south,east,north" string and overture_types (and overlay_priority)
+# are separated by semicolons or spaces. dimension_rules refers to a JSON file with
+# the rules, and scan_options is a JSON object, e.g. "{""batch_size"": 65536}".
+
+import csv
+import inspect
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from libs.Overture2STL import map_types_default, overture_to_stl
+from libs.session import Session
+
+# Parameters that can't be given in a manifest, as they are objects or callables,
+# or would keep the model from being written
+manifest_excluded = ["session", "profile", "diagnostics", "progress", "cancel", "in_memory"]
+
+# Session and limits of a worker process
+_worker_session = None
+_worker_limits = None
+
+
+# Read the jobs of a manifest file as dictionaries of raw values
+def read_manifest(path):
+    if os.path.splitext(path)[1].lower() == ".json":
+        with open(path, "r") as f:
+            jobs = json.load(f)
+        if isinstance(jobs, dict):
+            jobs = jobs.get("jobs", [])
+    else:
+        with open(path, "r", newline="") as f:
+            jobs = [
+                {k.strip(): v.strip() for k, v in row.items() if k and v and v.strip()}
+                for row in csv.DictReader(f)
+            ]
+    return [job_parameters(job, i) for i, job in enumerate(jobs)]
+
+
+# Convert the raw values of a job to parameters for overture_to_stl
+def job_parameters(job, index=0):
+    defaults = {
+        name: parameter.default
+        for name, parameter in inspect.signature(overture_to_stl).parameters.items()
+        if name not in manifest_excluded
+    }
+
+    parameters = {}
+    for name, value in job.items():
+        if name not in defaults:
+            raise ValueError(f"Job {index + 1}: unknown parameter '{name}'.")
+
+        if name == "bbox":
+            if isinstance(value, str):
+                value = value.split(",")
+            value = [round(float(x), 6) for x in value]
+            if len(value) != 4:
+                raise ValueError(f"Job {index + 1}: bbox must have four values.")
+        elif name in ["overture_types", "overlay_priority"]:
+            if isinstance(value, str):
+                value = [t for t in re.split(r"[;,\s]+", value) if t]
+        elif name in ["face_budget", "size_budget"]:
+            if value is not None:
+                value = int(float(value))
+        elif isinstance(defaults[name], bool):
+            if isinstance(value, str):
+                value = value.lower() in ["1", "true", "yes", "y"]
+        elif isinstance(defaults[name], float):
+            value = float(value)
+        elif isinstance(defaults[name], int):
+            value = int(value)
+        elif isinstance(defaults[name], str):
+            value = str(value)
+        elif name == "dimension_rules" and isinstance(value, str):
+            # A CSV manifest refers to a JSON file with the rules
+            with open(value, "r") as f:
+                value = json.load(f)
+        elif name == "scan_options":
+            # A CSV manifest gives the options as a JSON object
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError as e:
+                    raise ValueError(f"Job {index + 1}: scan_options is not valid JSON: {e}")
+            if not isinstance(value, dict):
+                raise ValueError(f"Job {index + 1}: scan_options must be an object.")
+        parameters[name] = value
+
+    for name in ["bbox", "output_stl_path"]:
+        if not parameters.get(name):
+            raise ValueError(f"Job {index + 1}: missing '{name}'.")
+
+    return parameters
+
+
+# Run a single job with the given session, returning the error message if it failed.
+# With limits (keyword arguments of libs.estimate.check_limits), a job whose
+# estimated cost exceeds them is rejected without running it.
+def run_job(parameters, session, limits=None):
+    start = time.perf_counter()
+    try:
+        error = None
+        if limits:
+            from libs import estimate
+
+            cost = estimate.estimate(
+                parameters["bbox"],
+                parameters.get("overture_types", map_types_default),
+                parameters.get("output_format", "stl"),
+                session,
+            )
+            reasons = estimate.check_limits(cost, **limits)
+            if reasons:
+                error = "rejected, estimated " + "; ".join(reasons)
+        if error is None:
+            session.generate(**parameters)
+    except Exception as e:
+        error = str(e)
+    return parameters["output_stl_path"], error, time.perf_counter() - start
+
+
+def _init_worker(storage=None, limits=None):
+    global _worker_session, _worker_limits
+    _worker_session = Session(storage=storage)
+    _worker_limits = limits
+
+
+def _run_worker_job(parameters):
+    return run_job(parameters, _worker_session, _worker_limits)
+
+
+# Run all jobs, with the given number of jobs running at the same time, and return
+# (output path, error message or None, seconds) for each job. Concurrent jobs run in
+# threads sharing one session, or in worker processes each with its own session.
+# Data is read from the given libs.core storage, or the default one. Jobs estimated
+# to exceed the limits are rejected, see run_job.
+def run_batch(jobs, concurrency=1, processes=False, storage=None, limits=None):
+    if concurrency <= 1:
+        session = Session(storage=storage)
+        return [run_job(parameters, session, limits) for parameters in jobs]
+
+    if processes:
+        with ProcessPoolExecutor(
+            max_workers=concurrency, initializer=_init_worker, initargs=(storage, limits)
+        ) as executor:
+            return list(executor.map(_run_worker_job, jobs))
+
+    session = Session(storage=storage)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda parameters: run_job(parameters, session, limits), jobs))
@@ -0,0 +1,204 @@
+# Budget of faces, adapting the level of detail of each type to a maximum number of
+# faces or output size.
+#
+# Extruding a polygon with n vertices and h holes makes 4n + 4h - 4 faces, a line
+# becomes a corridor of twice its vertices, and a point a cylinder of 4 faces per
+# section. The number of faces of a type at a level of detail can therefore be
+# counted exactly, without meshing, from its clipped and projected geometries,
+# simplified and culled like overture_to_stl does. Levels leave out a growing
+# share of the smallest features of a type, by the quantiles of their sizes, so
+# the thresholds suit any data and scale, and the level past the last leaves the
+# type out altogether. Starting at full detail, the type that saves the most faces
+# by going one level coarser is coarsened until the total fits the budget. Types
+# are only left out when all are at the coarsest level and it still doesn't fit,
+# the least important first, so the total always fits in the end, as long as the
+# budget is larger than the base. Buildings and their parts are planned together.
+# As a step can save more than needed, types are then made finer again as far as
+# the budget allows. Cuts made by an overlay add faces that aren't counted.
+
+from libs.lazy import lazy_import
+
+np = lazy_import("numpy")
+shapely = lazy_import("shapely")
+estimate = lazy_import("libs.estimate")
+overlay = lazy_import("libs.overlay")
+
+# Levels of detail, from full to coarsest: simplification tolerance in mm in the
+# printed model, share of the features of a type left out, the smallest first, and
+# sections of point cylinders
+levels = [
+    (0.0, 0.0, 24),
+    (0.05, 0.0, 16),
+    (0.1, 0.1, 12),
+    (0.25, 0.2, 8),
+    (0.5, 0.35, 6),
+    (1.0, 0.5, 4),
+    (2.0, 0.7, 3),
+    (2.0, 0.9, 3),
+]
+
+# Level that leaves a type out
+left_out = len(levels)
+
+# Faces of the base, a box
+base_faces = 12
+
+# Bytes of the header and count of a binary STL file
+stl_header_bytes = 84
+
+
+# Maximum number of faces of a model in an output format of at most size bytes.
+# Exact for STL, from the typical size of a face for indexed formats.
+def faces_for_size(size, output_format="stl"):
+    return max(int((size - stl_header_bytes) / estimate.bytes_per_face.get(output_format, 50)), 0)
+
+
+# Projected geometries of a type that will be meshed, in meters
+class TypeGeometry:
+    def __init__(self, polygons, lines, points):
+        self.polygons = polygons
+        self.lines = lines
+        self.points = points
+        # Sizes of the features, the side of a square of the same area for polygons
+        self.sizes = np.concatenate([np.sqrt(shapely.area(polygons)), shapely.length(lines)])
+        self._faces = {}
+
+    # Simplification tolerance and minimum feature size in meters and point sections
+    # of a level of detail (an index of levels) in a model scaled by scale_factor, or
+    # None for the level that leaves the type out
+    def detail(self, level, scale_factor=1.0):
+        if level >= left_out:
+            return None
+        tolerance, share, sections = levels[level]
+        min_size = 0.0
+        if share and len(self.sizes):
+            min_size = float(np.quantile(self.sizes, share))
+        return tolerance / scale_factor, min_size, sections
+
+    # Faces of the type at a level of detail in a model scaled by scale_factor
+    def faces(self, level, scale_factor=1.0):
+        from libs.Overture2STL import reduce_detail
+
+        key = (level, scale_factor)
+        if key not in self._faces:
+            detail = self.detail(level, scale_factor)
+            if detail is None:
+                self._faces[key] = 0
+                return 0
+            tolerance, min_size, sections = detail
+
+            polygons, kept = reduce_detail(self.polygons, tolerance, min_size**2)
+            parts = shapely.get_parts(polygons[kept])
+            holes = shapely.get_num_interior_rings(parts)
+            vertices = shapely.get_num_coordinates(parts) - (1 + holes)
+            faces = int((4 * vertices + 4 * holes - 4).sum())
+
+            lines, kept = reduce_detail(self.lines, tolerance, 0.0, min_size)
+            faces += int((8 * shapely.get_num_coordinates(shapely.get_parts(lines[kept])) - 4).sum())
+
+            faces += 4 * sections * self.points
+            self._faces[key] = faces
+        return self._faces[key]
+
+
+# Geometries of a type that will be meshed, from a list of the results of
+# prepare_features() and the dimensions of the features resolved by libs.rules
+def type_geometry(prepared, dimensions):
+    indices = np.array([i for i, _, _, _, _ in prepared], dtype=np.int64)
+    geoms = np.empty(len(prepared), dtype=object)
+    geoms[:] = [projected_geom for _, _, projected_geom, _, _ in prepared]
+
+    type_ids = shapely.get_type_id(geoms)
+    polygon_height = dimensions["polygon_height"][indices]
+    line_width = dimensions["line_width"][indices]
+    line_height = dimensions["line_height"][indices]
+    point_width = dimensions["point_width"][indices]
+    point_height = dimensions["point_height"][indices]
+    polygons = geoms[np.isin(type_ids, [3, 6]) & (polygon_height > 0.0)]
+    lines = geoms[np.isin(type_ids, [1, 5]) & (line_width > 0.0) & (line_height > 0.0)]
+    points = geoms[np.isin(type_ids, [0, 4]) & (point_width > 0.0) & (point_height > 0.0)]
+    return TypeGeometry(polygons, lines, int(shapely.get_num_geometries(points).sum()))
+
+
+# Groups of types planned together, at the same level of detail, so that e.g. the
+# parts of buildings aren't kept while their footprints are left out
+linked_types = [("building", "building_part")]
+
+
+# Groups of the given types, as tuples of type names
+def _groups(type_names):
+    groups = []
+    grouped = set()
+    for linked in linked_types:
+        group = tuple(type_name for type_name in linked if type_name in type_names)
+        if group:
+            groups.append(group)
+            grouped.update(group)
+    return groups + [(type_name,) for type_name in type_names if type_name not in grouped]
+
+
+# Rank of a group in the overlay priority (see libs/overlay.py), types that aren't
+# listed last
+def _priority_rank(group):
+    priority = overlay.overlay_priority_default
+    return min(priority.index(type_name) if type_name in priority else len(priority) for type_name in group)
+
+
+# Levels of detail of types ({type: TypeGeometry}) that fit max_faces together with
+# other_faces. Linked types (see linked_types) get the same level. The group that
+# saves the most faces is coarsened first, and only when every group is at the
+# coarsest level are groups left out, those of the lowest overlay priority first.
+# Returns the level of each type, left_out for those left out, and the number of
+# faces at those levels, which is more than max_faces only if other_faces alone are.
+def plan(geometries, max_faces, scale_factor=1.0, other_faces=base_faces):
+    groups = _groups(list(geometries))
+
+    def group_faces(group, level):
+        return sum(geometries[type_name].faces(level, scale_factor) for type_name in group)
+
+    chosen = {group: 0 for group in groups}
+    faces = {group: group_faces(group, 0) for group in groups}
+    while sum(faces.values()) + other_faces > max_faces:
+        candidates = [group for group in groups if chosen[group] < left_out - 1]
+        if not candidates:
+            break
+        savings = {
+            group: faces[group] - group_faces(group, chosen[group] + 1) for group in candidates
+        }
+        group = max(candidates, key=lambda candidate: savings[candidate])
+        chosen[group] += 1
+        faces[group] -= savings[group]
+
+    for group in sorted(groups, key=_priority_rank, reverse=True):
+        if sum(faces.values()) + other_faces <= max_faces:
+            break
+        chosen[group] = left_out
+        faces[group] = 0
+
+    # Use what's left of the budget for finer levels, coarsest groups first
+    for group in sorted(groups, key=lambda group: -chosen[group]):
+        while chosen[group] > 0:
+            finer = group_faces(group, chosen[group] - 1)
+            if sum(faces.values()) - faces[group] + finer + other_faces > max_faces:
+                break
+            chosen[group] -= 1
+            faces[group] = finer
+    type_levels = {type_name: chosen[group] for group in groups for type_name in group}
+    return {type_name: type_levels[type_name] for type_name in geometries}, sum(faces.values()) + other_faces
+
+
+# Heightmap resolution in mm giving at most max_faces faces for bounds in meters
+def heightmap_resolution(bounds, max_faces, scale_factor=1.0):
+    width = bounds[2] - bounds[0]
+    height = bounds[3] - bounds[1]
+
+    # The surface has at most 2 faces per cell, fewer where flat cells are merged,
+    # and walls and bottom 6 per boundary sample
+    cell = np.sqrt(2.0 * width * height / max(max_faces, 1))
+    for _ in range(8):
+        columns = np.ceil(width / cell) + 1
+        rows = np.ceil(height / cell) + 1
+        if 2 * (columns - 1) * (rows - 1) + 6 * (columns + rows) <= max_faces:
+            break
+        cell *= 1.05
+    return cell * scale_factor
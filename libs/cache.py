@@ -0,0 +1,181 @@
+# Safe writes of cached files that several threads or processes may share.
+#
+# A cached file is written to a temporary file next to it and renamed into place
+# when complete, and a sidecar file with its size, modification time and checksum
+# is written after it. Only a file whose sidecar matches its size and modification
+# time is a valid cache entry, so files left by an interrupted write, or by older
+# versions without sidecars, are fetched again. The checksum is only compared on
+# request, as reading large files on every hit is slow. A lock file per entry,
+# removed when released, makes sure only one process fetches it at a time, while
+# the others wait and then reuse the result.
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Seconds between attempts to take a lock that is held by someone else
+lock_poll_seconds = 0.1
+
+
+# Path of the sidecar file with the integrity metadata of a cached file
+def meta_path(path):
+    return path + ".meta.json"
+
+
+# Path of a temporary file to write a cached file to, unique per process and thread
+def temp_path(path):
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Whether a cached file is complete: its sidecar exists, matches its size and
+# modification time, and has the expected values of the given keys. With verify,
+# or for sidecars without a modification time, the checksum is compared as well.
+def is_valid(path, verify=False, **expected):
+    try:
+        with open(meta_path(path), "r") as f:
+            meta = json.load(f)
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return False
+    if meta.get("size") != stat.st_size:
+        return False
+    if any(meta.get(key) != value for key, value in expected.items()):
+        return False
+    if meta.get("mtime_ns") not in [None, stat.st_mtime_ns]:
+        return False
+    if verify or meta.get("mtime_ns") is None:
+        return meta.get("sha256") == _checksum(path)
+    return True
+
+
+# Metadata of a valid cached file, None if it isn't valid
+def read_meta(path, verify=False):
+    if not is_valid(path, verify):
+        return None
+    with open(meta_path(path), "r") as f:
+        return json.load(f)
+
+
+# Move a completely written temporary file into place as a cached file, with a
+# sidecar holding its size, modification time, checksum and the given values. If
+# that fails, the temporary files are removed.
+def commit(temp, path, **info):
+    meta_temp = temp_path(meta_path(path))
+    try:
+        stat = os.stat(temp)
+        meta = {**info, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": _checksum(temp)}
+        with open(meta_temp, "w") as f:
+            json.dump(meta, f)
+
+        # The old sidecar goes first, so the file is never valid with the wrong one
+        remove(meta_path(path))
+        os.replace(temp, path)
+        os.replace(meta_temp, meta_path(path))
+    except BaseException:
+        remove(temp)
+        remove(meta_temp)
+        raise
+
+
+# Remove a file if it exists
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Exclusive lock on a cached file, shared by threads and processes through a lock
+# file next to it. Waiting checks the cancel token (see libs.progress), if given.
+# The lock file is removed when released, so a waiter that then gets the lock of
+# the removed file opens the lock file again and waits for that one instead.
+class FileLock:
+    def __init__(self, path, cancel=None):
+        self.path = path + ".lock"
+        self.cancel = cancel
+        self._file = None
+
+    def acquire(self):
+        while True:
+            f = open(self.path, "a+b")
+            try:
+                while not _try_lock(f):
+                    if self.cancel is not None:
+                        self.cancel.check()
+                    time.sleep(lock_poll_seconds)
+            except BaseException:
+                f.close()
+                raise
+            if _is_current(f, self.path):
+                self._file = f
+                return
+            f.close()
+
+    def release(self):
+        if self._file is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                # Open files can't be removed on Windows, the lock file then stays
+                pass
+            _unlock(self._file)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, value, traceback):
+        self.release()
+
+
+# Whether an open lock file is still the one at its path
+def _is_current(f, path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(f.fileno())
+    return (stat.st_dev, stat.st_ino) == (opened.st_dev, opened.st_ino)
+
+
+if os.name == "nt":
+    import msvcrt
+
+    def _try_lock(f):
+        try:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+else:
+    import fcntl
+
+    # flock locks belong to the open file, so threads of a process exclude each
+    # other as well as other processes
+    def _try_lock(f):
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _unlock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -9,16 +9,10 @@ specified bounding box in a few different file formats.
 import json
 import os
 import sys
-from typing import Optional
 
-import pyarrow as pa
-import pyarrow.dataset as ds
-import pyarrow.compute as pc
-import pyarrow.fs as fs
-import pyarrow.parquet as pq
 import shapely.wkb
 
-from .core import record_batch_reader, get_all_overture_types
+from .core import record_batch_reader
 
 
 def get_writer(output_format, path, schema):
@@ -56,24 +50,32 @@ def get_writer(output_format, path, schema):
                 }
         metadata[b"geo"] = json.dumps(geo).encode("utf-8")
         schema = schema.with_metadata(metadata)
+        import pyarrow.parquet as pq
+
         writer = pq.ParquetWriter(path, schema)
     return writer
 
 
-def download(bbox, output_format, output, type_):
+def download(bbox, output_format, output, type_, dataset=None, cancel=None, **scan_options):
     if output is None:
         output = sys.stdout
 
-    reader = record_batch_reader(type_, bbox)
+    reader = record_batch_reader(type_, bbox, dataset, **scan_options)
     if reader is None:
         return
 
     with get_writer(output_format, output, schema=reader.schema) as writer:
-        copy(reader, writer)
+        copy(reader, writer, cancel)
 
 
-def copy(reader, writer):
+def copy(reader, writer, cancel=None):
+    """
+    Copy batches from reader to writer, checking the optional cancel token (see
+    libs.progress) between batches
+    """
     while True:
+        if cancel is not None:
+            cancel.check()
         try:
             batch = reader.read_next_batch()
         except StopIteration:
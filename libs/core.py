@@ -1,42 +1,574 @@
-from typing import List, Optional
+import base64
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import pyarrow as pa
 import pyarrow.compute as pc
 import pyarrow.dataset as ds
 import pyarrow.fs as fs
 
-# Allows for optional import of additional dependencies
-try:
-    import geopandas as gpd
+# geopandas is an optional dependency, and slow to import, so it's only imported
+# when geodataframe() is called
+if TYPE_CHECKING:
     from geopandas import GeoDataFrame
 
-    HAS_GEOPANDAS = True
-except ImportError:
-    HAS_GEOPANDAS = False
-    GeoDataFrame = None
+# Overture release to read, unless another one is given
+release = os.environ.get("OVERTURE2STL_RELEASE", "2025-05-21.0")
 
+# Public Overture bucket and its region
+s3_bucket = "overturemaps-us-west-2"
+s3_region = "us-west-2"
 
-def record_batch_reader(overture_type, bbox=None) -> Optional[pa.RecordBatchReader]:
+# Directory for metadata cached on disk between runs
+cache_dir = os.environ.get(
+    "OVERTURE2STL_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "overture2stl"),
+)
+
+# Seconds a file listing cached on disk is used before the files are listed again,
+# for storages that don't report when a directory changed
+listing_max_age = 7 * 24 * 60 * 60
+
+# Datasets and filesystems shared by all callers in the process. A dataset keeps
+# the Parquet metadata of its files once they have been read, so later scans of
+# the same dataset can skip files and row groups without reading footers again.
+# Datasets are opened under a lock of their own, so listing one doesn't hold up
+# opening others.
+_pool_lock = threading.Lock()
+_datasets: Dict[Tuple, ds.Dataset] = {}
+_dataset_locks: Dict[Tuple, threading.Lock] = {}
+_filesystems: Dict[Tuple, fs.FileSystem] = {}
+_storage: Optional["Storage"] = None
+
+
+class Storage:
     """
-    Return a pyarrow RecordBatchReader for the desired bounding box and s3 path
+    Where Overture data is read from: a pyarrow filesystem and the directory under
+    it that holds release/<release>/theme=<theme>/type=<type>/, the layout of the
+    Overture bucket, and the release to read.
+
+    Use Storage.s3() for the Overture bucket or an S3-compatible copy of it,
+    Storage.local() for a mirror on a local or network disk, Storage.http() for a
+    mirror served over HTTP, or pass any pyarrow filesystem to the constructor.
     """
-    path = _dataset_path(overture_type)
 
-    if bbox:
-        xmin, ymin, xmax, ymax = bbox
-        filter = (
-            (pc.field("bbox", "xmin") < xmax)
-            & (pc.field("bbox", "xmax") > xmin)
-            & (pc.field("bbox", "ymin") < ymax)
-            & (pc.field("bbox", "ymax") > ymin)
-        )
-    else:
-        filter = None
+    def __init__(
+        self,
+        filesystem: fs.FileSystem,
+        root: str,
+        release: str = release,
+        name: Optional[str] = None,
+    ):
+        self.filesystem = filesystem
+        self.root = root.rstrip("/")
+        self.release = release
+        # Identifies the source in the listing cache, together with the path
+        self.name = name or filesystem.type_name
+
+    def __repr__(self):
+        return f"Storage({self.name!r}, {self.root!r}, release={self.release!r})"
+
+    @classmethod
+    def s3(
+        cls,
+        bucket: str = s3_bucket,
+        region: str = s3_region,
+        endpoint: Optional[str] = None,
+        anonymous: bool = True,
+        release: str = release,
+    ) -> "Storage":
+        """
+        Read from an S3 bucket, by default the public Overture bucket. bucket may
+        include a prefix, and endpoint is the URL of an S3-compatible server.
+        """
+        filesystem = _s3_filesystem(region, endpoint, anonymous)
+        return cls(filesystem, bucket, release, f"s3:{endpoint or region}")
+
+    @classmethod
+    def local(cls, path: str, release: str = release) -> "Storage":
+        """
+        Read from a directory with a copy of the Overture bucket, e.g. made with
+        aws s3 sync for the releases, themes and types that are needed
+        """
+        key = ("local",)
+        with _pool_lock:
+            filesystem = _filesystems.get(key)
+            if filesystem is None:
+                filesystem = _filesystems[key] = fs.LocalFileSystem()
+        root = os.path.abspath(os.path.expanduser(path)).replace(os.sep, "/")
+        return cls(filesystem, root, release, "local")
+
+    @classmethod
+    def http(cls, url: str, release: str = release) -> "Storage":
+        """
+        Read from a copy of the Overture bucket served over HTTP. The server must
+        list directories as HTML index pages, and support range requests. Requires
+        fsspec (with aiohttp).
+        """
+        try:
+            import fsspec
+        except ImportError:
+            raise ImportError("fsspec is required to read from an HTTP mirror")
+
+        key = ("http",)
+        with _pool_lock:
+            filesystem = _filesystems.get(key)
+            if filesystem is None:
+                filesystem = fs.PyFileSystem(fs.FSSpecHandler(fsspec.filesystem("http")))
+                _filesystems[key] = filesystem
+        return cls(filesystem, url, release, "http")
+
+    @classmethod
+    def from_uri(
+        cls,
+        uri: str,
+        release: str = release,
+        region: str = s3_region,
+        endpoint: Optional[str] = None,
+    ) -> "Storage":
+        """
+        Storage for s3://bucket[/prefix], http(s)://host/path or a local directory
+        (optionally as file://path)
+        """
+        if uri.startswith("s3://"):
+            return cls.s3(uri[len("s3://") :], region, endpoint, release=release)
+        if uri.startswith(("http://", "https://")):
+            return cls.http(uri, release)
+        if uri.startswith("file://"):
+            uri = uri[len("file://") :]
+        return cls.local(uri, release)
+
+    def with_release(self, release: str) -> "Storage":
+        """
+        The same storage, reading another release
+        """
+        return Storage(self.filesystem, self.root, release, self.name)
+
+    def dataset_path(self, overture_type: str, release: Optional[str] = None) -> str:
+        """
+        Path of the files of a type, in the release of the storage unless another
+        one is given
+        """
+        return _dataset_path(overture_type, release or self.release, self.root)
+
+
+def get_storage() -> Storage:
+    """
+    Return the storage used when none is given. It's the public Overture bucket,
+    unless changed by set_storage() or the OVERTURE2STL_STORAGE environment variable
+    (a URI as taken by Storage.from_uri).
+    """
+    global _storage
+    if _storage is None:
+        uri = os.environ.get("OVERTURE2STL_STORAGE")
+        _storage = Storage.from_uri(uri) if uri else Storage.s3()
+    return _storage
+
+
+def set_storage(storage: Optional[Storage]):
+    """
+    Set the storage used when none is given, or go back to the default with None
+    """
+    global _storage
+    _storage = storage
+
+
+def open_dataset(
+    overture_type: str,
+    release: Optional[str] = None,
+    filesystem: Optional[fs.FileSystem] = None,
+    disk_cache: bool = True,
+    storage: Optional[Storage] = None,
+    pool: bool = True,
+) -> ds.Dataset:
+    """
+    Return the pooled pyarrow dataset for the given release and type
+
+    The first call for a storage, release and type lists its files, unless the
+    listing has been cached on disk by an earlier run. Later calls return the same
+    dataset. Without pool, a new dataset is opened that isn't kept in the pool, for
+    callers that keep their own, like libs.session.
+
+    Parameters
+    ----------
+    overture_type: type to open
+    release: Overture release, by default the one of the storage
+    filesystem: filesystem to read from instead of the storage, which must have the
+        layout of the Overture bucket under its root
+    disk_cache: whether to cache the file listing and schema on disk
+    storage: where to read from, by default get_storage()
+    pool: whether to share the dataset through the pool of the process
+
+    Returns
+    -------
+    ds.Dataset
+
+    """
+    if filesystem is not None:
+        storage = Storage(filesystem, s3_bucket)
+    elif storage is None:
+        storage = get_storage()
+    path = storage.dataset_path(overture_type, release)
+    if not pool:
+        return _open_unpooled(path, storage, disk_cache)
+
+    key = (storage.name, id(storage.filesystem), path)
+    with _pool_lock:
+        entry = _datasets.get(key)
+        if entry is not None:
+            return entry[0]
+        lock = _dataset_locks.setdefault(key, threading.Lock())
+
+    with lock:
+        with _pool_lock:
+            entry = _datasets.get(key)
+        if entry is not None:
+            return entry[0]
+
+        dataset = _open_unpooled(path, storage, disk_cache)
+
+        # Keep the filesystem alive as long as the entry, since its id is in the key
+        with _pool_lock:
+            _datasets[key] = (dataset, storage.filesystem)
+        return dataset
+
+
+def _open_unpooled(path: str, storage: Storage, disk_cache: bool) -> ds.Dataset:
+    dataset = _open_cached_listing(path, storage) if disk_cache else None
+    if dataset is None:
+        dataset = ds.dataset(path, filesystem=storage.filesystem)
+        if disk_cache:
+            _save_listing(path, dataset, storage)
+    return dataset
+
+
+def clear_pool(listings: bool = True):
+    """
+    Forget all pooled datasets and filesystems, e.g. after a mirror has been updated,
+    and unless listings is False, the file listings cached on disk
+    """
+    global _storage
+    with _pool_lock:
+        _datasets.clear()
+        _dataset_locks.clear()
+        _filesystems.clear()
+    _storage = None
+    if listings:
+        clear_listings()
+
+
+def clear_listings():
+    """
+    Remove the file listings cached on disk, so that datasets are listed again
+    """
+    shutil.rmtree(os.path.join(cache_dir, "listings"), ignore_errors=True)
+
+
+def _s3_filesystem(region: str, endpoint: Optional[str] = None, anonymous: bool = True) -> fs.FileSystem:
+    key = ("s3", region, endpoint, anonymous)
+    with _pool_lock:
+        filesystem = _filesystems.get(key)
+        if filesystem is None:
+            filesystem = fs.S3FileSystem(anonymous=anonymous, region=region, endpoint_override=endpoint)
+            _filesystems[key] = filesystem
+    return filesystem
+
+
+def _listing_cache_path(path: str, storage: Storage) -> str:
+    key = hashlib.sha1(f"{storage.name}:{path}".encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "listings", key[:16] + ".json")
+
+
+def _directory_mtime(path: str, filesystem: fs.FileSystem) -> Optional[int]:
+    # Modification time of a directory, which changes when files are added or
+    # removed, or None if the filesystem doesn't have one (e.g. S3)
+    try:
+        mtime_ns = filesystem.get_file_info(path.rstrip("/")).mtime_ns
+    except (OSError, NotImplementedError):
+        return None
+    return mtime_ns
+
+
+def _open_cached_listing(path: str, storage: Storage) -> Optional[ds.Dataset]:
+    """
+    Build a dataset from a file listing cached on disk, without listing the files.
+    Passing the file sizes also saves a request per file when reading footers. A
+    listing is used while the directory hasn't changed since it was saved, or for
+    storages without modification times of directories, for listing_max_age.
+    """
+    filesystem = storage.filesystem
+    try:
+        with open(_listing_cache_path(path, storage), "r") as f:
+            listing = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if listing.get("path") != path:
+        return None
+    mtime_ns = listing.get("mtime_ns")
+    if mtime_ns is not None:
+        if _directory_mtime(path, filesystem) != mtime_ns:
+            return None
+    elif time.time() - listing.get("saved", 0) > listing_max_age:
+        return None
+
+    schema = pa.ipc.read_schema(pa.py_buffer(base64.b64decode(listing["schema"])))
+    file_format = ds.ParquetFileFormat()
+    fragments = [
+        file_format.make_fragment(f["path"], filesystem, file_size=f["size"])
+        for f in listing["files"]
+    ]
+    return ds.FileSystemDataset(fragments, schema, file_format, filesystem)
 
-    dataset = ds.dataset(
-        path, filesystem=fs.S3FileSystem(anonymous=True, region="us-west-2")
+
+def _save_listing(path: str, dataset: ds.Dataset, storage: Storage):
+    filesystem = dataset.filesystem
+    infos = filesystem.get_file_info(dataset.files)
+    listing = {
+        "path": path,
+        "saved": time.time(),
+        "mtime_ns": _directory_mtime(path, filesystem),
+        "schema": base64.b64encode(dataset.schema.serialize().to_pybytes()).decode("ascii"),
+        "files": [{"path": info.path, "size": info.size} for info in infos],
+    }
+    cache_path = _listing_cache_path(path, storage)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(listing, f)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # The cache is only an optimization
+        pass
+
+
+class CountingFileSystemHandler(fs.FileSystemHandler):
+    """
+    Filesystem handler that forwards to another filesystem and counts listings and
+    opened files, e.g. to check how much metadata a fetch reads from a local copy of
+    the Overture layout. Use it as fs.PyFileSystem(CountingFileSystemHandler(...)).
+    """
+
+    def __init__(self, filesystem: fs.FileSystem):
+        self.filesystem = filesystem
+        self.counts = {"list": 0, "info": 0, "open": 0}
+
+    def __eq__(self, other):
+        return isinstance(other, CountingFileSystemHandler) and self.filesystem.equals(other.filesystem)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def get_type_name(self):
+        return "counting+" + self.filesystem.type_name
+
+    def normalize_path(self, path):
+        return self.filesystem.normalize_path(path)
+
+    def get_file_info(self, paths):
+        self.counts["info"] += len(paths)
+        return self.filesystem.get_file_info(paths)
+
+    def get_file_info_selector(self, selector):
+        self.counts["list"] += 1
+        return self.filesystem.get_file_info(selector)
+
+    def open_input_file(self, path):
+        self.counts["open"] += 1
+        return self.filesystem.open_input_file(path)
+
+    def open_input_stream(self, path):
+        self.counts["open"] += 1
+        return self.filesystem.open_input_stream(path)
+
+    def create_dir(self, path, recursive):
+        self.filesystem.create_dir(path, recursive=recursive)
+
+    def delete_dir(self, path):
+        self.filesystem.delete_dir(path)
+
+    def delete_dir_contents(self, path, missing_dir_ok=False):
+        self.filesystem.delete_dir_contents(path, missing_dir_ok=missing_dir_ok)
+
+    def delete_root_dir_contents(self):
+        self.filesystem.delete_dir_contents("/", accept_root_dir=True)
+
+    def delete_file(self, path):
+        self.filesystem.delete_file(path)
+
+    def move(self, src, dest):
+        self.filesystem.move(src, dest)
+
+    def copy_file(self, src, dest):
+        self.filesystem.copy_file(src, dest)
+
+    def open_output_stream(self, path, metadata):
+        return self.filesystem.open_output_stream(path, metadata=metadata)
+
+    def open_append_stream(self, path, metadata):
+        return self.filesystem.open_append_stream(path, metadata=metadata)
+
+
+class BoundedBatches:
+    """
+    Iterator over record batches that are read ahead by a background thread, but
+    only until max_bytes of batches are waiting to be consumed. This puts a ceiling
+    on the memory used between a fast scan and a slower consumer.
+
+    The thread is only started by the first read, so a reader that is dropped
+    before it is read holds no thread. It stops when close() is called, which
+    happens when iterating ends, including when the iterator is closed or garbage
+    collected before the end.
+    """
+
+    def __init__(self, batches: Iterable[pa.RecordBatch], max_bytes: int):
+        self.max_bytes = max_bytes
+        self.buffered_bytes = 0
+        self.peak_bytes = 0
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._done = False
+        self._closed = False
+        self._error = None
+        self._batches = batches
+        self._thread = None
+
+    def _start(self):
+        with self._condition:
+            if self._thread is not None or self._closed:
+                return
+            self._thread = threading.Thread(
+                target=self._produce, args=(self._batches,), daemon=True
+            )
+            self._batches = None
+            self._thread.start()
+
+    def _produce(self, batches: Iterable[pa.RecordBatch]):
+        try:
+            for batch in batches:
+                size = batch.nbytes
+                with self._condition:
+                    # A batch larger than the ceiling is let through when nothing
+                    # else is buffered, to not wait forever
+                    while (
+                        not self._closed
+                        and self.buffered_bytes > 0
+                        and self.buffered_bytes + size > self.max_bytes
+                    ):
+                        self._condition.wait()
+                    if self._closed:
+                        return
+                    self._queue.append(batch)
+                    self.buffered_bytes += size
+                    self.peak_bytes = max(self.peak_bytes, self.buffered_bytes)
+                    self._condition.notify_all()
+        except BaseException as e:
+            self._error = e
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+
+    def __iter__(self) -> Iterator[pa.RecordBatch]:
+        # The body of a generator only runs on the first next(), so this does
+        # not start the thread until the batches are actually read
+        self._start()
+        try:
+            while True:
+                with self._condition:
+                    while not self._queue and not self._done and not self._closed:
+                        self._condition.wait()
+                    if self._queue:
+                        batch = self._queue.popleft()
+                        self.buffered_bytes -= batch.nbytes
+                        self._condition.notify_all()
+                    elif self._error is not None:
+                        raise self._error
+                    else:
+                        return
+                yield batch
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stop reading ahead and drop the buffered batches
+        """
+        with self._condition:
+            self._closed = True
+            self._batches = None
+            self._queue.clear()
+            self.buffered_bytes = 0
+            self._condition.notify_all()
+
+
+def bbox_filter(bbox) -> pc.Expression:
+    """
+    Return a pyarrow filter for the features whose bbox intersects the bounding box
+    """
+    xmin, ymin, xmax, ymax = bbox
+    return (
+        (pc.field("bbox", "xmin") < xmax)
+        & (pc.field("bbox", "xmax") > xmin)
+        & (pc.field("bbox", "ymin") < ymax)
+        & (pc.field("bbox", "ymax") > ymin)
     )
-    batches = dataset.to_batches(filter=filter)
+
+
+def record_batch_reader(
+    overture_type,
+    bbox=None,
+    dataset: Optional[ds.Dataset] = None,
+    use_index: bool = True,
+    batch_size: Optional[int] = None,
+    batch_readahead: Optional[int] = None,
+    fragment_readahead: Optional[int] = None,
+    use_threads: Optional[bool] = None,
+    max_buffer_bytes: Optional[int] = None,
+) -> Optional[pa.RecordBatchReader]:
+    """
+    Return a pyarrow RecordBatchReader for the desired bounding box and s3 path
+
+    The pooled dataset of the type is used unless another dataset is passed. With
+    use_index, only the row groups that the spatial index of the dataset (built on
+    first use, see libs.index) says intersect the bounding box are scanned.
+
+    batch_size, batch_readahead, fragment_readahead and use_threads are passed to
+    the pyarrow scanner, which uses its defaults for the ones that are None. With
+    max_buffer_bytes, batches are handed over through BoundedBatches so no more
+    than that many bytes are read ahead of the consumer.
+    """
+    filter = bbox_filter(bbox) if bbox else None
+
+    if dataset is None:
+        dataset = open_dataset(overture_type)
+    schema = dataset.schema
+
+    if bbox and use_index and isinstance(dataset, ds.FileSystemDataset):
+        from .index import pruned_dataset
+
+        dataset = pruned_dataset(dataset, bbox)
+
+    scan_options = {
+        name: value
+        for name, value in [
+            ("batch_size", batch_size),
+            ("batch_readahead", batch_readahead),
+            ("fragment_readahead", fragment_readahead),
+            ("use_threads", use_threads),
+        ]
+        if value is not None
+    }
+    if dataset is None:
+        batches = iter([])
+    else:
+        batches = dataset.to_batches(filter=filter, **scan_options)
 
     # to_batches() can yield many batches with no rows. I've seen
     # this cause downstream crashes or other negative effects. For
@@ -45,15 +577,69 @@ def record_batch_reader(overture_type, bbox=None) -> Optional[pa.RecordBatchRead
     # them so the RecordBatchReader only has non-empty ones. Use
     # the generator syntax so the batches are streamed out
     non_empty_batches = (b for b in batches if b.num_rows > 0)
+    if max_buffer_bytes:
+        non_empty_batches = iter(BoundedBatches(non_empty_batches, max_buffer_bytes))
 
-    geoarrow_schema = geoarrow_schema_adapter(dataset.schema)
+    geoarrow_schema = geoarrow_schema_adapter(schema)
     reader = pa.RecordBatchReader.from_batches(geoarrow_schema, non_empty_batches)
     return reader
 
 
+def benchmark_scan(
+    overture_type: str,
+    bbox=None,
+    dataset: Optional[ds.Dataset] = None,
+    consume_seconds_per_batch: float = 0.0,
+    **scan_options,
+) -> dict:
+    """
+    Scan a bounding box with the given scanner options and report the throughput
+
+    Pass a dataset opened on a local copy of the data (see open_dataset) to compare
+    options without network noise. consume_seconds_per_batch simulates a slower
+    consumer, to see the effect of max_buffer_bytes.
+
+    Returns
+    -------
+    dict with rows, bytes, batches, seconds, rows_per_second, bytes_per_second and,
+    with max_buffer_bytes, peak_buffered_bytes
+    """
+    max_buffer_bytes = scan_options.pop("max_buffer_bytes", None)
+    reader = record_batch_reader(overture_type, bbox, dataset, **scan_options)
+    batches = iter(reader)
+    bounded = None
+    if max_buffer_bytes:
+        bounded = BoundedBatches(batches, max_buffer_bytes)
+        batches = iter(bounded)
+
+    start = time.perf_counter()
+    rows = 0
+    num_bytes = 0
+    count = 0
+    for batch in batches:
+        rows += batch.num_rows
+        num_bytes += batch.nbytes
+        count += 1
+        if consume_seconds_per_batch:
+            time.sleep(consume_seconds_per_batch)
+    seconds = time.perf_counter() - start
+
+    result = {
+        "rows": rows,
+        "bytes": num_bytes,
+        "batches": count,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds > 0 else 0.0,
+        "bytes_per_second": num_bytes / seconds if seconds > 0 else 0.0,
+    }
+    if bounded is not None:
+        result["peak_buffered_bytes"] = bounded.peak_bytes
+    return result
+
+
 def geodataframe(
     overture_type: str, bbox: (float, float, float, float) = None
-) -> GeoDataFrame:
+) -> "GeoDataFrame":
     """
     Loads geoparquet for specified type into a geopandas dataframe
 
@@ -67,7 +653,9 @@ def geodataframe(
     GeoDataFrame with the optionally filtered theme data
 
     """
-    if not HAS_GEOPANDAS:
+    try:
+        import geopandas as gpd
+    except ImportError:
         raise ImportError("geopandas is required to use this function")
 
     reader = record_batch_reader(overture_type, bbox)
@@ -121,18 +709,17 @@ type_theme_map = {
 }
 
 
-def _dataset_path(overture_type: str) -> str:
+def _dataset_path(overture_type: str, release: str = release, root: str = s3_bucket) -> str:
     """
-    Returns the s3 path of the Overture dataset to use. This assumes overture_type has
-    been validated, e.g. by the CLI
+    Returns the path of the Overture dataset to use under the root of a storage. This
+    assumes overture_type has been validated, e.g. by the CLI
 
     """
     # Map of sub-partition "type" to parent partition "theme" for forming the
     # complete s3 path. Could be discovered by reading from the top-level s3
     # location but this allows to only read the files in the necessary partition.
     theme = type_theme_map[overture_type]
-    # return f"overturemaps-us-west-2/release/2025-03-19.0/theme={theme}/type={overture_type}/"
-    return f"overturemaps-us-west-2/release/2025-05-21.0/theme={theme}/type={overture_type}/"
+    return f"{root}/release/{release}/theme={theme}/type={overture_type}/"
 
 
 def get_all_overture_types() -> List[str]:
@@ -0,0 +1,80 @@
+# Choice between the footprint of a building and its parts.
+#
+# Overture has both the outer footprint of a building (type "building") and, for
+# well-mapped buildings, its parts (type "building_part"). Extruding both puts
+# overlapping solids on top of each other, so only one representation is kept per
+# building: the parts when they carry heights, otherwise the footprint.
+
+from libs.lazy import lazy_import
+
+np = lazy_import("numpy")
+shapely = lazy_import("shapely")
+shapely_geometry = lazy_import("shapely.geometry")
+
+# Attributes that give a building part a height of its own
+part_height_attributes = ["height", "height_m", "height_ft", "num_floors", "min_height", "min_floor"]
+
+
+# Indices of the buildings that parts belong to, -1 for parts whose building isn't
+# among the given buildings. Parts without a building reference are matched to the
+# building that contains them, found through a spatial index.
+def part_buildings(building_features, part_features):
+    building_index = {}
+    for i, feature in enumerate(building_features):
+        building_id = (feature.get("properties") or {}).get("id") or feature.get("id")
+        if building_id is not None:
+            building_index[building_id] = i
+
+    owners = np.full(len(part_features), -1, dtype=np.int64)
+    unreferenced = []
+    for i, feature in enumerate(part_features):
+        building_id = (feature.get("properties") or {}).get("building_id")
+        if building_id is None:
+            unreferenced.append(i)
+        else:
+            owners[i] = building_index.get(building_id, -1)
+
+    if unreferenced and building_features:
+        footprints = [shapely_geometry.shape(f["geometry"]) for f in building_features]
+        tree = shapely.STRtree(footprints)
+        points = shapely.point_on_surface(
+            [shapely_geometry.shape(part_features[i]["geometry"]) for i in unreferenced]
+        )
+        point_indices, building_indices = tree.query(points, predicate="within")
+        # A point on the part that is within several footprints goes to the first one
+        matched = np.full(len(unreferenced), -1, dtype=np.int64)
+        first = np.unique(point_indices, return_index=True)[1]
+        matched[point_indices[first]] = building_indices[first]
+        owners[np.array(unreferenced)] = matched
+
+    return owners
+
+
+# Masks of the buildings and parts to keep. With prefer_parts the parts of a
+# building are kept if any of them has a height of its own, otherwise the footprint
+# is always kept. Parts of buildings outside the data are always kept.
+def building_representation(building_features, part_features, prefer_parts=True):
+    keep_buildings = np.ones(len(building_features), dtype=bool)
+    keep_parts = np.ones(len(part_features), dtype=bool)
+    if not building_features or not part_features:
+        return keep_buildings, keep_parts
+
+    owners = part_buildings(building_features, part_features)
+    owned = owners >= 0
+
+    has_height = np.array(
+        [
+            any((f.get("properties") or {}).get(name) is not None for name in part_height_attributes)
+            for f in part_features
+        ],
+        dtype=bool,
+    )
+
+    # Buildings with a part that has a height
+    has_part_heights = np.zeros(len(building_features), dtype=bool)
+    if prefer_parts:
+        has_part_heights[owners[owned & has_height]] = True
+
+    keep_buildings[has_part_heights] = False
+    keep_parts[owned] = has_part_heights[owners[owned]]
+    return keep_buildings, keep_parts
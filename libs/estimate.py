@@ -0,0 +1,193 @@
+# Estimate of the cost of generating a model, made before anything is downloaded.
+#
+# The row group index of each type (see libs/index.py) gives the number of rows and
+# bytes of the row groups that intersect the bounding box. Assuming features are
+# spread evenly over the extent of a row group, the part of the extent inside the
+# bounding box gives the number of features. Typical faces and processing time per
+# feature of each type turn that into a triangle count, output size and run time.
+# The figures are rough, but good enough to tell a minute from an hour and a few
+# MB from a few GB.
+
+from libs.lazy import lazy_import
+
+np = lazy_import("numpy")
+core = lazy_import("libs.core")
+cache = lazy_import("libs.cache")
+index = lazy_import("libs.index")
+
+# Typical number of faces of the mesh of a feature, by type. Points get no mesh
+# unless a rule gives them a size.
+faces_per_feature = {
+    "address": 0,
+    "bathymetry": 400,
+    "building": 14,
+    "building_part": 14,
+    "connector": 0,
+    "division": 0,
+    "division_area": 400,
+    "division_boundary": 60,
+    "infrastructure": 30,
+    "land": 300,
+    "land_cover": 400,
+    "land_use": 80,
+    "place": 0,
+    "segment": 30,
+    "water": 150,
+}
+faces_per_feature_default = 40
+
+# Typical seconds spent clipping, projecting and extruding a feature, by type
+seconds_per_feature = {
+    "bathymetry": 5e-3,
+    "building": 3e-4,
+    "building_part": 3e-4,
+    "land": 3e-3,
+    "land_cover": 5e-3,
+    "water": 2e-3,
+}
+seconds_per_feature_default = 5e-4
+
+# Seconds spent welding and writing a face of the model
+seconds_per_face = 2e-6
+
+# Bytes per face of the output formats
+bytes_per_face = {"stl": 50, "3mf": 20, "ply": 21}
+
+# Download throughput assumed for the public Overture bucket
+fetch_bytes_per_second_default = 20e6
+
+
+# Estimated number of rows inside the bounding box, and bytes and row groups to read
+def _type_estimate(row_groups, bbox):
+    mask = row_groups.intersecting(bbox)
+    extent = row_groups.extent[mask]
+    xmin, ymin, xmax, ymax = bbox
+    width = np.minimum(extent[:, 2], xmax) - np.maximum(extent[:, 0], xmin)
+    height = np.minimum(extent[:, 3], ymax) - np.maximum(extent[:, 1], ymin)
+    extent_area = (extent[:, 2] - extent[:, 0]) * (extent[:, 3] - extent[:, 1])
+
+    # Row groups without statistics or of a single point count fully
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.clip(width * height / extent_area, 0.0, 1.0)
+    fraction[~np.isfinite(fraction) | (extent_area <= 0.0)] = 1.0
+
+    return (
+        float((row_groups.num_rows[mask] * fraction).sum()),
+        int(row_groups.num_bytes[mask].sum()),
+        int(mask.sum()),
+    )
+
+
+# Types whose GeoJSON for the bounding box is cached in the working directory for
+# a release, by default that of libs.core
+def cached_types(bbox, overture_types, release=None):
+    from libs.Overture2STL import bbox_string
+
+    if release is None:
+        release = core.get_storage().release
+    return [
+        type_name
+        for type_name in overture_types
+        if cache.is_valid(
+            f"{bbox_string(bbox)}-{type_name}.geojson",
+            type=type_name,
+            bbox=bbox_string(bbox),
+            release=release,
+        )
+    ]
+
+
+# Estimate the cost of generating a model of the given types for a bounding box.
+# Types in cached, by default those with a cached GeoJSON file, are not fetched
+# again. Returns a dictionary with an entry per type (features, bytes, row_groups,
+# faces, seconds, and error for types that can't be read) and the totals features,
+# bytes, faces, output_bytes and seconds.
+def estimate(
+    bbox,
+    overture_types,
+    output_format="stl",
+    session=None,
+    cached=None,
+    fetch_bytes_per_second=fetch_bytes_per_second_default,
+):
+    if cached is None:
+        storage = session.storage if session is not None else None
+        cached = cached_types(bbox, overture_types, (storage or core.get_storage()).release)
+
+    types = {}
+    for type_name in overture_types:
+        try:
+            dataset = session.dataset(type_name) if session is not None else core.open_dataset(type_name)
+            features, num_bytes, row_groups = _type_estimate(index.row_group_index(dataset), bbox)
+        except OSError as e:
+            # Like a failed download, a type that can't be read is left out
+            types[type_name] = {
+                "features": 0,
+                "bytes": 0,
+                "row_groups": 0,
+                "faces": 0,
+                "seconds": 0.0,
+                "error": str(e),
+            }
+            continue
+        if type_name in cached:
+            num_bytes = 0
+        faces = features * faces_per_feature.get(type_name, faces_per_feature_default)
+        types[type_name] = {
+            "features": int(round(features)),
+            "bytes": num_bytes,
+            "row_groups": row_groups,
+            "faces": int(round(faces)),
+            "seconds": num_bytes / fetch_bytes_per_second
+            + features * seconds_per_feature.get(type_name, seconds_per_feature_default)
+            + faces * seconds_per_face,
+        }
+
+    faces = sum(entry["faces"] for entry in types.values())
+    return {
+        "types": types,
+        "features": sum(entry["features"] for entry in types.values()),
+        "bytes": sum(entry["bytes"] for entry in types.values()),
+        "faces": faces,
+        "output_bytes": 84 + faces * bytes_per_face.get(output_format, bytes_per_face["stl"]),
+        "seconds": sum(entry["seconds"] for entry in types.values()),
+    }
+
+
+# Reasons why an estimate exceeds limits, empty if it doesn't. A limit that is None
+# isn't checked.
+def check_limits(cost, max_faces=None, max_output_bytes=None, max_seconds=None):
+    reasons = []
+    if max_faces is not None and cost["faces"] > max_faces:
+        reasons.append(f"about {cost['faces']} faces, more than {max_faces}")
+    if max_output_bytes is not None and cost["output_bytes"] > max_output_bytes:
+        reasons.append(
+            f"about {_megabytes(cost['output_bytes'])} of output, more than {_megabytes(max_output_bytes)}"
+        )
+    if max_seconds is not None and cost["seconds"] > max_seconds:
+        reasons.append(f"about {cost['seconds']:.0f} s, more than {max_seconds:.0f} s")
+    return reasons
+
+
+def _megabytes(num_bytes):
+    return f"{num_bytes / (1024 * 1024):.1f} MB"
+
+
+# Printable summary of an estimate, one line per type and a total
+def format_estimate(cost):
+    lines = []
+    for type_name, entry in cost["types"].items():
+        if "error" in entry:
+            lines.append(f"{type_name}: can't be read ({entry['error']})")
+            continue
+        lines.append(
+            f"{type_name}: ~{entry['features']} features, {_megabytes(entry['bytes'])} to fetch, "
+            f"~{entry['faces']} faces"
+        )
+    minutes, seconds = divmod(int(round(cost["seconds"])), 60)
+    lines.append(
+        f"Total: ~{cost['features']} features, {_megabytes(cost['bytes'])} to fetch, "
+        f"~{cost['faces']} faces, ~{_megabytes(cost['output_bytes'])} output, "
+        f"~{minutes} min {seconds} s"
+    )
+    return lines
@@ -0,0 +1,107 @@
+# Writers for mesh formats that store each vertex once and refer to it from the
+# faces, unlike STL that repeats the vertices of every triangle.
+#
+# The writers take vertex and face arrays and write them in chunks, so no full
+# copy of the mesh is made in another representation.
+
+import zipfile
+
+import numpy as np
+
+# Number of vertices or faces converted and written at a time
+chunk_rows = 1 << 16
+
+_content_types_3mf = """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>
+</Types>
+"""
+
+_rels_3mf = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>
+"""
+
+_model_header_3mf = """<?xml version="1.0" encoding="UTF-8"?>
+<model unit="millimeter" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">
+<metadata name="Application">Overture2STL</metadata>
+<resources>
+<object id="1" type="model">
+<mesh>
+"""
+
+_model_footer_3mf = """</mesh>
+</object>
+</resources>
+<build>
+<item objectid="1"/>
+</build>
+</model>
+"""
+
+
+# Write a mesh as a binary little-endian PLY file, to a path or binary file object
+def write_ply(where, vertices, faces):
+    if isinstance(where, str):
+        with open(where, "wb") as f:
+            _write_ply(f, vertices, faces)
+    else:
+        _write_ply(where, vertices, faces)
+
+
+def _write_ply(f, vertices, faces):
+    header = (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        "comment Overture2STL\n"
+        f"element vertex {len(vertices)}\n"
+        "property float x\n"
+        "property float y\n"
+        "property float z\n"
+        f"element face {len(faces)}\n"
+        "property list uchar uint vertex_indices\n"
+        "end_header\n"
+    )
+    f.write(header.encode("ascii"))
+
+    for start in range(0, len(vertices), chunk_rows):
+        chunk = np.ascontiguousarray(vertices[start : start + chunk_rows], dtype="<f4")
+        f.write(chunk.tobytes())
+
+    face_dtype = np.dtype([("count", "u1"), ("indices", "<u4", (3,))])
+    for start in range(0, len(faces), chunk_rows):
+        chunk = faces[start : start + chunk_rows]
+        records = np.empty(len(chunk), dtype=face_dtype)
+        records["count"] = 3
+        records["indices"] = chunk
+        f.write(records.tobytes())
+
+
+# Write a mesh as a 3MF file (a zip-compressed XML model), to a path or binary file
+# object. Coordinates are in millimeters. Each chunk is formatted with one format
+# string repeated for all of its rows, and compressed at the fastest level, as
+# formatting and compressing the XML take most of the time.
+def write_3mf(where, vertices, faces):
+    with zipfile.ZipFile(where, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        archive.writestr("[Content_Types].xml", _content_types_3mf)
+        archive.writestr("_rels/.rels", _rels_3mf)
+        with archive.open("3D/3dmodel.model", "w", force_zip64=True) as f:
+            f.write(_model_header_3mf.encode("utf-8"))
+
+            f.write(b"<vertices>\n")
+            for start in range(0, len(vertices), chunk_rows):
+                chunk = np.asarray(vertices[start : start + chunk_rows])
+                row = '<vertex x="%.4f" y="%.4f" z="%.4f"/>\n'
+                f.write((row * len(chunk) % tuple(chunk.ravel().tolist())).encode("ascii"))
+            f.write(b"</vertices>\n")
+
+            f.write(b"<triangles>\n")
+            for start in range(0, len(faces), chunk_rows):
+                chunk = np.asarray(faces[start : start + chunk_rows])
+                row = '<triangle v1="%d" v2="%d" v3="%d"/>\n'
+                f.write((row * len(chunk) % tuple(chunk.ravel().tolist())).encode("ascii"))
+            f.write(b"</triangles>\n")
+
+            f.write(_model_footer_3mf.encode("utf-8"))
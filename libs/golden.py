@@ -0,0 +1,460 @@
+# End-to-end performance regression gate.
+#
+# A set of golden scenarios, each a parameter set for overture_to_stl, is run
+# against a synthetic fixture dataset that is generated locally with a fixed seed
+# in the layout of the Overture bucket, so no network access is needed. For every
+# scenario the wall time, peak memory, face count, output size and a checksum of
+# the output geometry are measured and compared with recorded baselines. Metrics
+# that grew by more than their threshold, or a changed checksum, are flagged.
+#
+# The face count, size and checksum don't depend on the machine, and their
+# baselines are committed with the code. Wall time and peak memory do, so they are
+# recorded and compared per machine, in a file in the cache directory, and only
+# when asked for.
+#
+#   python -m libs.golden --record              # record the output, when meant to change
+#   python -m libs.golden --record-timings      # record timings of this machine
+#   python -m libs.golden                       # compare the output, exit code 1 if worse
+#   python -m libs.golden --timings             # also compare timings, e.g. for an upgrade
+#
+# Each scenario runs in a fresh process, so that peak memory and import times
+# don't depend on the scenarios that ran before.
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+from libs.lazy import lazy_import
+
+np = lazy_import("numpy")
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+shapely = lazy_import("shapely")
+core = lazy_import("libs.core")
+
+# Version of the fixture data, to regenerate it when the generator changes
+fixture_version = 1
+
+# Release name under which the fixture data is stored
+fixture_release = "golden-1"
+
+# Area covered by the fixture data
+fixture_bbox = [13.0, 55.6, 13.02, 55.615]
+
+# Scenarios, each with a name and parameters for overture_to_stl. The bounding box
+# defaults to the fixture area and the output path is set by the runner.
+scenarios = [
+    {
+        "name": "buildings-fixed",
+        "overture_types": ["building"],
+        "polygon_height_mode": "f",
+    },
+    {
+        "name": "city-explicit",
+        "overture_types": ["building", "building_part", "segment", "water"],
+        "polygon_height_mode": "e",
+    },
+    {
+        "name": "city-overlay",
+        "overture_types": ["building", "building_part", "segment", "water"],
+        "polygon_height_mode": "e",
+        "overlay_priority": [],
+    },
+    {
+        "name": "roads-water-scaled",
+        "overture_types": ["segment", "water"],
+        "scale_percent": 50.0,
+        "base_margin": 2.0,
+    },
+]
+
+# Metrics that are the same on any machine, and those that depend on the machine
+output_metrics = ("faces", "size", "checksum")
+timing_metrics = ("seconds", "peak_memory")
+
+# Metrics compared with the baselines, with the relative increase allowed
+thresholds_default = {
+    "seconds": 0.25,
+    "peak_memory": 0.20,
+    "faces": 0.0,
+    "size": 0.0,
+}
+
+# Grid quantum (in output units) of the vertices hashed by the geometry checksum
+checksum_quantum = 0.001
+
+# Default path of the recorded baselines
+baselines_path_default = "golden_baselines.json"
+
+
+# Default path of the timings recorded on this machine
+def timings_path_default():
+    return os.path.join(core.cache_dir, "golden", "timings.json")
+
+
+# Directory of the fixture data, generated if it's missing or outdated
+def fixture_dir(directory=None):
+    if directory is None:
+        directory = os.path.join(core.cache_dir, "golden", f"fixture-{fixture_version}")
+    marker = os.path.join(directory, "fixture.json")
+    if not os.path.exists(marker):
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        _generate_fixture(directory)
+        with open(marker, "w") as f:
+            json.dump({"version": fixture_version, "release": fixture_release}, f)
+    return directory
+
+
+# Write a type of the fixture as Parquet files with a bbox column, sorted by latitude
+# so that the row group statistics are useful, and with nulls for missing values
+def _write_fixture_type(directory, overture_type, geometries, columns, files=2):
+    bounds = shapely.bounds(geometries)
+    order = np.argsort(bounds[:, 1], kind="stable")
+    theme = core.type_theme_map[overture_type]
+    path = os.path.join(directory, "release", fixture_release, f"theme={theme}", f"type={overture_type}")
+    os.makedirs(path, exist_ok=True)
+
+    table = pa.table(
+        {
+            "geometry": pa.array(shapely.to_wkb(geometries[order]).tolist(), pa.binary()),
+            "bbox": pa.StructArray.from_arrays(
+                [pa.array(bounds[order, i], pa.float32()) for i in range(4)],
+                ["xmin", "ymin", "xmax", "ymax"],
+            ),
+            **{
+                name: pa.array(np.asarray(values, dtype=object)[order].tolist())
+                for name, values in columns.items()
+            },
+        }
+    )
+    geo = {
+        "version": "1.1.0",
+        "primary_column": "geometry",
+        "columns": {"geometry": {"encoding": "WKB", "geometry_types": []}},
+    }
+    table = table.replace_schema_metadata({"geo": json.dumps(geo)})
+    rows = (table.num_rows + files - 1) // files
+    for i in range(files):
+        pq.write_table(
+            table.slice(i * rows, rows), os.path.join(path, f"part-{i}.parquet"), row_group_size=256
+        )
+
+
+def _generate_fixture(directory):
+    rng = np.random.default_rng(20250521)
+    west, south, east, north = fixture_bbox
+    columns_x, rows_y = 40, 60
+    cell_x = (east - west) / columns_x
+    cell_y = (north - south) / rows_y
+
+    def nulls(values, fraction):
+        values = np.asarray(values, dtype=object)
+        values[rng.random(len(values)) < fraction] = None
+        return values
+
+    # Buildings in a grid of blocks, with streets between every fourth row/column
+    cells = [
+        (i, j) for i in range(columns_x) for j in range(rows_y) if i % 4 != 0 and j % 4 != 0
+    ]
+    x0 = np.array([west + i * cell_x for i, _ in cells]) + rng.random(len(cells)) * cell_x * 0.2
+    y0 = np.array([south + j * cell_y for _, j in cells]) + rng.random(len(cells)) * cell_y * 0.2
+    x1 = x0 + cell_x * (0.5 + rng.random(len(cells)) * 0.25)
+    y1 = y0 + cell_y * (0.5 + rng.random(len(cells)) * 0.25)
+    buildings = shapely.box(x0, y0, x1, y1)
+    building_ids = [f"golden-building-{i}" for i in range(len(cells))]
+    count = len(cells)
+    _write_fixture_type(
+        directory,
+        "building",
+        buildings,
+        {
+            "id": building_ids,
+            "subtype": rng.choice(["residential", "commercial", "industrial"], count),
+            "class": rng.choice(["house", "apartments", "office", "warehouse"], count),
+            "height": nulls(rng.choice([6.0, 9.0, 12.0, 15.0, 24.0], count), 0.5),
+            "num_floors": nulls(rng.integers(1, 8, count).astype(float), 0.6),
+        },
+    )
+
+    # Two parts of different heights for every fifth building
+    owners = np.arange(0, count, 5)
+    middle = (x0[owners] + x1[owners]) / 2.0
+    parts = np.concatenate(
+        [
+            shapely.box(x0[owners], y0[owners], middle, y1[owners]),
+            shapely.box(middle, y0[owners], x1[owners], y1[owners]),
+        ]
+    )
+    part_owners = np.concatenate([owners, owners])
+    _write_fixture_type(
+        directory,
+        "building_part",
+        parts,
+        {
+            "id": [f"golden-part-{i}" for i in range(len(parts))],
+            "building_id": [building_ids[i] for i in part_owners],
+            "height": nulls(rng.choice([4.0, 8.0, 16.0, 30.0], len(parts)), 0.3),
+        },
+    )
+
+    # Streets along the grid lines between blocks, with some jitter in their vertices
+    road_classes = ["primary", "secondary", "tertiary", "residential", "footway", "service"]
+    lines = []
+    for i in range(0, columns_x + 1, 4):
+        y = np.linspace(south, north, 25)
+        x = west + i * cell_x + rng.normal(0.0, cell_x * 0.02, len(y))
+        lines.append(shapely.linestrings(x, y))
+    for j in range(0, rows_y + 1, 4):
+        x = np.linspace(west, east, 25)
+        y = south + j * cell_y + rng.normal(0.0, cell_y * 0.02, len(x))
+        lines.append(shapely.linestrings(x, y))
+    lines = np.array(lines, dtype=object)
+    _write_fixture_type(
+        directory,
+        "segment",
+        lines,
+        {
+            "id": [f"golden-segment-{i}" for i in range(len(lines))],
+            "subtype": ["road"] * len(lines),
+            "class": rng.choice(road_classes, len(lines)),
+        },
+        files=1,
+    )
+
+    # Ponds with detailed outlines, some overlapping buildings and streets
+    centers = rng.random((12, 2)) * [east - west, north - south] + [west, south]
+    water = shapely.buffer(shapely.points(centers), cell_x * (1.0 + rng.random(12) * 2.0), quad_segs=32)
+    _write_fixture_type(
+        directory,
+        "water",
+        water,
+        {
+            "id": [f"golden-water-{i}" for i in range(len(water))],
+            "subtype": ["water"] * len(water),
+            "class": rng.choice(["pond", "lake"], len(water)),
+        },
+        files=1,
+    )
+
+
+# Checksum of the triangles of a binary STL file, with vertices rounded to a grid
+# and triangles in a canonical order, so that only changes of the geometry and not
+# of the order of triangles or vertices within them change it
+def stl_checksum(path, quantum=checksum_quantum):
+    with open(path, "rb") as f:
+        f.seek(80)
+        (count,) = struct.unpack("<I", f.read(4))
+        records = np.frombuffer(
+            f.read(count * 50),
+            dtype=np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")]),
+        )
+    vertices = np.round(records["vertices"].astype(np.float64) / quantum).astype(np.int64)
+
+    # Start each triangle at its smallest vertex, which keeps its winding
+    keys = vertices.reshape(-1, 3)
+    _, ranks = np.unique(keys, axis=0, return_inverse=True)
+    ranks = ranks.reshape(-1, 3)
+    first = np.argmin(ranks, axis=1)
+    rolled = np.take_along_axis(ranks, (first[:, None] + np.arange(3)) % 3, axis=1)
+    triangles = np.take_along_axis(vertices, ((first[:, None] + np.arange(3)) % 3)[:, :, None], axis=1)
+
+    order = np.lexsort(rolled.T[::-1])
+    return hashlib.sha1(np.ascontiguousarray(triangles[order]).tobytes()).hexdigest()
+
+
+def _peak_memory():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Run a scenario in the current process and return its metrics. The fastest of the
+# repetitions is used for the wall time.
+def run_scenario(scenario, directory, repeat=1):
+    from libs.Overture2STL import overture_to_stl
+
+    core.set_storage(core.Storage.local(directory, fixture_release))
+    parameters = {name: value for name, value in scenario.items() if name != "name"}
+    parameters.setdefault("bbox", fixture_bbox)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            output_path = os.path.join(work_dir, "golden")
+            seconds = []
+            for _ in range(repeat):
+                # Fetch again every time, downloaded GeoJSON is cached in the directory
+                for name in os.listdir(work_dir):
+                    os.remove(os.path.join(work_dir, name))
+                start = time.perf_counter()
+                overture_to_stl(output_stl_path=output_path, **parameters)
+                seconds.append(time.perf_counter() - start)
+
+            stl_path = output_path + ".stl"
+            with open(stl_path, "rb") as f:
+                f.seek(80)
+                (faces,) = struct.unpack("<I", f.read(4))
+            return {
+                "seconds": min(seconds),
+                "peak_memory": _peak_memory(),
+                "faces": faces,
+                "size": os.path.getsize(stl_path),
+                "checksum": stl_checksum(stl_path),
+            }
+        finally:
+            os.chdir(cwd)
+
+
+# Run scenarios, each in a fresh process, and return their metrics by name
+def run_scenarios(selected=None, repeat=3, directory=None):
+    directory = fixture_dir(directory)
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for scenario in scenarios:
+        if selected and scenario["name"] not in selected:
+            continue
+        print(f"Running scenario '{scenario['name']}'...")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[scenario["name"]] = executor.submit(run_scenario, scenario, directory, repeat).result()
+    return results
+
+
+# Compare metrics with baselines, returning a list of regression messages. Only the
+# given metrics are compared, by default all.
+def compare(results, baselines, thresholds=None, check_checksum=True, metrics=None):
+    thresholds = {**thresholds_default, **(thresholds or {})}
+    if metrics is not None:
+        thresholds = {metric: value for metric, value in thresholds.items() if metric in metrics}
+        check_checksum = check_checksum and "checksum" in metrics
+    regressions = []
+    for name, metrics in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            regressions.append(f"{name}: no baseline recorded")
+            continue
+        for metric, threshold in thresholds.items():
+            value = metrics.get(metric)
+            reference = baseline.get(metric)
+            if value is None or reference is None:
+                continue
+            if value > reference * (1.0 + threshold):
+                change = (value / reference - 1.0) * 100.0 if reference else float("inf")
+                regressions.append(
+                    f"{name}: {metric} grew by {change:.1f}% ({reference} -> {value}), "
+                    f"more than {threshold * 100.0:.1f}%"
+                )
+        if check_checksum and metrics.get("checksum") != baseline.get("checksum"):
+            regressions.append(f"{name}: output geometry changed")
+    return regressions
+
+
+# Record some of the metrics of results in a JSON file, keeping those of other
+# scenarios and the other metrics of the same scenarios
+def record(results, path, metrics):
+    recorded = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            recorded = json.load(f)
+    for name, result in results.items():
+        recorded.setdefault(name, {}).update({metric: result[metric] for metric in metrics})
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(recorded, f, indent=2)
+
+
+def _format_metrics(metrics):
+    memory = metrics["peak_memory"]
+    memory = "n/a" if memory is None else f"{memory / (1024 * 1024):.0f} MB"
+    return (
+        f"{metrics['seconds']:.2f} s, {memory}, {metrics['faces']} faces, "
+        f"{metrics['size'] / 1024:.0f} KB, checksum {metrics['checksum'][:12]}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the golden end-to-end scenarios.")
+    parser.add_argument("--record", action="store_true", help="record the output of the results as baselines")
+    parser.add_argument(
+        "--record-timings", action="store_true", help="record the timings of the results on this machine"
+    )
+    parser.add_argument(
+        "--timings", action="store_true", help="also compare the timings with those recorded on this machine"
+    )
+    parser.add_argument(
+        "--baselines",
+        default=baselines_path_default,
+        help=f"JSON file with the baselines ({baselines_path_default})",
+    )
+    parser.add_argument("--timings-file", help="JSON file with the timings (in the cache directory)")
+    parser.add_argument("--scenario", action="append", help="scenario to run (all)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario, the fastest counts, the first including imports (3)")
+    parser.add_argument("--fixture-dir", help="directory of the fixture data (in the cache directory)")
+    parser.add_argument(
+        "--threshold",
+        action="append",
+        default=[],
+        metavar="METRIC=FRACTION",
+        help="allowed relative increase of a metric, e.g. seconds=0.5",
+    )
+    parser.add_argument("--ignore-checksum", action="store_true", help="don't flag changed geometry")
+    args = parser.parse_args(argv)
+
+    thresholds = {}
+    for threshold in args.threshold:
+        metric, _, value = threshold.partition("=")
+        if metric not in thresholds_default:
+            parser.error(f"unknown metric '{metric}'")
+        thresholds[metric] = float(value)
+
+    results = run_scenarios(args.scenario, args.repeat, args.fixture_dir)
+    for name, metrics in results.items():
+        print(f"{name}: {_format_metrics(metrics)}")
+
+    timings_path = args.timings_file or timings_path_default()
+    if args.record or args.record_timings:
+        if args.record:
+            record(results, args.baselines, output_metrics)
+            print(f"Recorded baselines in '{args.baselines}'.")
+        if args.record_timings:
+            record(results, timings_path, timing_metrics)
+            print(f"Recorded timings in '{timings_path}'.")
+        return 0
+
+    if not os.path.exists(args.baselines):
+        print(f"No baselines in '{args.baselines}', record them with --record.")
+        return 1
+    with open(args.baselines, "r") as f:
+        baselines = json.load(f)
+    regressions = compare(results, baselines, thresholds, not args.ignore_checksum, output_metrics)
+
+    if args.timings:
+        if not os.path.exists(timings_path):
+            print(f"No timings in '{timings_path}', record them with --record-timings.")
+            return 1
+        with open(timings_path, "r") as f:
+            timings = json.load(f)
+        regressions += compare(results, timings, thresholds, metrics=timing_metrics)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    print("No regressions." if not regressions else f"{len(regressions)} regressions.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+# Heightmap engine, an alternative to extruding every feature separately.
+#
+# The footprints of all features are rasterized with their heights into a grid at
+# print resolution, keeping the highest feature of every cell, and the grid is
+# meshed as one closed surface on top of the base. The cost depends on the printed
+# area and the resolution rather than on the number of features, and the mesh is
+# manifold by construction, at the price of detail finer than a cell and walls
+# that slope over one cell.
+#
+# Grids are limited to samples_max samples, as a fine resolution over a large print
+# quickly needs more memory than there is. Flat areas, like the ground and roofs,
+# are meshed as square blocks of cells with faces only along their edges.
+
+from libs.lazy import lazy_import
+
+np = lazy_import("numpy")
+shapely = lazy_import("shapely")
+
+# Maximum number of samples of a grid, e.g. 2000 x 2000, which at 0.2 mm is already
+# larger than the bed of most printers
+samples_max = 4_000_000
+
+# Levels of the blocks of flat cells meshed as one fan of faces, 2**level cells on
+# a side
+block_levels = range(1, 11)
+
+
+# Coordinates of the samples of a grid with the given bounds and shape, evenly
+# spaced from edge to edge
+def grid_coordinates(bounds, shape):
+    xmin, ymin, xmax, ymax = bounds
+    rows, columns = shape
+    return np.linspace(xmin, xmax, columns), np.linspace(ymin, ymax, rows)
+
+
+# Shape (rows, columns) of a grid that samples the given bounds at most cell apart
+def grid_shape(bounds, cell):
+    xmin, ymin, xmax, ymax = bounds
+    columns = max(int(np.ceil((xmax - xmin) / cell)), 1) + 1
+    rows = max(int(np.ceil((ymax - ymin) / cell)), 1) + 1
+    return rows, columns
+
+
+# Smallest distance between samples, at least cell, that keeps a grid of the given
+# bounds within max_samples samples
+def capped_cell(bounds, cell, max_samples=samples_max):
+    while np.prod(grid_shape(bounds, cell)) > max_samples:
+        rows, columns = grid_shape(bounds, cell)
+        cell *= max(np.sqrt(rows * columns / max_samples), 1.01)
+    return cell
+
+
+# Rasterize footprints with heights into a grid that samples the given bounds at
+# most cell apart, with the highest footprint at each sample and 0 outside all.
+# Raises ValueError if the grid would have more than max_samples samples.
+def rasterize(footprints, heights, bounds, cell, max_samples=samples_max):
+    xmin, ymin, xmax, ymax = bounds
+    rows, columns = grid_shape(bounds, cell)
+    if rows * columns > max_samples:
+        raise ValueError(
+            f"A heightmap of {columns} x {rows} samples is larger than {max_samples} samples, "
+            "use a coarser resolution."
+        )
+    grid = np.zeros((rows, columns), dtype=np.float32)
+    x_all, y_all = grid_coordinates(bounds, grid.shape)
+    dx = (xmax - xmin) / (columns - 1)
+    dy = (ymax - ymin) / (rows - 1)
+
+    for footprint, height in zip(footprints, heights):
+        if height <= 0.0 or footprint.is_empty:
+            continue
+
+        # Samples within the bounds of the footprint
+        fxmin, fymin, fxmax, fymax = footprint.bounds
+        j0 = max(int(np.ceil((fxmin - xmin) / dx)), 0)
+        j1 = min(int(np.floor((fxmax - xmin) / dx)) + 1, columns)
+        i0 = max(int(np.ceil((fymin - ymin) / dy)), 0)
+        i1 = min(int(np.floor((fymax - ymin) / dy)) + 1, rows)
+        if j0 >= j1 or i0 >= i1:
+            continue
+
+        shapely.prepare(footprint)
+        inside = shapely.contains_xy(footprint, x_all[None, j0:j1], y_all[i0:i1, None])
+        window = grid[i0:i1, j0:j1]
+        window[inside] = np.maximum(window[inside], height)
+
+    return grid
+
+
+# Mesh a grid made by rasterize() as a closed solid: a surface through the samples
+# at their heights, walls around the edges and a bottom at the given z. Returns
+# float32 vertices relative to origin (x, y) and uint32 faces.
+def grid_mesh(grid, bounds, bottom, origin=(0.0, 0.0)):
+    rows, columns = grid.shape
+    x, y = grid_coordinates(bounds, grid.shape)
+
+    # Surface, vertex (i, j) at index i * columns + j
+    top = np.empty((rows * columns, 3), dtype=np.float32)
+    top[:, 0] = np.tile((x - origin[0]).astype(np.float32), rows)
+    top[:, 1] = np.repeat((y - origin[1]).astype(np.float32), columns)
+    top[:, 2] = grid.ravel()
+    surface, covered = _flat_blocks(grid)
+
+    # Two faces for every other cell
+    i, j = np.nonzero(~covered)
+    a = (i * columns + j).astype(np.uint32)
+    b = a + 1
+    c = a + np.uint32(columns + 1)
+    d = a + np.uint32(columns)
+    surface += [np.column_stack([a, b, c]), np.column_stack([a, c, d])]
+
+    # Boundary of the surface counterclockwise seen from above, and the bottom
+    # vertices below it
+    index = np.arange(rows * columns, dtype=np.uint32).reshape(rows, columns)
+    ring = np.concatenate(
+        [
+            index[0, :-1],
+            index[:-1, -1],
+            index[-1, :0:-1],
+            index[:0:-1, 0],
+        ]
+    )
+    count = len(top)
+    bottom_vertices = top[ring]
+    bottom_vertices[:, 2] = bottom
+    below = np.uint32(count) + np.arange(len(ring), dtype=np.uint32)
+    following = np.roll(np.arange(len(ring)), -1)
+
+    # Walls, facing outwards
+    walls = [
+        np.column_stack([ring, below, below[following]]),
+        np.column_stack([ring, below[following], ring[following]]),
+    ]
+
+    # Bottom as a fan around its center, facing down
+    center = np.array([[top[:, 0].mean(), top[:, 1].mean(), bottom]], dtype=np.float32)
+    center_index = np.full(len(ring), count + len(ring), dtype=np.uint32)
+    base = [np.column_stack([center_index, below[following], below])]
+
+    vertices = np.concatenate([top, bottom_vertices, center])
+    faces = np.concatenate(surface + walls + base)
+
+    # Drop the samples inside flat blocks, which no face uses
+    used = np.zeros(len(vertices), dtype=bool)
+    used[faces.ravel()] = True
+    remap = (np.cumsum(used, dtype=np.int64) - 1).astype(np.uint32)
+    return vertices[used], remap[faces]
+
+
+# Faces of the square blocks of flat cells of a grid, aligned to their size, of the
+# sizes of block_levels, the largest first. Each block is a fan around its center
+# sample through the samples of its edges that other faces use as well: its
+# corners, the corners of the cells outside blocks and the edge of the grid. The
+# blocks that share an edge leave out the same samples along it, so the surface
+# stays closed, and a block with only its corners on its edges is two faces.
+# Returns a list of face arrays and a mask of the cells covered by blocks.
+def _flat_blocks(grid):
+    rows, columns = grid.shape
+    corners = grid[:-1, :-1]
+    flat = (corners == grid[:-1, 1:]) & (corners == grid[1:, :-1]) & (corners == grid[1:, 1:])
+
+    # Height of the blocks of each level, NaN where they aren't flat
+    heights = [np.where(flat, corners, np.nan).astype(np.float32)]
+    while len(heights) <= block_levels.stop - 1 and min(heights[-1].shape) >= 2:
+        h = heights[-1]
+        r = h.shape[0] // 2 * 2
+        c = h.shape[1] // 2 * 2
+        a = h[0:r:2, 0:c:2]
+        same = (a == h[0:r:2, 1:c:2]) & (a == h[1:r:2, 0:c:2]) & (a == h[1:r:2, 1:c:2])
+        heights.append(np.where(same, a, np.nan))
+
+    # Blocks of each level, by the row and column of their lower left cell
+    blocks = []
+    covered = np.zeros(flat.shape, dtype=bool)
+    for level in range(len(heights) - 1, block_levels.start - 1, -1):
+        size = 1 << level
+        bi, bj = np.nonzero(~np.isnan(heights[level]))
+        free = ~covered[bi * size, bj * size]
+        bi, bj = bi[free] * size, bj[free] * size
+        if len(bi) == 0:
+            continue
+
+        mask = np.zeros(heights[level].shape, dtype=bool)
+        mask[bi // size, bj // size] = True
+        mask = np.repeat(np.repeat(mask, size, axis=0), size, axis=1)
+        covered[: mask.shape[0], : mask.shape[1]] |= mask
+        blocks.append((size, bi, bj))
+
+    # Samples used by faces other than the fans of the blocks they are on
+    needed = np.zeros(grid.shape, dtype=bool)
+    needed[[0, -1], :] = True
+    needed[:, [0, -1]] = True
+    i, j = np.nonzero(~covered)
+    for di, dj in [(0, 0), (0, 1), (1, 0), (1, 1)]:
+        needed[i + di, j + dj] = True
+    for size, bi, bj in blocks:
+        for di, dj in [(0, 0), (0, size), (size, 0), (size, size)]:
+            needed[bi + di, bj + dj] = True
+    needed = needed.ravel()
+
+    faces = []
+    for size, bi, bj in blocks:
+        # Edge samples counterclockwise from the lower left corner, x along columns
+        # and y along rows
+        steps = np.arange(size)
+        di = np.concatenate([np.zeros(size, int), steps, np.full(size, size), size - steps])
+        dj = np.concatenate([steps, np.full(size, size), size - steps, np.zeros(size, int)])
+        edge = ((bi[:, None] + di) * columns + bj[:, None] + dj).astype(np.uint32)
+        keep = needed[edge]
+        counts = keep.sum(axis=1)
+
+        # Blocks with only their corners as two faces
+        square = edge[counts == 4][:, [0, size, 2 * size, 3 * size]]
+        faces.append(square[:, [0, 1, 2]])
+        faces.append(square[:, [0, 2, 3]])
+
+        # The others as fans through the samples they keep
+        fan = counts > 4
+        edge, keep, counts = edge[fan], keep[fan], counts[fan]
+        center = ((bi[fan] + size // 2) * columns + bj[fan] + size // 2).astype(np.uint32)
+        points = edge[keep]
+        following = np.arange(1, len(points) + 1)
+        ends = np.cumsum(counts)
+        following[ends - 1] = ends - counts
+        faces.append(np.column_stack([np.repeat(center, counts), points, points[following]]))
+    return faces, covered
@@ -0,0 +1,212 @@
+"""
+Spatial index of the row groups of an Overture dataset
+
+The index maps every row group of every file to the extent of its features, taken
+from the statistics of the bbox column. It is built once per release and type,
+stored on disk, and used to plan the exact row groups to read for a bounding box,
+so that small areas don't have to probe every file of a theme.
+"""
+
+import hashlib
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import pyarrow.dataset as ds
+
+from . import core
+
+# Indexes shared by all callers in the process, by the files they cover. Each is
+# built under a lock of its own, so building one doesn't hold up the others.
+_index_lock = threading.Lock()
+_indexes: Dict[str, "RowGroupIndex"] = {}
+_build_locks: Dict[str, threading.Lock] = {}
+
+_bbox_columns = ["bbox.xmin", "bbox.ymin", "bbox.xmax", "bbox.ymax"]
+
+
+class RowGroupIndex:
+    """
+    Extent, row count and size of each row group of a set of Parquet files
+    """
+
+    def __init__(
+        self,
+        paths: List[str],
+        file: np.ndarray,
+        row_group: np.ndarray,
+        extent: np.ndarray,
+        num_rows: np.ndarray,
+        num_bytes: np.ndarray,
+    ):
+        self.paths = paths
+        self.file = file
+        self.row_group = row_group
+        self.extent = extent
+        self.num_rows = num_rows
+        self.num_bytes = num_bytes
+
+    def __len__(self):
+        return len(self.file)
+
+    @classmethod
+    def build(cls, dataset: ds.FileSystemDataset) -> "RowGroupIndex":
+        """
+        Build the index by reading the footer of every file of the dataset
+        """
+        paths = []
+        file, row_group, extent, num_rows, num_bytes = [], [], [], [], []
+        for fragment in dataset.get_fragments():
+            metadata = fragment.metadata
+            columns = _column_indices(metadata.schema)
+            file_index = len(paths)
+            paths.append(fragment.path)
+            for i in range(metadata.num_row_groups):
+                group = metadata.row_group(i)
+                file.append(file_index)
+                row_group.append(i)
+                extent.append(_row_group_extent(group, columns))
+                num_rows.append(group.num_rows)
+                num_bytes.append(group.total_byte_size)
+
+        return cls(
+            paths,
+            np.array(file, dtype=np.int32),
+            np.array(row_group, dtype=np.int32),
+            np.array(extent, dtype=np.float64).reshape(-1, 4),
+            np.array(num_rows, dtype=np.int64),
+            np.array(num_bytes, dtype=np.int64),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "RowGroupIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["paths"].tolist(),
+                data["file_index"],
+                data["row_group"],
+                data["extent"],
+                data["num_rows"],
+                data["num_bytes"],
+            )
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            temp_path,
+            paths=np.array(self.paths, dtype=str),
+            file_index=self.file,
+            row_group=self.row_group,
+            extent=self.extent,
+            num_rows=self.num_rows,
+            num_bytes=self.num_bytes,
+        )
+        os.replace(temp_path, path)
+
+    def intersecting(self, bbox) -> np.ndarray:
+        """
+        Return a mask of the row groups whose extent intersects the bounding box
+        """
+        xmin, ymin, xmax, ymax = bbox
+        return (
+            (self.extent[:, 0] < xmax)
+            & (self.extent[:, 2] > xmin)
+            & (self.extent[:, 1] < ymax)
+            & (self.extent[:, 3] > ymin)
+        )
+
+    def plan(self, bbox) -> Dict[str, List[int]]:
+        """
+        Return the row groups to read for the bounding box, by file path
+        """
+        mask = self.intersecting(bbox)
+        plan: Dict[str, List[int]] = {}
+        for f, g in zip(self.file[mask].tolist(), self.row_group[mask].tolist()):
+            plan.setdefault(self.paths[f], []).append(g)
+        return plan
+
+
+def row_group_index(dataset: ds.FileSystemDataset, disk_cache: bool = True) -> RowGroupIndex:
+    """
+    Return the index of a dataset, loading it from disk or building it if needed
+    """
+    key = _index_key(dataset)
+    with _index_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            return index
+        lock = _build_locks.setdefault(key, threading.Lock())
+
+    with lock:
+        with _index_lock:
+            index = _indexes.get(key)
+        if index is not None:
+            return index
+
+        path = _index_cache_path(key) if disk_cache else None
+        index = None
+        if path is not None and os.path.exists(path):
+            try:
+                index = RowGroupIndex.load(path)
+            except (OSError, ValueError, KeyError):
+                index = None
+        if index is None:
+            index = RowGroupIndex.build(dataset)
+            if path is not None:
+                try:
+                    index.save(path)
+                except OSError:
+                    # The index can always be built again
+                    pass
+
+        with _index_lock:
+            _indexes[key] = index
+        return index
+
+
+def pruned_dataset(dataset: ds.FileSystemDataset, bbox) -> Optional[ds.FileSystemDataset]:
+    """
+    Return a dataset with only the row groups of the dataset that intersect the
+    bounding box according to its index, or None if no row group does
+    """
+    plan = row_group_index(dataset).plan(bbox)
+    if not plan:
+        return None
+
+    fragments = [
+        fragment.subset(row_group_ids=plan[fragment.path])
+        for fragment in dataset.get_fragments()
+        if fragment.path in plan
+    ]
+    return ds.FileSystemDataset(fragments, dataset.schema, dataset.format, dataset.filesystem)
+
+
+def _index_key(dataset: ds.FileSystemDataset) -> str:
+    # The files of a release and type have unique names, so an index is keyed by them
+    files = "\n".join(sorted(dataset.files))
+    return hashlib.sha1(f"{dataset.filesystem.type_name}\n{files}".encode("utf-8")).hexdigest()
+
+
+def _index_cache_path(key: str) -> str:
+    return os.path.join(core.cache_dir, "indexes", key[:16] + ".npz")
+
+
+def _column_indices(schema) -> Dict[str, int]:
+    return {schema.column(i).path: i for i in range(len(schema)) if schema.column(i).path in _bbox_columns}
+
+
+def _row_group_extent(group, columns: Dict[str, int]) -> List[float]:
+    # Row groups without statistics get an infinite extent, so they are always read
+    extent = [-np.inf, -np.inf, np.inf, np.inf]
+    for i, name in enumerate(_bbox_columns):
+        column = columns.get(name)
+        if column is None:
+            continue
+        statistics = group.column(column).statistics
+        if statistics is None or not statistics.has_min_max:
+            continue
+        # Lower left corner from the minimums, upper right from the maximums
+        extent[i] = statistics.min if i < 2 else statistics.max
+    return extent
@@ -0,0 +1,54 @@
+# Lazy loading of heavy dependencies, so that each one is only imported when the
+# stage that needs it runs, and a report of how long each import took.
+
+import importlib
+import sys
+import time
+import types
+
+# Seconds spent importing each lazily loaded module, in load order
+import_times = {}
+
+
+# Module stand-in that imports the real module on first attribute access
+class LazyModule(types.ModuleType):
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attr):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = self._load()
+        return getattr(module, attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def _load(self):
+        # Always go through importlib, which waits for a module that another thread
+        # is still importing, instead of returning it partially initialized
+        name = self.__name__
+        loaded = name in sys.modules
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        if not loaded:
+            import_times[name] = time.perf_counter() - start
+        self.__dict__["_module"] = module
+        return module
+
+
+# Return a stand-in for a module that is imported when first used
+def lazy_import(name):
+    return LazyModule(name)
+
+
+# Return a printable report of the time spent importing lazily loaded modules
+def import_report():
+    if not import_times:
+        return "No lazily loaded modules were imported."
+    lines = ["Import times for lazily loaded modules:"]
+    for name, seconds in sorted(import_times.items(), key=lambda item: -item[1]):
+        lines.append(f"  {name:<24} {seconds * 1000.0:8.1f} ms")
+    lines.append(f"  {'total':<24} {sum(import_times.values()) * 1000.0:8.1f} ms")
+    return "\n".join(lines)
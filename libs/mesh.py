@@ -0,0 +1,582 @@
+# Mesh storage used while generating a model.
+#
+# Vertices are kept as float32 relative to a local origin (the projected centroid of
+# the bounding box), since absolute UTM coordinates in the hundreds of thousands of
+# meters would need float64 to keep millimeter precision. Faces are kept as uint32.
+
+import os
+import tempfile
+
+import numpy as np
+
+from libs.lazy import lazy_import
+
+shapely = lazy_import("shapely")
+trimesh = lazy_import("trimesh")
+
+# Number of rows added to the capacity of a buffer each time it needs to grow
+chunk_rows_default = 1 << 16
+
+# Number of rows handled at a time when transforming vertices in place
+transform_rows = 1 << 20
+
+# Size of the grid that vertices are snapped to when welding, in model units (mm)
+weld_tolerance_default = 0.001
+
+# Grid that unit face normals are rounded to, to find the faces in the same plane
+normal_quantum = 1e-6
+
+
+# Growable buffer of vertices and faces that reserves capacity in chunks, either in
+# memory or backed by memory-mapped files in a directory.
+class MeshAccumulator:
+    def __init__(self, origin=(0.0, 0.0, 0.0), chunk_rows=chunk_rows_default, buffer_dir=None):
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.chunk_rows = chunk_rows
+        self.buffer_dir = buffer_dir
+        self.vertex_count = 0
+        self.face_count = 0
+        self._paths = {}
+        self._vertices = self._allocate("vertices", np.float32, 0)
+        self._faces = self._allocate("faces", np.uint32, 0)
+
+    # Vertices added so far (a view, not a copy)
+    @property
+    def vertices(self):
+        return self._vertices[: self.vertex_count]
+
+    # Faces added so far (a view, not a copy)
+    @property
+    def faces(self):
+        return self._faces[: self.face_count]
+
+    # Approximate number of bytes used by the vertices and faces added so far
+    @property
+    def nbytes(self):
+        return self.vertex_count * 3 * 4 + self.face_count * 3 * 4
+
+    # Add a mesh given in projected coordinates, or with relative, in coordinates
+    # relative to the origin. Face indices are relative to the given vertices and
+    # are offset to follow the vertices already added.
+    def add(self, vertices, faces, relative=False):
+        vertex_total = self.vertex_count + len(vertices)
+        face_total = self.face_count + len(faces)
+        if vertex_total > np.iinfo(np.uint32).max:
+            raise OverflowError("Too many vertices for 32-bit face indices.")
+
+        self._vertices = self._reserve("vertices", self._vertices, vertex_total)
+        self._faces = self._reserve("faces", self._faces, face_total)
+
+        if relative:
+            self._vertices[self.vertex_count : vertex_total] = vertices
+        else:
+            np.subtract(
+                vertices, self.origin, out=self._vertices[self.vertex_count : vertex_total], casting="unsafe"
+            )
+        np.add(
+            faces, self.vertex_count, out=self._faces[self.face_count : face_total], casting="unsafe"
+        )
+
+        self.vertex_count = vertex_total
+        self.face_count = face_total
+
+    # Rotate all vertices around the Z axis through the local origin, in place
+    def rotate_z(self, angle_deg):
+        angle_rad = np.deg2rad(angle_deg)
+        R = np.array(
+            [
+                [np.cos(angle_rad), -np.sin(angle_rad)],
+                [np.sin(angle_rad), np.cos(angle_rad)],
+            ],
+            dtype=np.float32,
+        )
+        for start in range(0, self.vertex_count, transform_rows):
+            xy = self._vertices[start : min(start + transform_rows, self.vertex_count), :2]
+            xy[:] = xy @ R.T
+
+    # Scale all vertices around the local origin, in place
+    def scale(self, factor):
+        for start in range(0, self.vertex_count, transform_rows):
+            self._vertices[start : min(start + transform_rows, self.vertex_count)] *= factor
+
+    # Weld the vertices and faces added so far, a chunk at a time, as weld does.
+    # Returns new arrays of the types of the buffers.
+    def weld(self, tolerance=weld_tolerance_default, join_parts=False):
+        welder = VertexWelder(tolerance, join_parts)
+        index = [
+            welder.add_vertices(self._vertices[start : min(start + transform_rows, self.vertex_count)])
+            for start in range(0, self.vertex_count, transform_rows)
+        ]
+        index = np.concatenate(index) if index else np.empty(0, dtype=np.int64)
+        for start in range(0, self.face_count, transform_rows):
+            welder.add_faces(index[self._faces[start : min(start + transform_rows, self.face_count)]])
+        vertices, faces = welder.finish()
+        return vertices.astype(np.float32), faces.astype(np.uint32)
+
+    # Release any memory-mapped files
+    def close(self):
+        self._vertices = None
+        self._faces = None
+        for path in self._paths.values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._paths = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, value, traceback):
+        self.close()
+
+    # Allocate a buffer with room for the given number of rows
+    def _allocate(self, name, dtype, rows):
+        rows = max(rows, self.chunk_rows)
+        if self.buffer_dir is None:
+            return np.empty((rows, 3), dtype=dtype)
+
+        path = self._paths.get(name)
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix=f"{name}-", suffix=".bin", dir=self.buffer_dir)
+            os.close(fd)
+            self._paths[name] = path
+        with open(path, "r+b") as f:
+            f.truncate(rows * 3 * np.dtype(dtype).itemsize)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=(rows, 3))
+
+    # Make sure a buffer has room for the given number of rows, growing it if needed
+    def _reserve(self, name, buffer, rows):
+        if rows <= len(buffer):
+            return buffer
+
+        # Grow by at least one chunk, and by half the current capacity for large buffers
+        capacity = max(rows, len(buffer) + self.chunk_rows, len(buffer) * 3 // 2)
+        if self.buffer_dir is not None:
+            # The file is grown in place, so the existing rows don't need to be copied
+            buffer.flush()
+            return self._allocate(name, buffer.dtype, capacity)
+
+        grown = np.empty((capacity, 3), dtype=buffer.dtype)
+        grown[: len(buffer)] = buffer
+        return grown
+
+
+# Whether every edge is used by exactly two faces (the mesh is watertight), and
+# whether those two faces use it in opposite directions (the winding is consistent),
+# worked out from the compact face array without building a trimesh
+def check_edges(faces):
+    faces = np.asarray(faces)
+    if len(faces) == 0:
+        return False, False
+    starts = faces.astype(np.uint64)
+    ends = np.roll(starts, -1, axis=1)
+    directed = (starts << np.uint64(32) | ends).ravel()
+    undirected = (np.minimum(starts, ends) << np.uint64(32) | np.maximum(starts, ends)).ravel()
+    del starts, ends
+    undirected.sort()
+    # Sorted, each edge of a watertight mesh is a pair of equal keys, and no key
+    # occurs in more than one pair
+    watertight = len(undirected) % 2 == 0 and bool(
+        np.all(undirected[0::2] == undirected[1::2])
+        and np.all(undirected[1:-1:2] != undirected[2::2])
+    )
+    del undirected
+    if not watertight:
+        return False, False
+    directed.sort()
+    return True, bool(np.all(directed[1:] != directed[:-1]))
+
+
+# Integer grid coordinates of vertices, as one fixed-size key per vertex
+def _vertex_keys(vertices, tolerance):
+    grid = np.round(np.asarray(vertices, dtype=np.float64) / tolerance).astype(np.int64)
+    return np.ascontiguousarray(grid).view(np.dtype((np.void, 24))).ravel()
+
+
+# Mask of faces that use the same vertex more than once
+def _degenerate_faces(faces):
+    return (faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2]) | (faces[:, 0] == faces[:, 2])
+
+
+# Faces with their vertex indices sorted, and whether the sorting flipped the winding
+def _face_keys(faces):
+    order = np.argsort(faces, axis=1)
+    keys = np.take_along_axis(faces, order, axis=1)
+    # Sorting a triangle is an even permutation (a rotation) or an odd one (a flip)
+    in_order = (
+        (order[:, 0] < order[:, 1]).astype(np.int8)
+        + (order[:, 1] < order[:, 2])
+        + (order[:, 0] < order[:, 2])
+    )
+    flipped = in_order % 2 == 0
+    return np.ascontiguousarray(keys.astype(np.int64)).view(np.dtype((np.void, 24))).ravel(), flipped
+
+
+# Drop faces that occur more than once. A face that occurs with both windings is a
+# wall between two touching parts, so all its copies are dropped, otherwise one
+# copy is kept.
+def _drop_duplicate_faces(faces):
+    if len(faces) == 0:
+        return faces
+    face_keys, flipped = _face_keys(faces)
+    _, first_face, face_inverse, counts = np.unique(
+        face_keys, return_index=True, return_inverse=True, return_counts=True
+    )
+    face_inverse = face_inverse.reshape(-1)
+    flips = np.bincount(face_inverse, weights=flipped, minlength=len(counts))
+    single_winding = (flips == 0) | (flips == counts)
+    keep = np.zeros(len(faces), dtype=bool)
+    keep[first_face[single_winding]] = True
+    return faces[keep]
+
+
+# The plane of every face, as a key shared by the faces of both sides of the plane,
+# and whether the face is on the back side. The unit normal is turned so that its
+# largest component is positive, and is rounded to normal_quantum, the distance of
+# the plane from the origin to the tolerance. Also returns the normals and
+# distances, and a mask of the faces with an area.
+def _face_planes(vertices, faces, tolerance):
+    a = vertices[faces[:, 0]]
+    normals = np.cross(vertices[faces[:, 1]] - a, vertices[faces[:, 2]] - a)
+    lengths = np.linalg.norm(normals, axis=1)
+    flat = lengths > 0
+    normals[flat] /= lengths[flat, None]
+    largest = np.abs(normals).argmax(axis=1)
+    back = normals[np.arange(len(normals)), largest] < 0
+    normals[back] *= -1
+    distances = np.einsum("ij,ij->i", normals, a)
+    grid = np.column_stack(
+        [np.round(normals / normal_quantum), np.round(distances / tolerance)]
+    ).astype(np.int64)
+    keys = np.ascontiguousarray(grid).view(np.dtype((np.void, 32))).ravel()
+    return keys, back, normals, distances, flat
+
+
+# Two unit vectors that together with the normal make a right-handed frame
+def _plane_axes(normal):
+    helper = np.zeros(3)
+    helper[np.abs(normal).argmin()] = 1.0
+    u = np.cross(helper, normal)
+    u /= np.linalg.norm(u)
+    return u, np.cross(normal, u)
+
+
+# Areas of triangles given by their corners in a plane, negative for those that are
+# wound clockwise
+def _signed_areas(corners):
+    ab = corners[:, 1] - corners[:, 0]
+    ac = corners[:, 2] - corners[:, 0]
+    return (ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0]) / 2
+
+
+# Triangles of a region of a plane given as a shapely geometry, with vertex indices
+# looked up by grid coordinates in the plane, and new vertices added to new_vertices
+# (lifted back to 3D). The triangles are wound counterclockwise in the plane.
+def _triangulate_region(region, lookup, new_vertices, vertex_count, frame, tolerance):
+    u, v, normal, distance = frame
+    triangles = []
+    for polygon in getattr(region, "geoms", [region]):
+        if polygon.geom_type != "Polygon" or polygon.area <= tolerance * tolerance:
+            continue
+        points, polygon_faces = trimesh.creation.triangulate_polygon(polygon)
+        keys = np.round(points / tolerance).astype(np.int64).tolist()
+        indices = np.empty(len(points), dtype=np.int64)
+        for i, key in enumerate(map(tuple, keys)):
+            index = lookup.get(key)
+            if index is None:
+                index = vertex_count + len(new_vertices)
+                lookup[key] = index
+                x, y = points[i]
+                new_vertices.append(u * x + v * y + normal * distance)
+            indices[i] = index
+        clockwise = _signed_areas(points[polygon_faces]) < 0
+        polygon_faces[clockwise] = polygon_faces[clockwise, ::-1]
+        triangles.append(indices[polygon_faces])
+    if not triangles:
+        return np.empty((0, 3), dtype=np.int64)
+    return np.concatenate(triangles)
+
+
+# The region covered by the triangles of one side of a plane, given by their
+# corners in the plane, and a mask of the triangles left out of it. Triangles that
+# overlap others on the same side belong to intersecting solids, which can't be
+# joined by removing walls, so the connected pieces of the region where they are
+# found are left out.
+def _side_region(corners, tolerance):
+    triangles = shapely.polygons(corners)
+    region = shapely.union_all(triangles, grid_size=tolerance)
+    pieces = np.array(getattr(region, "geoms", [region]), dtype=object)
+    if len(pieces) == 0 or region.is_empty:
+        return region, np.zeros(len(corners), dtype=bool)
+
+    piece_of = np.full(len(corners), -1)
+    centroids, piece_index = shapely.STRtree(pieces).query(
+        shapely.points(corners.mean(axis=1)), predicate="intersects"
+    )
+    piece_of[centroids] = piece_index
+    areas = np.abs(_signed_areas(corners))
+    found = piece_of >= 0
+    covered = np.bincount(piece_of[found], weights=areas[found], minlength=len(pieces))
+    # Snapping to the grid moves the outline of a piece by up to the tolerance
+    overlapping = covered > shapely.area(pieces) + tolerance * shapely.length(pieces)
+    if not overlapping.any():
+        return region, np.zeros(len(corners), dtype=bool)
+    return shapely.union_all(pieces[~overlapping]), overlapping[piece_of] & found
+
+
+# Remove the walls between touching parts. Faces on opposite sides of the same plane
+# that overlap are a wall between two solids: the overlap is cut out of both sides,
+# and what is left of each side is triangulated again. Parts that share a wall, and
+# parts that stand on the top of the base, then become one closed shell, once the
+# T-junctions along the cut are split (see _split_t_junctions).
+def _cancel_shared_walls(vertices, faces, tolerance):
+    keys, back, normals, distances, flat = _face_planes(vertices, faces, tolerance)
+    _, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    inverse[~flat] = -1
+    groups = inverse.max() + 1
+    fronts = np.bincount(inverse[flat], weights=~back[flat], minlength=groups)
+    backs = np.bincount(inverse[flat], weights=back[flat], minlength=groups)
+    shared = np.flatnonzero((fronts > 0) & (backs > 0))
+    if len(shared) == 0:
+        return vertices, faces
+
+    keep = np.ones(len(faces), dtype=bool)
+    added = []
+    new_vertices = []
+    order = np.argsort(inverse, kind="stable")
+    starts = np.searchsorted(inverse[order], shared)
+    ends = np.searchsorted(inverse[order], shared, side="right")
+    for start, end in zip(starts, ends):
+        group = order[start:end]
+        normal = normals[group].mean(axis=0)
+        normal /= np.linalg.norm(normal)
+        distance = distances[group].mean()
+        u, v = _plane_axes(normal)
+
+        # In-plane coordinates of the vertices of the faces on the plane,
+        group_vertices = np.unique(faces[group])
+        # snapped to the grid of the tolerance, which shapely keeps them on
+        grid = np.round(
+            np.column_stack([vertices[group_vertices] @ u, vertices[group_vertices] @ v]) / tolerance
+        ).astype(np.int64)
+        points = grid * tolerance
+        lookup = dict(zip(map(tuple, grid.tolist()), group_vertices.tolist()))
+        position = np.searchsorted(group_vertices, faces[group])
+        sides = []
+        loose = np.zeros(len(group), dtype=bool)
+        for side in (~back[group], back[group]):
+            region, overlapping = _side_region(points[position[side]], tolerance)
+            sides.append(region)
+            loose[np.flatnonzero(side)[overlapping]] = True
+        overlap = shapely.intersection(sides[0], sides[1], grid_size=tolerance)
+        if overlap.area <= tolerance * tolerance:
+            continue
+
+        keep[group[~loose]] = False
+        frame = (u, v, normal, distance)
+        for i, side in enumerate(sides):
+            rest = shapely.difference(side, overlap, grid_size=tolerance)
+            triangles = _triangulate_region(
+                rest, lookup, new_vertices, len(vertices), frame, tolerance
+            )
+            added.append(triangles[:, ::-1] if i else triangles)
+
+    if new_vertices:
+        vertices = np.concatenate([vertices, np.array(new_vertices)])
+    faces = _merge_new_vertices(
+        vertices, np.concatenate([faces[keep]] + added), len(vertices) - len(new_vertices), 2 * tolerance
+    )
+    return vertices, faces
+
+
+# Merge the vertices from first_new on into any vertex within the distance, with
+# the lowest index first. Vertices made by cutting different planes at the same
+# place are on grids in different frames, so they can be apart by about the
+# tolerance.
+def _merge_new_vertices(vertices, faces, first_new, distance):
+    if first_new == len(vertices):
+        return faces
+    tree = shapely.STRtree(shapely.points(vertices[:, :2]))
+    new = np.arange(first_new, len(vertices))
+    new_index, index = tree.query(
+        shapely.points(vertices[first_new:, :2]), predicate="dwithin", distance=distance
+    )
+    new_index = new[new_index]
+    close = (index < new_index) & (
+        np.linalg.norm(vertices[new_index] - vertices[index], axis=1) <= distance
+    )
+    target = np.arange(len(vertices))
+    np.minimum.at(target, new_index[close], index[close])
+    # Follow new vertices merged into new vertices to the vertex they end up in
+    while True:
+        merged = target[target]
+        if np.array_equal(merged, target):
+            break
+        target = merged
+    faces = target[faces]
+    return faces[~_degenerate_faces(faces)]
+
+
+# Split the edges that end in the middle of another edge. Where an edge is used by
+# one face only and vertices of other faces lie on it, the face is split into a fan
+# of faces through those vertices, so that every edge is used by two faces again.
+def _split_t_junctions(vertices, faces, tolerance, passes=8):
+    for _ in range(passes):
+        edges = faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+        low = edges.min(axis=1)
+        high = edges.max(axis=1)
+        _, inverse, counts = np.unique(
+            low * len(vertices) + high, return_inverse=True, return_counts=True
+        )
+        open_edges = np.flatnonzero(counts[inverse.reshape(-1)] == 1)
+        if len(open_edges) == 0:
+            break
+
+        # Vertices of open edges that lie within the tolerance of an open edge,
+        # away from its ends
+        candidates = np.unique(edges[open_edges])
+        tree = shapely.STRtree(shapely.points(vertices[candidates, :2]))
+        a = vertices[edges[open_edges, 0]]
+        b = vertices[edges[open_edges, 1]]
+        boxes = shapely.box(
+            np.minimum(a[:, 0], b[:, 0]) - tolerance,
+            np.minimum(a[:, 1], b[:, 1]) - tolerance,
+            np.maximum(a[:, 0], b[:, 0]) + tolerance,
+            np.maximum(a[:, 1], b[:, 1]) + tolerance,
+        )
+        edge_index, point_index = tree.query(boxes)
+        points = candidates[point_index]
+        a = a[edge_index]
+        direction = b[edge_index] - a
+        lengths = np.linalg.norm(direction, axis=1)
+        t = np.einsum("ij,ij->i", vertices[points] - a, direction) / lengths**2
+        offsets = np.linalg.norm(vertices[points] - a - t[:, None] * direction, axis=1)
+        on_edge = (offsets <= tolerance) & (t * lengths > tolerance) & ((1 - t) * lengths > tolerance)
+        if not on_edge.any():
+            break
+        edge_index, points, t = edge_index[on_edge], points[on_edge], t[on_edge]
+
+        # Split each face along one of its edges per pass
+        split_edges = open_edges[edge_index]
+        split_faces = split_edges // 3
+        first_edge = {}
+        for face, edge in zip(split_faces.tolist(), split_edges.tolist()):
+            first_edge.setdefault(face, edge)
+        chosen = np.fromiter(first_edge.values(), dtype=np.int64)
+        selected = np.isin(split_edges, chosen)
+        split_edges, points, t = split_edges[selected], points[selected], t[selected]
+        order = np.lexsort((t, split_edges))
+        split_edges, points = split_edges[order], points[order]
+
+        keep = np.ones(len(faces), dtype=bool)
+        added = []
+        bounds = np.flatnonzero(np.diff(split_edges)) + 1
+        for edge, edge_points in zip(
+            split_edges[np.r_[0, bounds]].tolist(), np.split(points, bounds)
+        ):
+            face, corner = divmod(edge, 3)
+            keep[face] = False
+            ring = faces[face][[corner, (corner + 1) % 3, (corner + 2) % 3]]
+            chain = np.concatenate([[ring[0]], edge_points, [ring[1]]])
+            added.append(np.column_stack([chain[:-1], chain[1:], np.full(len(chain) - 1, ring[2])]))
+        faces = np.concatenate([faces[keep]] + added)
+    return faces
+
+
+# Merges the vertices of meshes that are added one chunk at a time, e.g. extruded
+# parts or the chunks of a streamed mesh. Vertices closer than the tolerance are
+# snapped to a grid and matched by their grid coordinates, against a sorted array
+# of the keys of all vertices added before, so only the welded vertices are kept as
+# chunks come in. finish()
+# then cleans up the faces of all chunks together (see weld).
+class VertexWelder:
+    def __init__(self, tolerance=weld_tolerance_default, join_parts=False):
+        self.tolerance = tolerance
+        self.join_parts = join_parts
+        self.vertex_count = 0
+        self.input_vertex_count = 0
+        self.input_face_count = 0
+        # Keys of the welded vertices, sorted, and the index of the vertex of each
+        self._keys = np.empty(0, dtype=np.dtype((np.void, 24)))
+        self._key_index = np.empty(0, dtype=np.int64)
+        self._vertices = []
+        self._faces = []
+
+    # Add a chunk of vertices. Returns the index of each in the welded vertices,
+    # for the faces given to add_faces.
+    def add_vertices(self, vertices):
+        self.input_vertex_count += len(vertices)
+        if len(vertices) == 0:
+            return np.empty(0, dtype=np.int64)
+        keys = _vertex_keys(vertices, self.tolerance)
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+        # Look up the vertices of the chunk that have been seen before
+        position = np.searchsorted(self._keys, unique_keys)
+        found = position < len(self._keys)
+        found[found] = self._keys[position[found]] == unique_keys[found]
+        new = ~found
+        index = np.empty(len(unique_keys), dtype=np.int64)
+        index[found] = self._key_index[position[found]]
+        index[new] = np.arange(self.vertex_count, self.vertex_count + np.count_nonzero(new))
+        self.vertex_count += np.count_nonzero(new)
+
+        self._keys = np.insert(self._keys, position[new], unique_keys[new])
+        self._key_index = np.insert(self._key_index, position[new], index[new])
+        self._vertices.append(np.asarray(vertices, dtype=np.float64)[first[new]])
+        return index[inverse.reshape(-1)]
+
+    # Add a chunk of faces, with the vertex indices returned by add_vertices
+    def add_faces(self, faces):
+        self.input_face_count += len(faces)
+        faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+        self._faces.append(faces[~_degenerate_faces(faces)])
+
+    # Add a mesh, with face indices relative to its vertices
+    def add(self, vertices, faces):
+        index = self.add_vertices(vertices)
+        self.add_faces(index[np.asarray(faces, dtype=np.int64)])
+
+    # The welded vertices and faces of all chunks, without duplicate faces. With
+    # join_parts, walls between touching parts are also removed, and faces with
+    # T-junctions along their edges are split.
+    def finish(self):
+        if not self._vertices:
+            return np.empty((0, 3)), np.empty((0, 3), dtype=np.int64)
+        vertices = np.concatenate(self._vertices)
+        faces = _drop_duplicate_faces(np.concatenate(self._faces))
+        self._keys = self._keys[:0]
+        self._key_index = self._key_index[:0]
+        self._vertices = []
+        self._faces = []
+
+        if self.join_parts:
+            vertices, faces = _cancel_shared_walls(vertices, faces, self.tolerance)
+            faces = _split_t_junctions(vertices, faces, self.tolerance)
+            faces = _drop_duplicate_faces(faces[~_degenerate_faces(faces)])
+
+        # Drop the vertices that no face uses any more
+        used, faces = np.unique(faces, return_inverse=True)
+        return vertices[used], faces.reshape(-1, 3)
+
+
+# Merge vertices that are closer than the tolerance and drop degenerate and
+# duplicate faces, and with join_parts, join parts that touch into one closed shell
+# (see VertexWelder). Returns the new vertices and faces, in the types of those
+# given, and the number of vertices and faces removed. Faces split at T-junctions
+# can make the number of faces removed negative.
+def weld(vertices, faces, tolerance=weld_tolerance_default, join_parts=False):
+    if len(vertices) == 0:
+        return vertices, faces, 0, 0
+
+    welder = VertexWelder(tolerance, join_parts)
+    welder.add(vertices, faces)
+    welded_vertices, welded_faces = welder.finish()
+    return (
+        welded_vertices.astype(np.asarray(vertices).dtype, copy=False),
+        welded_faces.astype(np.asarray(faces).dtype, copy=False),
+        len(vertices) - len(welded_vertices),
+        len(faces) - len(welded_faces),
+    )
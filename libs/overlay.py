@@ -0,0 +1,95 @@
+# Resolution of overlaps between the footprints of features before extrusion.
+#
+# Features of different types are extruded from the same ground level, so where
+# e.g. a road runs under a building the two solids intersect. Here the footprints of
+# all features, in projected coordinates, are put in a spatial index and every
+# footprint is cut by the overlapping footprints of higher priority. Priority goes
+# by type, then by height (taller first), then by order. The cut footprints keep a
+# small gap to those that cut them, so that extruding them independently gives
+# solids that neither intersect nor share edges.
+
+from libs.lazy import lazy_import
+
+np = lazy_import("numpy")
+shapely = lazy_import("shapely")
+
+# Types from highest to lowest priority. Types that aren't listed come after these,
+# in the order they are first seen.
+overlay_priority_default = [
+    "building",
+    "building_part",
+    "infrastructure",
+    "segment",
+    "connector",
+    "water",
+    "land_use",
+    "land_cover",
+    "land",
+    "bathymetry",
+]
+
+# Pieces of cut footprints smaller than this (in square meters) are dropped
+min_area_default = 0.01
+
+# Smallest gap (in meters) between a cut footprint and the footprints that cut it
+gap_default = 0.01
+
+
+# Order in which footprints claim their area, as a rank per footprint
+def _ranks(layers, heights, priority):
+    layer_ranks = {layer: i for i, layer in enumerate(priority)}
+    for layer in layers:
+        layer_ranks.setdefault(layer, len(layer_ranks))
+    layer_rank = np.array([layer_ranks[layer] for layer in layers], dtype=np.int64)
+    order = np.lexsort((np.arange(len(layers)), -np.asarray(heights, dtype=np.float64), layer_rank))
+    ranks = np.empty(len(layers), dtype=np.int64)
+    ranks[order] = np.arange(len(layers))
+    return ranks
+
+
+# Cut overlapping footprints so that none of them overlap. layers are the types of
+# the footprints and heights their extrusion heights. Returns the polygons of the
+# cut footprints, the index of the footprint each polygon comes from, and the number
+# of footprints that were cut.
+def resolve_overlaps(
+    layers, heights, footprints, priority=None, min_area=min_area_default, gap=gap_default
+):
+    if priority is None:
+        priority = overlay_priority_default
+    footprints = np.asarray(footprints, dtype=object)
+    if len(footprints) == 0:
+        return np.empty(0, dtype=object), np.empty(0, dtype=np.int64), 0
+
+    ranks = _ranks(layers, heights, priority)
+
+    # Pairs of footprints that overlap or are closer than the gap, with the second
+    # one of higher priority
+    tree = shapely.STRtree(footprints)
+    lower, higher = tree.query(footprints, predicate="dwithin", distance=gap)
+    pairs = ranks[higher] < ranks[lower]
+    lower = lower[pairs]
+    higher = higher[pairs]
+
+    # Cut each footprint by the union of the footprints that have priority over it.
+    # The original footprints are subtracted, which covers the same area as their
+    # cut versions together with what those were cut by.
+    resolved = footprints.copy()
+    order = np.argsort(lower, kind="stable")
+    lower = lower[order]
+    higher = higher[order]
+    starts = np.flatnonzero(np.r_[True, lower[1:] != lower[:-1]]) if len(lower) else []
+    ends = np.r_[starts[1:], len(lower)] if len(lower) else []
+    for start, end in zip(starts, ends):
+        index = lower[start]
+        cutter = shapely.union_all(footprints[higher[start:end]])
+        if gap > 0.0:
+            cutter = shapely.buffer(cutter, gap, join_style="mitre")
+        resolved[index] = shapely.difference(footprints[index], cutter)
+
+    # Split into polygons, dropping slivers and lines left by the cuts
+    parts, part_index = shapely.get_parts(resolved, return_index=True)
+    polygons = shapely.get_type_id(parts) == 3
+    parts = parts[polygons]
+    part_index = part_index[polygons]
+    large = shapely.area(parts) >= min_area
+    return parts[large], part_index[large], len(starts)
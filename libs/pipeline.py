@@ -0,0 +1,86 @@
+# Pipelined execution of the stages of a generation.
+#
+# Without pipelining, overture_to_stl downloads every type, then parses and processes
+# one file after the other, and clips, projects and extrudes one feature after the
+# other. With pipelining, the next types are downloaded and parsed in a background
+# thread while the current type is processed, and the features of a type are
+# clipped and projected in another background thread while the calling thread
+# extrudes them and accumulates the meshes. Bounded queues between the stages make
+# a stage that gets ahead wait for the next one, so the run takes about as long as
+# its slowest stage and holds at most a few parsed files at a time.
+#
+# Downloading and the shapely and pyproj operations of clipping and projecting
+# release the GIL, so they do run at the same time as extrusion. Extrusion and
+# accumulation are kept together, as both are mostly Python and would only take
+# turns in separate threads.
+
+import queue
+import threading
+
+# Number of parsed files that may be waiting to be processed
+file_queue_size = 1
+
+# Number of batches of clipped and projected features that may be waiting to be
+# extruded, and features per batch
+feature_queue_size = 8
+feature_batch_size = 64
+
+# Seconds between checks of the cancel token while waiting for a stage
+poll_seconds = 0.1
+
+
+# Iterate over an iterable in a background thread, with at most maxsize batches of
+# batch_size items waiting for the consumer. Exceptions raised by the iterable are
+# raised by the consumer, and the background thread stops when the consumer stops
+# iterating. While waiting, the cancel token (see libs.progress) is checked, if given.
+def threaded(iterable, maxsize=file_queue_size, batch_size=1, cancel=None):
+    batches = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    # Put an item in the queue unless the consumer has stopped, returning whether it
+    # was put
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=poll_seconds)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        batch = []
+        try:
+            for item in iterable:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    if not put((batch, None)):
+                        return
+                    batch = []
+            if batch and not put((batch, None)):
+                return
+            put((None, None))
+        except BaseException as e:
+            put((None, e))
+
+    thread = threading.Thread(target=produce, name="pipeline", daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                batch, error = batches.get(timeout=poll_seconds)
+            except queue.Empty:
+                if cancel is not None:
+                    cancel.check()
+                continue
+            if batch is not None:
+                yield from batch
+            elif error is not None:
+                raise error
+            else:
+                return
+    finally:
+        # Let the producer finish what it's doing, so that nothing of the run is
+        # left running when it returns
+        stop.set()
+        thread.join()
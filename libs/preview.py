@@ -0,0 +1,61 @@
+# Quick, coarse previews of models, to check the area and heights before a full run.
+#
+# A preview is generated by overture_to_stl like the full model, but with the
+# heightmap engine on a coarse grid, geometries simplified, small features left
+# out, coarse points and no welding, so that it takes seconds instead of minutes.
+# Extruding features costs about the same per feature however simplified they are,
+# while the cost of a heightmap mostly depends on its number of samples. The
+# downloaded GeoJSON is cached as usual, and a session keeps it parsed, so the full
+# model made after a preview starts meshing right away. Previews are shown as GLB,
+# e.g. inline in a web page with model-viewer.
+
+import base64
+
+from libs.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+# Parameters of overture_to_stl replaced for previews, sizes in mm in the printed
+# model
+preview_parameters = {
+    "engine": "heightmap",
+    "simplify_tolerance": 1.0,
+    "min_feature_size": 1.5,
+    "point_sections": 6,
+    "weld_tolerance": 0.0,
+}
+
+# Number of heightmap samples along the longer side of previews
+preview_samples = 256
+
+# Script of the model-viewer web component showing previews
+model_viewer_script = "https://ajax.googleapis.com/ajax/libs/model-viewer/4.0.0/model-viewer.min.js"
+
+
+# Generate a preview of a model and return it as a trimesh mesh, without writing
+# files. The parameters are those of overture_to_stl, except the output path.
+def preview_model(bbox, **parameters):
+    from libs.Overture2STL import bbox_size_meters, overture_to_stl
+
+    parameters.update(preview_parameters)
+    size = max(bbox_size_meters(bbox)) * parameters.get("scale_percent", 100.0) / 100.0
+    parameters["heightmap_resolution"] = size / preview_samples
+    return overture_to_stl(bbox, in_memory=True, **parameters).mesh
+
+
+# GLB of a mesh, turned from z up to the y up of glTF
+def glb_bytes(mesh_obj):
+    mesh_obj = mesh_obj.copy()
+    mesh_obj.apply_transform(
+        np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [0.0, -1.0, 0.0, 0.0], [0.0, 0.0, 0.0, 1.0]])
+    )
+    return mesh_obj.export(file_type="glb")
+
+
+# HTML page showing a GLB with model-viewer, embedding it as a data URL
+def model_viewer_html(glb, height=500):
+    data = base64.b64encode(glb).decode("ascii")
+    return f"""<script type="module" src="{model_viewer_script}"></script>
+<model-viewer src="data:model/gltf-binary;base64,{data}" camera-controls shadow-intensity="1"
+    camera-orbit="0deg 45deg auto" style="width: 100%; height: {height - 20}px;"></model-viewer>
+"""
@@ -0,0 +1,98 @@
+# Per-feature cost accounting, to find the features that make a generation slow.
+#
+# Pass a FeatureProfile as the profile of overture_to_stl, and it records for every
+# feature the seconds spent clipping it to the bounding box, projecting it and
+# extruding it, and the number of vertices and faces it added to the model. The
+# report ranks the most expensive features, and the types, subtypes and classes
+# that take the most time overall.
+
+# Number of features and groups listed in a report
+top_n_default = 20
+
+# Recorded values of a feature, in column order
+columns = ["id", "type", "subtype", "class", "clip", "project", "extrude", "vertices", "faces"]
+
+
+class FeatureProfile:
+    def __init__(self, top_n=top_n_default):
+        self.top_n = top_n
+        self.rows = []
+
+    # Record the costs of a feature, returning its row so that costs of later stages
+    # can be added with add()
+    def record(
+        self, id, type, subtype, class_, clip=0.0, project=0.0, extrude=0.0, vertices=0, faces=0
+    ):
+        self.rows.append([id, type, subtype, class_, clip, project, extrude, vertices, faces])
+        return len(self.rows) - 1
+
+    # Add extrusion time, vertices and faces to a recorded feature
+    def add(self, row, extrude=0.0, vertices=0, faces=0):
+        values = self.rows[row]
+        values[6] += extrude
+        values[7] += vertices
+        values[8] += faces
+
+    # Recorded features as dictionaries, with the total seconds, most expensive first
+    def top(self, n=None):
+        rows = sorted(self.rows, key=lambda values: -(values[4] + values[5] + values[6]))
+        if n is not None:
+            rows = rows[:n]
+        return [dict(zip(columns, values), seconds=sum(values[4:7])) for values in rows]
+
+    # Totals per type, subtype and class, most expensive first
+    def groups(self, n=None):
+        totals = {}
+        for values in self.rows:
+            key = tuple(values[1:4])
+            total = totals.get(key)
+            if total is None:
+                total = totals[key] = [0, 0.0, 0.0, 0.0, 0, 0]
+            total[0] += 1
+            for i in range(5):
+                total[i + 1] += values[i + 4]
+        groups = [
+            {
+                "type": key[0],
+                "subtype": key[1],
+                "class": key[2],
+                "features": total[0],
+                "clip": total[1],
+                "project": total[2],
+                "extrude": total[3],
+                "vertices": total[4],
+                "faces": total[5],
+                "seconds": total[1] + total[2] + total[3],
+            }
+            for key, total in totals.items()
+        ]
+        groups.sort(key=lambda group: -group["seconds"])
+        return groups if n is None else groups[:n]
+
+    # Printable report of the most expensive features and groups
+    def report(self, n=None):
+        if n is None:
+            n = self.top_n
+        if not self.rows:
+            return "No features were profiled."
+
+        clip, project, extrude = (sum(values[i] for values in self.rows) for i in (4, 5, 6))
+        lines = [
+            f"Profiled {len(self.rows)} features: {clip:.2f} s clipping, "
+            f"{project:.2f} s projecting, {extrude:.2f} s extruding.",
+            "Most expensive features (ms clip/project/extrude, vertices, faces):",
+        ]
+        for row in self.top(n):
+            lines.append(
+                f"  {str(row['id']):<40} {row['type']:<14} {row['subtype'] + '/' + row['class']:<28}"
+                f" {row['clip'] * 1000.0:8.1f} {row['project'] * 1000.0:8.1f} {row['extrude'] * 1000.0:8.1f}"
+                f" {row['vertices']:8d} {row['faces']:8d}"
+            )
+        lines.append("Most expensive types/subtypes/classes (features, ms total, vertices, faces):")
+        for group in self.groups(n):
+            lines.append(
+                f"  {group['type']:<14} {group['subtype'] + '/' + group['class']:<28}"
+                f" {group['features']:8d} {group['seconds'] * 1000.0:10.1f}"
+                f" {group['vertices']:9d} {group['faces']:9d}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,73 @@
+# Progress reporting and cooperative cancellation of a generation.
+#
+# overture_to_stl calls an optional progress callback with an event dictionary
+# whenever it changes stage, and for every few features processed:
+#
+#   {"stage": "download", "type": "building", "done": 0, "total": 5}
+#   {"stage": "process", "type": "building", "index": 0, "types": 5,
+#    "done": 1200, "total": 5300}
+#   {"stage": "assemble"}, {"stage": "export"}, {"stage": "done"}
+#
+# "done" and "total" count types for the download stage and features of the
+# current type for the process stage, where "index" is the number of types already
+# processed out of "types". A CancelToken is checked at the same points,
+# and cancelling it makes the generation stop with Cancelled after removing the
+# files it has written.
+
+import threading
+
+# Stages in the order they are reported
+stages = ["download", "process", "assemble", "export", "done"]
+
+# Number of features processed between progress events and cancellation checks
+feature_interval = 256
+
+
+# Raised by a generation that has been cancelled
+class Cancelled(Exception):
+    pass
+
+
+# Token that cancels a generation when cancel() is called, e.g. from another thread
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    # Raise Cancelled if the token has been cancelled
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled("Generation was cancelled.")
+
+
+# Rough fraction of the whole generation that is done at an event, for progress bars
+def progress_fraction(event):
+    stage = event.get("stage")
+    if stage == "download":
+        return 0.3 * event.get("done", 0) / max(event.get("total", 1), 1)
+    if stage == "process":
+        index = event.get("index", 0)
+        within = event.get("done", 0) / max(event.get("total", 1), 1)
+        return 0.3 + 0.5 * (index + within) / max(event.get("types", 1), 1)
+    if stage == "assemble":
+        return 0.8
+    if stage == "export":
+        return 0.9
+    if stage == "done":
+        return 1.0
+    return 0.0
+
+
+# Report an event to a progress callback and check a cancel token, either of which
+# may be None
+def report(progress, cancel, stage, **counters):
+    if cancel is not None:
+        cancel.check()
+    if progress is not None:
+        progress({"stage": stage, **counters})
@@ -0,0 +1,141 @@
+# Incremental refresh of cached GeoJSON files to another Overture release.
+#
+# Every Overture feature has a stable id and a version that is increased whenever
+# the feature changes. Refreshing a cached file reads only the id and version
+# columns of the new release within its bounding box, compares them with those of
+# the cached features, and downloads just the features that were added or changed.
+# Unchanged features are copied from the cached file and removed ones are dropped,
+# so keeping a large cache current costs a fraction of downloading it again. Files
+# of datasets without versions are downloaded again as a whole.
+#
+# The refreshed file replaces the cached one atomically (see libs/cache.py), and
+# since its modification time changes, sessions parse it again on next use.
+
+import glob
+import json
+import os
+
+from libs.lazy import lazy_import
+
+ds = lazy_import("pyarrow.dataset")
+pc = lazy_import("pyarrow.compute")
+core = lazy_import("libs.core")
+index = lazy_import("libs.index")
+cli = lazy_import("libs.cli")
+cache = lazy_import("libs.cache")
+
+# Column that changes when a feature does
+version_column = "version"
+
+
+# Scanner of the rows of a dataset in a bounding box, with an optional extra filter.
+# None if no row group of the dataset intersects the bounding box.
+def _scanner(dataset, bbox, columns=None, filter=None):
+    if isinstance(dataset, ds.FileSystemDataset):
+        dataset = index.pruned_dataset(dataset, bbox)
+        if dataset is None:
+            return None
+    expression = core.bbox_filter(bbox)
+    if filter is not None:
+        expression = expression & filter
+    return dataset.scanner(columns=columns, filter=expression)
+
+
+# Refresh a cached GeoJSON file to the release of a storage (by default that of
+# libs.core). Returns a dictionary with the release it was refreshed from and the
+# number of kept, added, changed and removed features, or None if the file isn't a
+# valid cache entry. A file of the same release is left as it is.
+def refresh_file(path, storage=None, cancel=None):
+    if storage is None:
+        storage = core.get_storage()
+
+    with cache.FileLock(path, cancel):
+        meta = cache.read_meta(path)
+        if meta is None:
+            return None
+        result = {"release": meta.get("release"), "kept": 0, "added": 0, "changed": 0, "removed": 0}
+        if meta.get("release") == storage.release:
+            return result
+
+        type_name = meta["type"]
+        bbox = [float(x) for x in meta["bbox"].split(",")]
+        dataset = core.open_dataset(type_name, storage=storage)
+
+        with open(path, "r") as f:
+            cached = json.load(f)["features"]
+
+        temp = cache.temp_path(path)
+        try:
+            if version_column not in dataset.schema.names:
+                # Nothing to compare with, download it all
+                cli.download(bbox, "geojson", temp, type_name, dataset, cancel)
+                result["added"] = None
+                result["removed"] = len(cached)
+            else:
+                # Versions of the new release
+                scanner = _scanner(dataset, bbox, ["id", version_column])
+                table = scanner.to_table() if scanner is not None else None
+                versions = {}
+                if table is not None:
+                    versions = dict(
+                        zip(table.column("id").to_pylist(), table.column(version_column).to_pylist())
+                    )
+
+                # Features of the cached file that are unchanged, and ids of those
+                # to fetch
+                kept = []
+                cached_ids = set()
+                fetched_ids = []
+                for feature in cached:
+                    properties = feature.get("properties") or {}
+                    id = properties.get("id")
+                    cached_ids.add(id)
+                    if id not in versions:
+                        result["removed"] += 1
+                    elif versions[id] == properties.get(version_column):
+                        kept.append(feature)
+                    else:
+                        fetched_ids.append(id)
+                result["kept"] = len(kept)
+                result["changed"] = len(fetched_ids)
+                added_ids = [id for id in versions if id not in cached_ids]
+                result["added"] = len(added_ids)
+                fetched_ids += added_ids
+
+                # Unchanged features as they were, and the rest from the new release
+                with cli.GeoJSONWriter(temp) as writer:
+                    for feature in kept:
+                        writer.write_feature(feature)
+                    if fetched_ids:
+                        scanner = _scanner(dataset, bbox, filter=pc.field("id").isin(fetched_ids))
+                        reader = scanner.to_reader() if scanner is not None else None
+                        if reader is not None:
+                            cli.copy(reader, writer, cancel)
+
+            cache.commit(temp, path, **{**meta, "release": storage.release})
+        finally:
+            cache.remove(temp)
+        return result
+
+
+# Refresh the cached GeoJSON files of a directory to the release of a storage,
+# returning (path, result of refresh_file) for each of them
+def refresh_directory(directory=".", storage=None, cancel=None):
+    results = []
+    for path in sorted(glob.glob(os.path.join(glob.escape(directory), "*.geojson"))):
+        result = refresh_file(path, storage, cancel)
+        if result is not None:
+            results.append((path, result))
+    return results
+
+
+# Printable line about the result of refreshing a file
+def format_result(path, result, release):
+    if result["release"] == release:
+        return f"'{path}': already of release {release}"
+    if result["added"] is None:
+        return f"'{path}': downloaded again for release {release}, no versions to compare"
+    return (
+        f"'{path}': {result['release'] or 'unknown release'} to {release}, {result['kept']} kept, "
+        f"{result['added']} added, {result['changed']} changed, {result['removed']} removed"
+    )
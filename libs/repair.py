@@ -0,0 +1,118 @@
+# Repair of invalid geometries in bulk, and diagnostics that are counted rather than
+# printed one by one.
+#
+# Overture data has the odd self-intersecting or otherwise invalid polygon, which
+# makes clipping fail and extrusion produce garbage. repair_geometries() checks a
+# whole array of geometries at once and runs make_valid on the invalid ones only,
+# keeping the parts of the same dimension as the input. Problems are recorded in a
+# Diagnostics by stage and reason: the first few of each are printed, and the rest
+# only counted for the summary at the end of the run, as printing thousands of
+# warnings slows down a run by itself.
+
+import threading
+from collections import Counter
+
+from libs.lazy import lazy_import
+
+np = lazy_import("numpy")
+shapely = lazy_import("shapely")
+
+# Number of warnings printed for each stage and reason before they're only counted
+messages_per_reason = 3
+
+
+class Diagnostics:
+    def __init__(self, messages_per_reason=messages_per_reason):
+        self.messages_per_reason = messages_per_reason
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    # Record count occurrences of a problem, printing a warning with the detail
+    # unless enough have been printed for the stage and reason
+    def record(self, stage, reason, detail=None, count=1):
+        key = (stage, reason)
+        with self._lock:
+            previous = self.counts.get(key, 0)
+            self.counts[key] = previous + count
+        if previous < self.messages_per_reason:
+            message = f"Warning: {stage}: {reason}"
+            if count > 1:
+                message += f" ({count} geometries)"
+            if detail is not None:
+                message += f": {detail}"
+            print(message)
+            if previous + count >= self.messages_per_reason:
+                print(f"Further '{reason}' warnings of {stage} are only counted.")
+
+    # Total number of recorded problems
+    @property
+    def total(self):
+        with self._lock:
+            return sum(self.counts.values())
+
+    # Printable summary of the recorded problems, most frequent first
+    def report(self):
+        with self._lock:
+            counts = sorted(self.counts.items(), key=lambda item: -item[1])
+        if not counts:
+            return "No geometry problems."
+        lines = [f"Geometry problems ({sum(count for _, count in counts)}):"]
+        for (stage, reason), count in counts:
+            lines.append(f"  {stage}: {reason}: {count}")
+        return "\n".join(lines)
+
+
+# Record a problem in diagnostics, or print it without
+def warn(diagnostics, stage, reason, detail=None):
+    if diagnostics is not None:
+        diagnostics.record(stage, reason, detail)
+    elif detail is not None:
+        print(f"Warning: {stage}: {reason}: {detail}")
+    else:
+        print(f"Warning: {stage}: {reason}")
+
+
+# Valid versions of an array of geometries, where invalid ones are replaced by the
+# parts of the same dimension of their make_valid() result, possibly empty. The
+# reasons they were invalid are recorded in diagnostics, if given, for the stage.
+def repair_geometries(geometries, diagnostics=None, stage="repair"):
+    invalid = ~shapely.is_valid(geometries)
+    if not invalid.any():
+        return geometries
+
+    broken = geometries[invalid]
+    repaired = shapely.make_valid(broken)
+
+    # make_valid keeps collapsed parts as lines or points, which can't be extruded
+    # like the rest of a polygon
+    collections = np.flatnonzero(shapely.get_type_id(repaired) == 7)
+    dimensions = shapely.get_dimensions(broken)
+    for i in collections:
+        parts = shapely.get_parts(repaired[i])
+        parts = parts[shapely.get_dimensions(parts) == dimensions[i]]
+        repaired[i] = _collect(parts, dimensions[i])
+
+    if diagnostics is not None:
+        # Reasons end with the location, e.g. "Self-intersection[13.1 55.7]"
+        reasons = shapely.is_valid_reason(broken)
+        counts = Counter(reason.split("[")[0] for reason in reasons)
+        for reason, count in counts.items():
+            detail = next(r for r in reasons if r.startswith(reason))
+            diagnostics.record(stage, f"repaired {reason}", detail, count)
+
+    geometries = geometries.copy()
+    geometries[invalid] = repaired
+    return geometries
+
+
+# Multi-geometry of parts of a dimension, or an empty geometry if there are none
+def _collect(parts, dimension):
+    if len(parts) == 0:
+        return shapely.Polygon()
+    if len(parts) == 1:
+        return parts[0]
+    if dimension == 2:
+        return shapely.multipolygons(parts)
+    if dimension == 1:
+        return shapely.multilinestrings(parts)
+    return shapely.multipoints(parts)
@@ -0,0 +1,71 @@
+# Results of a generation kept in memory instead of written to files.
+#
+# With in_memory, overture_to_stl writes neither the feature log nor the model, and
+# returns a ModelResult instead. It holds the mesh, whose vertex and face arrays can
+# be used directly, serializes it to the bytes of an output format on request, and
+# holds the feature log as a pyarrow table with the columns of the CSV log. A web
+# app or service can then hand the bytes to its client without a round trip
+# through the disk and files to clean up afterwards.
+
+import io
+
+from libs.lazy import lazy_import
+
+pa = lazy_import("pyarrow")
+pa_csv = lazy_import("pyarrow.csv")
+export = lazy_import("libs.export")
+
+
+# Rows of the feature log collected in memory, written like those of a csv.writer
+# with the column names first
+class FeatureLog:
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+    # The log as a pyarrow table
+    def table(self):
+        if not self.rows:
+            return pa.table({})
+        names = self.rows[0]
+        return pa.table({name: [row[j] for row in self.rows[1:]] for j, name in enumerate(names)})
+
+
+class ModelResult:
+    def __init__(self, mesh_obj, log, output_format="stl"):
+        self.mesh = mesh_obj
+        self.log = log
+        self.output_format = output_format
+
+    # Vertices as an (n, 3) float array
+    @property
+    def vertices(self):
+        return self.mesh.vertices
+
+    # Faces as an (n, 3) array of vertex indices
+    @property
+    def faces(self):
+        return self.mesh.faces
+
+    # The model in an output format (by default the one it was generated for), as
+    # the bytes of the file overture_to_stl would have written
+    def to_bytes(self, output_format=None):
+        output_format = output_format or self.output_format
+        if output_format == "stl":
+            return self.mesh.export(file_type="stl")
+        f = io.BytesIO()
+        if output_format == "3mf":
+            export.write_3mf(f, self.mesh.vertices, self.mesh.faces)
+        elif output_format == "ply":
+            export.write_ply(f, self.mesh.vertices, self.mesh.faces)
+        else:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        return f.getvalue()
+
+    # The feature log as the bytes of a CSV file
+    def log_csv(self):
+        f = io.BytesIO()
+        pa_csv.write_csv(self.log, f)
+        return f.getvalue()
@@ -0,0 +1,222 @@
+# Rules mapping feature attributes to model dimensions.
+#
+# The rules are a table that is evaluated column-wise over the attributes of all
+# features of a file or record batch at once, producing arrays of polygon heights,
+# line widths/heights and point widths/heights.
+
+from libs.lazy import lazy_import
+
+np = lazy_import("numpy")
+pc = lazy_import("pyarrow.compute")
+
+# Widths of roads in meters
+# https://github.com/OvertureMaps/schema/blob/dev/schema/transportation/segment.yaml
+road_widths = {
+    "motorway": 20.0,
+    "primary": 12.0,
+    "secondary": 8.0,
+    "tertiary": 6.0,
+    "residential": 4.0,
+    "living_street": 4.0,
+    "trunk": 2.0,
+    "unclassified": 2.0,
+    "service": 2.0,
+    "pedestrian": 2.0,
+    "footway": 2.0,
+    "steps": 2.0,
+    "path": 2.0,
+    "track": 2.0,
+    "cycleway": 2.0,
+    "bridleway": 2.0,
+    "unknown": 2.0,
+}
+
+# Polygons to be considered flat areas
+polygon_flat = [
+    # Infrastructure
+    # https://github.com/OvertureMaps/schema/blob/dev/schema/base/infrastructure.yaml
+    "barrier",
+    "pier",
+    "transit",
+    # Water
+    # https://github.com/OvertureMaps/schema/blob/dev/schema/base/water.yaml
+    "canal",
+    "human_made",
+    "lake",
+    "ocean",
+    "physical",
+    "pond",
+    "reservoir",
+    "river",
+    "spring",
+    "stream",
+    "wastewater",
+    "water",
+]
+
+# Points that are relevant to include
+point_relevant = [
+    "transit/bus_stop",
+    # "barrier/bollard",
+    # "barrier/gate"
+]
+
+# Dimensions resolved by the rules
+dimensions = ["polygon_height", "line_width", "line_height", "point_width", "point_height"]
+
+# Default rules, applied in order. Each rule sets a dimension for the features it
+# matches. "subtype" and "class" match a value or a list of values, and match all
+# features if left out. "value" is a number or the name of a default dimension
+# parameter of overture_to_stl (e.g. "line_width_default"). "op" combines the value
+# with the current one: "set" (the default), "max" or "min".
+dimension_rules_default = [
+    # Polygons
+    {"dimension": "polygon_height", "value": "polygon_height_default"},
+    {"dimension": "polygon_height", "subtype": polygon_flat, "value": "polygon_height_flat_default"},
+    # Lines
+    {"dimension": "line_height", "value": "line_height_default"},
+    {"dimension": "line_width", "value": "line_width_default"},
+    *[
+        {"dimension": "line_width", "subtype": "road", "class": road_class, "value": width}
+        for road_class, width in road_widths.items()
+    ],
+    {
+        "dimension": "line_width",
+        "subtype": "road",
+        "class": list(road_widths),
+        "value": "line_width_default",
+        "op": "max",
+    },
+    # Points, only the relevant ones get a size
+    {"dimension": "point_width", "value": 0.0},
+    {"dimension": "point_height", "value": 0.0},
+    *[
+        {"dimension": dimension, "subtype": subtype, "class": point_class, "value": f"{dimension}_default"}
+        for subtype, point_class in (point.split("/") for point in point_relevant)
+        for dimension in ["point_width", "point_height"]
+    ],
+]
+
+# Attributes with an explicit polygon height, in order of preference, with the scale
+# and offset that convert them to meters
+height_sources_default = [
+    ("height", 1.0, 0.0),
+    ("height_m", 1.0, 0.0),
+    ("height_ft", 0.3048, 0.0),
+    ("num_floors", 3.0, 3.0),
+]
+
+
+# Convert an attribute value to a float, NaN if missing or not a number
+def _to_float(value):
+    if value is None:
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+# Attribute columns of a list of GeoJSON features, as numpy arrays
+def feature_columns(features, height_sources=height_sources_default):
+    properties = [feature.get("properties") or {} for feature in features]
+    columns = {
+        "subtype": np.array([str(p.get("subtype") or "").lower() for p in properties], dtype=object),
+        "class": np.array([str(p.get("class") or "").lower() for p in properties], dtype=object),
+    }
+    for name, _, _ in height_sources:
+        columns[name] = np.array([_to_float(p.get(name)) for p in properties], dtype=np.float64)
+    return columns
+
+
+# Attribute columns of an Arrow table or record batch, as numpy arrays
+def table_columns(table, height_sources=height_sources_default):
+    columns = {}
+    for name in ["subtype", "class"]:
+        if name in table.schema.names:
+            values = pc.utf8_lower(pc.fill_null(table.column(name).cast("string"), ""))
+            columns[name] = values.to_numpy(zero_copy_only=False).astype(object)
+        else:
+            columns[name] = np.full(table.num_rows, "", dtype=object)
+    for name, _, _ in height_sources:
+        if name in table.schema.names:
+            values = table.column(name).cast("float64")
+            columns[name] = pc.fill_null(values, np.nan).to_numpy(zero_copy_only=False)
+        else:
+            columns[name] = np.full(table.num_rows, np.nan)
+    return columns
+
+
+# Mask of the features matched by the attribute conditions of a rule
+def _rule_mask(rule, columns, count):
+    mask = np.ones(count, dtype=bool)
+    for attribute in ["subtype", "class"]:
+        if attribute in rule:
+            values = rule[attribute]
+            if isinstance(values, str):
+                mask &= columns[attribute] == values
+            else:
+                mask &= np.isin(columns[attribute], list(values))
+    return mask
+
+
+# Resolve the dimensions of all features from their attribute columns.
+# parameters holds the default dimensions by parameter name, e.g.
+# {"polygon_height_default": 3.0, ...}. The height mode works as in overture_to_stl.
+def resolve_dimensions(
+    columns,
+    parameters,
+    polygon_height_mode="f",
+    rules=None,
+    height_sources=height_sources_default,
+):
+    if rules is None:
+        rules = dimension_rules_default
+
+    count = len(columns["subtype"])
+    resolved = {dimension: np.zeros(count, dtype=np.float64) for dimension in dimensions}
+
+    for rule in rules:
+        dimension = rule["dimension"]
+        if dimension not in resolved:
+            raise ValueError(f"Unknown dimension in rule: {dimension}")
+        value = rule["value"]
+        value = float(parameters[value]) if isinstance(value, str) else float(value)
+        mask = _rule_mask(rule, columns, count)
+        target = resolved[dimension]
+        op = rule.get("op", "set")
+        if op == "set":
+            target[mask] = value
+        elif op == "max":
+            target[mask] = np.maximum(target[mask], value)
+        elif op == "min":
+            target[mask] = np.minimum(target[mask], value)
+        else:
+            raise ValueError(f"Unknown operation in rule: {op}")
+
+    # Height mode other than 'f': explicit height if it exists
+    polygon_height_compare = resolved["polygon_height"]
+    polygon_height = polygon_height_compare.copy()
+    if polygon_height_mode != "f":
+        explicit = np.full(count, np.nan)
+        for name, scale, offset in height_sources:
+            values = columns.get(name)
+            if values is None:
+                continue
+            missing = np.isnan(explicit)
+            explicit[missing] = values[missing] * scale + offset
+        has_explicit = ~np.isnan(explicit)
+        polygon_height[has_explicit] = explicit[has_explicit]
+
+        # Height mode 'l': adjust if explicit height too low
+        if polygon_height_mode == "l":
+            polygon_height = np.maximum(polygon_height, polygon_height_compare)
+
+        # Height mode 'h': adjust if explicit height too high
+        if polygon_height_mode == "h":
+            polygon_height = np.minimum(polygon_height, polygon_height_compare)
+
+    resolved["polygon_height"] = np.maximum(
+        polygon_height, float(parameters["polygon_height_flat_default"])
+    )
+    return resolved
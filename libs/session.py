@@ -0,0 +1,153 @@
+# Reusable state for generating several models in one process.
+#
+# A session owns the pyproj transformers, the pyarrow datasets and the parsed
+# GeoJSON files used by calls to overture_to_stl, so that only the first model for
+# an area pays for setting them up, and clear() or dropping the session releases
+# them. Transformers are kept per thread, as they must not be shared between
+# threads, and otherwise a session can be shared by threads. Data is read from the
+# storage of the session, or the default storage of libs.core if it has none.
+# overture_to_stl uses default_session() when it isn't given one.
+#
+# Parsed features take several times the size of their file in memory, so the cache
+# is bounded by an estimate of that as well as by the number of files.
+
+import os
+import threading
+
+from libs.lazy import lazy_import
+
+geojson = lazy_import("geojson")
+pyproj = lazy_import("pyproj")
+core = lazy_import("libs.core")
+
+
+# Number of parsed GeoJSON files kept by a session
+cached_files_max = 16
+
+# Approximate memory in bytes of the parsed GeoJSON kept by a session
+cached_bytes_max = 1024 * 1024 * 1024
+
+# Approximate bytes of memory taken by parsed GeoJSON per byte of its file
+parsed_bytes_per_file_byte = 8
+
+
+# Transformers from WGS84 to EPSG codes, made on first use and kept per thread
+class TransformerCache:
+    def __init__(self):
+        self._local = threading.local()
+
+    # Transformer to the given EPSG code, for the calling thread
+    def get(self, epsg_code):
+        transformers = getattr(self._local, "transformers", None)
+        if transformers is None:
+            transformers = self._local.transformers = {}
+        transformer = transformers.get(epsg_code)
+        if transformer is None:
+            transformer = pyproj.Transformer.from_crs("EPSG:4326", f"EPSG:{epsg_code}", always_xy=True)
+            transformers[epsg_code] = transformer
+        return transformer
+
+    # Release the transformers of all threads
+    def clear(self):
+        self._local = threading.local()
+
+
+class Session:
+    def __init__(self, cache_features=True, storage=None, cache_bytes=cached_bytes_max):
+        self.cache_features = cache_features
+        self.storage = storage
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.features = {}
+        self._lock = threading.Lock()
+        self._transformers = TransformerCache()
+        self._datasets = {}
+        self._dataset_locks = {}
+        self._dataset_lock = threading.Lock()
+
+    # Transformer from WGS84 to the given EPSG code, for the calling thread
+    def transformer(self, epsg_code):
+        return self._transformers.get(epsg_code)
+
+    # pyarrow dataset for the given Overture type, opened on first use. Without a
+    # storage of its own, the session follows the default storage of libs.core.
+    def dataset(self, overture_type):
+        storage = self.storage or core.get_storage()
+        path = storage.dataset_path(overture_type)
+        # The filesystem is kept with the dataset, since its id is in the key
+        key = (storage.name, id(storage.filesystem), path)
+        with self._dataset_lock:
+            entry = self._datasets.get(key)
+            if entry is not None:
+                return entry[0]
+            lock = self._dataset_locks.setdefault(key, threading.Lock())
+
+        # Opened under a lock of its own, so listing one type doesn't hold up others
+        with lock:
+            with self._dataset_lock:
+                entry = self._datasets.get(key)
+            if entry is None:
+                dataset = core.open_dataset(overture_type, storage=storage, pool=False)
+                entry = (dataset, storage.filesystem)
+                with self._dataset_lock:
+                    self._datasets[key] = entry
+        return entry[0]
+
+    # Features of a GeoJSON file, parsed again only if the file has changed
+    def load_features(self, path):
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self.features.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        with open(path, "r") as f:
+            features = geojson.load(f)["features"]
+        size = stat.st_size * parsed_bytes_per_file_byte
+        if self.cache_features and size <= self.cache_bytes:
+            with self._lock:
+                # Drop the least recently parsed files until this one fits
+                self._forget(path)
+                while self.features and (
+                    len(self.features) >= cached_files_max or self.cached_bytes + size > self.cache_bytes
+                ):
+                    self._forget(next(iter(self.features)))
+                self.features[path] = (key, features, size)
+                self.cached_bytes += size
+        return features
+
+    def _forget(self, path):
+        cached = self.features.pop(path, None)
+        if cached is not None:
+            self.cached_bytes -= cached[2]
+
+    # Generate a model using this session, see overture_to_stl for the parameters
+    def generate(self, bbox, **parameters):
+        from libs.Overture2STL import overture_to_stl
+
+        return overture_to_stl(bbox, session=self, **parameters)
+
+    # Release the transformers, datasets and parsed files of the session
+    def clear(self):
+        with self._lock:
+            self.features.clear()
+            self.cached_bytes = 0
+        with self._dataset_lock:
+            self._datasets.clear()
+            self._dataset_locks.clear()
+        self._transformers.clear()
+
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+# Session of the process, used by overture_to_stl when it isn't given one. It
+# doesn't keep parsed files, but keeps transformers and datasets between calls.
+def default_session():
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = Session(cache_features=False)
+        return _default_session
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import shapely
+
+from libs import budget
+
+
+def squares(count, seed):
+    rng = np.random.default_rng(seed)
+    sizes = rng.uniform(2.0, 30.0, count)
+    x = rng.uniform(0.0, 1000.0, count)
+    y = rng.uniform(0.0, 1000.0, count)
+    return shapely.buffer(shapely.points(x, y), sizes, quad_segs=4)
+
+
+def lines(count, seed):
+    rng = np.random.default_rng(seed)
+    coords = rng.uniform(0.0, 1000.0, (count, 6, 2))
+    return shapely.linestrings(coords)
+
+
+@pytest.fixture
+def geometries():
+    return {
+        "building": budget.TypeGeometry(squares(400, 1), np.empty(0, dtype=object), 0),
+        "building_part": budget.TypeGeometry(squares(200, 2), np.empty(0, dtype=object), 0),
+        "segment": budget.TypeGeometry(np.empty(0, dtype=object), lines(300, 3), 0),
+        "water": budget.TypeGeometry(squares(50, 4), np.empty(0, dtype=object), 0),
+    }
+
+
+def coarsest_faces(geometries):
+    return sum(geometry.faces(budget.left_out - 1) for geometry in geometries.values())
+
+
+def test_plan_keeps_types_while_the_coarsest_levels_fit(geometries):
+    max_faces = coarsest_faces(geometries) + budget.base_faces
+    levels, faces = budget.plan(geometries, max_faces)
+    assert faces <= max_faces
+    assert budget.left_out not in levels.values()
+    assert levels["building"] == levels["building_part"]
+
+
+def test_plan_leaves_out_the_least_important_types_first(geometries):
+    max_faces = (
+        coarsest_faces(geometries) - geometries["water"].faces(budget.left_out - 1) + budget.base_faces
+    )
+    levels, faces = budget.plan(geometries, max_faces)
+    assert faces <= max_faces
+    assert levels["water"] == budget.left_out
+    assert levels["building"] == levels["building_part"] != budget.left_out
+
+
+@pytest.mark.parametrize("max_faces", [100000, 20000, 5000, 1000, 100])
+def test_plan_gives_buildings_and_their_parts_the_same_level(geometries, max_faces):
+    levels, faces = budget.plan(geometries, max_faces)
+    assert faces <= max_faces
+    assert levels["building"] == levels["building_part"]
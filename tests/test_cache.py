@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from libs import cache
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Takes the lock, and increments a counter in a file with a pause between reading
+# and writing it, logging when it enters and leaves
+racer = """
+import sys, time
+from libs import cache
+path = sys.argv[1]
+for _ in range(3):
+    with cache.FileLock(path):
+        with open(path + ".log", "a") as f:
+            f.write("enter\\n")
+        with open(path, "r") as f:
+            count = int(f.read())
+        time.sleep(0.02)
+        with open(path, "w") as f:
+            f.write(str(count + 1))
+        with open(path + ".log", "a") as f:
+            f.write("leave\\n")
+"""
+
+
+def write(path, text):
+    temp = cache.temp_path(path)
+    with open(temp, "w") as f:
+        f.write(text)
+    cache.commit(temp, path, type="building")
+
+
+def test_file_lock_excludes_other_processes(tmp_path):
+    path = str(tmp_path / "counter")
+    with open(path, "w") as f:
+        f.write("0")
+    processes = [subprocess.Popen([sys.executable, "-c", racer, path], cwd=root) for _ in range(4)]
+    assert all(process.wait(timeout=60) == 0 for process in processes)
+
+    with open(path) as f:
+        assert f.read() == "12"
+    with open(path + ".log") as f:
+        assert f.read().split() == ["enter", "leave"] * 12
+    assert not os.path.exists(path + ".lock")
+
+
+def test_is_valid_rejects_stale_and_truncated_files(tmp_path):
+    path = str(tmp_path / "entry.geojson")
+    write(path, '{"features": []}')
+    assert cache.is_valid(path)
+    assert cache.is_valid(path, verify=True, type="building")
+    assert not cache.is_valid(path, type="water")
+
+    # Truncated after it was committed
+    with open(path, "r+") as f:
+        f.truncate(5)
+    assert not cache.is_valid(path)
+
+    # Same size, but written after its sidecar
+    write(path, '{"features": []}')
+    with open(path, "w") as f:
+        f.write('{"features": [1]}'[:16])
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000_000))
+    assert not cache.is_valid(path)
+
+    # Without a sidecar, e.g. left by an older version
+    write(path, '{"features": []}')
+    os.remove(cache.meta_path(path))
+    assert not cache.is_valid(path)
+
+
+def test_commit_leaves_no_temporary_files_when_it_fails(tmp_path):
+    # A directory where the file should go can't be replaced by it
+    path = str(tmp_path / "entry.geojson")
+    os.mkdir(path)
+    temp = cache.temp_path(path)
+    with open(temp, "w") as f:
+        f.write('{"features": []}')
+
+    with pytest.raises(OSError):
+        cache.commit(temp, path)
+    assert sorted(os.listdir(tmp_path)) == ["entry.geojson"]
+    assert not cache.is_valid(path)
@@ -0,0 +1,28 @@
+import numpy as np
+import shapely
+
+from libs import heightmap, mesh
+
+
+def grid(seed):
+    rng = np.random.default_rng(seed)
+    footprints = shapely.buffer(shapely.points(rng.uniform(0, 100, (40, 2))), rng.uniform(2, 12, 40))
+    heights = rng.choice([3.0, 6.0, 9.0], 40)
+    return heightmap.rasterize(footprints, heights, (0.0, 0.0, 100.0, 100.0), 0.5)
+
+
+def test_grid_mesh_is_closed_with_fewer_faces_than_cells():
+    samples = grid(1)
+    vertices, faces = heightmap.grid_mesh(samples, (0.0, 0.0, 100.0, 100.0), -1.0)
+    assert mesh.check_edges(faces) == (True, True)
+    assert len(faces) < (samples.shape[0] - 1) * (samples.shape[1] - 1)
+    assert vertices.dtype == np.float32 and faces.dtype == np.uint32
+
+
+def test_flat_grid_is_a_box():
+    vertices, faces = heightmap.grid_mesh(np.zeros((65, 65), dtype=np.float32), (0.0, 0.0, 64.0, 64.0), -1.0)
+    assert mesh.check_edges(faces) == (True, True)
+    # One block fanned through the samples of the edge of the grid, which the walls
+    # use, the walls and the bottom
+    assert len(faces) == 256 + 2 * 256 + 256
+
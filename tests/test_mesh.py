@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+import shapely
+import trimesh
+
+from libs import mesh
+
+
+def extrude(polygon, height, bottom=0.0):
+    extruded = trimesh.creation.extrude_polygon(polygon, height)
+    vertices = extruded.vertices.copy()
+    vertices[:, 2] += bottom
+    return vertices, extruded.faces
+
+
+def concatenate(parts):
+    offsets = np.cumsum([0] + [len(vertices) for vertices, _ in parts])
+    vertices = np.concatenate([vertices for vertices, _ in parts]).astype(np.float32)
+    faces = np.concatenate([faces + offset for (_, faces), offset in zip(parts, offsets)])
+    return vertices, faces.astype(np.uint32)
+
+
+def shell(vertices, faces):
+    watertight, winding_consistent = mesh.check_edges(faces)
+    result = trimesh.Trimesh(vertices, faces, process=False)
+    return watertight, winding_consistent, result.body_count, result.volume
+
+
+adjacent = {
+    "shared face": [extrude(shapely.box(0, 0, 1, 1), 1), extrude(shapely.box(1, 0, 2, 1), 1)],
+    "different heights": [extrude(shapely.box(0, 0, 1, 1), 2), extrude(shapely.box(1, 0, 2, 1), 1)],
+    "partly shared face": [
+        extrude(shapely.box(0, 0, 1, 1), 1),
+        extrude(shapely.box(1, 0.5, 2, 1.5), 1),
+    ],
+    "on the base": [
+        extrude(shapely.box(-1, -1, 3, 3), 1, bottom=-1),
+        extrude(shapely.box(0, 0, 1, 1), 2),
+        extrude(shapely.box(1.5, 1.5, 2.5, 2), 1),
+    ],
+}
+
+
+@pytest.mark.parametrize("name", adjacent)
+def test_weld_joins_adjacent_extrusions(name):
+    parts = adjacent[name]
+    volume = sum(trimesh.Trimesh(*part).volume for part in parts)
+    vertices, faces, _, _ = mesh.weld(*concatenate(parts), join_parts=True)
+
+    watertight, winding_consistent, bodies, welded_volume = shell(vertices, faces)
+    assert watertight and winding_consistent
+    assert bodies == 1
+    assert welded_volume == pytest.approx(volume, rel=1e-5)
+    assert vertices.dtype == np.float32 and faces.dtype == np.uint32
+
+
+@pytest.mark.parametrize("name", adjacent)
+def test_vertex_welder_joins_chunks(name):
+    welder = mesh.VertexWelder(join_parts=True)
+    for vertices, faces in adjacent[name]:
+        welder.add(vertices, faces)
+    vertices, faces = welder.finish()
+
+    watertight, winding_consistent, bodies, _ = shell(vertices, faces)
+    assert watertight and winding_consistent
+    assert bodies == 1
+
+
+def test_weld_only_merges_vertices_by_default():
+    parts = adjacent["shared face"]
+    vertices, faces, vertices_removed, faces_removed = mesh.weld(*concatenate(parts))
+    assert (vertices_removed, faces_removed) == (4, 0)
+    assert len(vertices) == 12 and len(faces) == 24
+
+
+def test_accumulator_weld_matches_weld(monkeypatch):
+    # Small chunks, so that vertices are matched against earlier chunks
+    monkeypatch.setattr(mesh, "transform_rows", 5)
+    parts = adjacent["on the base"]
+    accumulator = mesh.MeshAccumulator()
+    for vertices, faces in parts:
+        accumulator.add(vertices, faces, relative=True)
+    vertices, faces = accumulator.weld()
+    expected_vertices, expected_faces, _, _ = mesh.weld(*concatenate(parts))
+    assert vertices.dtype == np.float32 and faces.dtype == np.uint32
+    np.testing.assert_array_equal(vertices[faces], expected_vertices[expected_faces])
+
+
+def test_weld_keeps_separate_and_intersecting_parts():
+    separate = [extrude(shapely.box(0, 0, 1, 1), 1), extrude(shapely.box(3, 0, 4, 1), 1)]
+    vertices, faces, vertices_removed, faces_removed = mesh.weld(*concatenate(separate))
+    assert (vertices_removed, faces_removed) == (0, 0)
+    assert shell(vertices, faces)[2] == 2
+
+    # Solids that intersect can't be joined by removing walls, so they stay closed
+    intersecting = [
+        extrude(shapely.box(-1, -1, 3, 3), 1, bottom=-1),
+        extrude(shapely.box(0, 0, 1, 1), 1),
+        extrude(shapely.box(0.5, 0.5, 1.5, 1.5), 1),
+    ]
+    vertices, faces, _, _ = mesh.weld(*concatenate(intersecting), join_parts=True)
+    assert mesh.check_edges(faces) == (True, True)
+
+
+def test_weld_drops_duplicate_and_degenerate_faces():
+    vertices, faces = extrude(shapely.box(0, 0, 1, 1), 1)
+    moved = vertices + 1e-5
+    faces = np.concatenate([faces, faces + len(vertices), [[0, 0, 1]]])
+    welded_vertices, welded_faces, _, _ = mesh.weld(np.concatenate([vertices, moved]), faces)
+    assert len(welded_vertices) == len(vertices)
+    assert len(welded_faces) == len(faces) // 2
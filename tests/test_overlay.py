@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+import shapely
+
+from libs import overlay
+
+
+def resolve(layers, heights, footprints, **options):
+    polygons, index, cut = overlay.resolve_overlaps(layers, heights, footprints, **options)
+    # Nothing overlaps, and the polygons keep the gap between them
+    gap = options.get("gap", overlay.gap_default)
+    for i in range(len(polygons)):
+        for j in range(i + 1, len(polygons)):
+            assert shapely.intersection(polygons[i], polygons[j]).area < 1e-9
+            if index[i] != index[j]:
+                assert shapely.distance(polygons[i], polygons[j]) >= gap * 0.999
+    return polygons, index, cut
+
+
+def area(polygons, index, source):
+    return sum(polygon.area for polygon, i in zip(polygons, index) if i == source)
+
+
+def test_higher_priority_type_cuts_lower_one():
+    # A road strip running under a building
+    footprints = [shapely.box(0, 0, 10, 2), shapely.box(3, -1, 5, 3)]
+    polygons, index, cut = resolve(["segment", "building"], [1.0, 1.0], footprints)
+    assert cut == 1
+    assert area(polygons, index, 1) == pytest.approx(8.0)
+    # The strip is split in two, each piece shortened by the gap
+    assert sorted(index.tolist()) == [0, 0, 1]
+    assert area(polygons, index, 0) == pytest.approx(20.0 - 4.0 - 4 * overlay.gap_default)
+
+
+def test_taller_footprint_wins_within_a_type():
+    footprints = [shapely.box(0, 0, 4, 4), shapely.box(2, 0, 6, 4)]
+    polygons, index, _ = resolve(["building", "building"], [5.0, 20.0], footprints)
+    assert area(polygons, index, 1) == pytest.approx(16.0)
+    assert area(polygons, index, 0) == pytest.approx(4 * (2 - overlay.gap_default))
+
+
+def test_earlier_footprint_wins_at_the_same_type_and_height():
+    footprints = [shapely.box(0, 0, 4, 4), shapely.box(2, 0, 6, 4)]
+    polygons, index, _ = resolve(["building", "building"], [10.0, 10.0], footprints)
+    assert area(polygons, index, 0) == pytest.approx(16.0)
+    assert area(polygons, index, 1) == pytest.approx(4 * (2 - overlay.gap_default))
+
+
+def test_priority_order_can_be_given():
+    footprints = [shapely.box(0, 0, 10, 2), shapely.box(3, -1, 5, 3)]
+    polygons, index, _ = resolve(
+        ["segment", "building"], [1.0, 1.0], footprints, priority=["segment", "building"]
+    )
+    assert area(polygons, index, 0) == pytest.approx(20.0)
+    assert area(polygons, index, 1) < 8.0
+
+
+def test_footprints_closer_than_the_gap_are_cut():
+    # Touching squares, the lower one moves away by the gap
+    footprints = [shapely.box(0, 0, 2, 2), shapely.box(2, 0, 4, 2)]
+    polygons, index, cut = resolve(["water", "building"], [0.1, 5.0], footprints, gap=0.1)
+    assert cut == 1
+    assert area(polygons, index, 0) == pytest.approx(2 * 1.9)
+    assert shapely.distance(polygons[index == 0][0], footprints[1]) == pytest.approx(0.1)
+
+    # Farther apart than the gap, nothing is cut
+    footprints = [shapely.box(0, 0, 2, 2), shapely.box(2.5, 0, 4, 2)]
+    polygons, index, cut = resolve(["water", "building"], [0.1, 5.0], footprints, gap=0.1)
+    assert cut == 0
+    assert shapely.equals(polygons[index == 0][0], footprints[0])
+
+
+def test_slivers_are_dropped():
+    # The building covers the strip but for a sliver along one side
+    footprints = [shapely.box(0, 0, 10, 2), shapely.box(-1, -1, 11, 1.9995)]
+    polygons, index, cut = resolve(["land_use", "building"], [0.1, 5.0], footprints, gap=0.0)
+    assert cut == 1
+    assert index.tolist() == [1]
+
+    # With a smaller minimum area it is kept
+    polygons, index, _ = resolve(["land_use", "building"], [0.1, 5.0], footprints, gap=0.0, min_area=0.001)
+    assert sorted(index.tolist()) == [0, 1]
+    assert area(polygons, index, 0) == pytest.approx(0.005)
+
+
+def test_unlisted_types_come_last_in_order_of_appearance():
+    footprints = [shapely.box(0, 0, 4, 4), shapely.box(2, 0, 6, 4), shapely.box(1, 1, 5, 3)]
+    polygons, index, cut = resolve(["park", "plaza", "bathymetry"], [50.0, 1.0, 1.0], footprints)
+    assert cut == 2
+    assert area(polygons, index, 2) == pytest.approx(8.0)
+    assert np.isin(index, [0, 1, 2]).all()
+    assert area(polygons, index, 0) > area(polygons, index, 1)
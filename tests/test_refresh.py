@@ -0,0 +1,69 @@
+import json
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+from libs import cache, cli, core, refresh
+
+bbox = [13.0, 55.6, 13.01, 55.61]
+
+
+# Write the buildings of a release as GeoParquet, given the version of each id
+def write_release(root, release, versions):
+    ids = sorted(versions)
+    x = np.linspace(bbox[0] + 0.001, bbox[2] - 0.001, len(ids))
+    geometries = shapely.buffer(shapely.points(x, np.full(len(ids), 55.605)), 0.0002)
+    bounds = shapely.bounds(geometries)
+    table = pa.table(
+        {
+            "id": pa.array(ids),
+            "version": pa.array([versions[id] for id in ids], pa.int32()),
+            "geometry": pa.array(shapely.to_wkb(geometries).tolist(), pa.binary()),
+            "bbox": pa.StructArray.from_arrays(
+                [pa.array(bounds[:, i], pa.float32()) for i in range(4)], ["xmin", "ymin", "xmax", "ymax"]
+            ),
+        }
+    )
+    geo = {"version": "1.1.0", "primary_column": "geometry", "columns": {"geometry": {"encoding": "WKB"}}}
+    path = os.path.join(root, "release", release, "theme=buildings", "type=building")
+    os.makedirs(path)
+    pq.write_table(table.replace_schema_metadata({"geo": json.dumps(geo)}), os.path.join(path, "part-0.parquet"))
+
+
+def features(path):
+    with open(path) as f:
+        return {
+            feature["properties"]["id"]: feature["properties"]["version"]
+            for feature in json.load(f)["features"]
+        }
+
+
+def test_refresh_file_fetches_only_added_and_changed_features(tmp_path):
+    old = {f"kept-{i}": 1 for i in range(7)}
+    old.update({f"changed-{i}": 1 for i in range(3)})
+    old.update({f"removed-{i}": 1 for i in range(2)})
+    new = {id: version for id, version in old.items() if not id.startswith("removed")}
+    new.update({f"changed-{i}": 2 for i in range(3)})
+    new["added-0"] = 1
+    write_release(str(tmp_path), "old", old)
+    write_release(str(tmp_path), "new", new)
+
+    # Cached file of the old release
+    path = str(tmp_path / "building.geojson")
+    old_storage = core.Storage.local(str(tmp_path), "old")
+    temp = cache.temp_path(path)
+    cli.download(bbox, "geojson", temp, "building", core.open_dataset("building", storage=old_storage))
+    cache.commit(temp, path, type="building", bbox=",".join(map(str, bbox)), release="old")
+    assert features(path) == old
+
+    result = refresh.refresh_file(path, core.Storage.local(str(tmp_path), "new"))
+    assert result == {"release": "old", "kept": 7, "added": 1, "changed": 3, "removed": 2}
+    assert features(path) == new
+    assert cache.read_meta(path)["release"] == "new"
+
+    # Already of the new release
+    result = refresh.refresh_file(path, core.Storage.local(str(tmp_path), "new"))
+    assert result == {"release": "new", "kept": 0, "added": 0, "changed": 0, "removed": 0}
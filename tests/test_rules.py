@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from libs import rules
+
+parameters = {
+    "polygon_height_default": 10.0,
+    "polygon_height_flat_default": 0.5,
+    "line_width_default": 3.0,
+    "line_height_default": 1.0,
+    "point_width_default": 2.0,
+    "point_height_default": 4.0,
+}
+
+
+# The dimensions of a feature as they were worked out before the rule table, one
+# feature at a time
+def baseline(properties, polygon_height_mode):
+    subtype = properties.get("subtype", "").lower()
+    feature_class = properties.get("class", "").lower()
+
+    if subtype in rules.polygon_flat:
+        polygon_height = polygon_height_compare = parameters["polygon_height_flat_default"]
+    else:
+        polygon_height = polygon_height_compare = parameters["polygon_height_default"]
+    if polygon_height_mode != "f":
+        if properties.get("height") is not None:
+            polygon_height = float(properties["height"])
+        elif properties.get("height_m") is not None:
+            polygon_height = float(properties["height_m"])
+        elif properties.get("height_ft") is not None:
+            polygon_height = float(properties["height_ft"]) * 0.3048
+        elif properties.get("num_floors") is not None:
+            polygon_height = float(properties["num_floors"]) * 3.0 + 3.0
+        if polygon_height_mode == "l" and polygon_height < polygon_height_compare:
+            polygon_height = polygon_height_compare
+        if polygon_height_mode == "h" and polygon_height > polygon_height_compare:
+            polygon_height = polygon_height_compare
+    polygon_height = max(polygon_height, parameters["polygon_height_flat_default"])
+
+    line_width = parameters["line_width_default"]
+    if subtype == "road" and feature_class in rules.road_widths:
+        line_width = max(rules.road_widths[feature_class], parameters["line_width_default"])
+
+    if f"{subtype}/{feature_class}" in rules.point_relevant:
+        point_width, point_height = parameters["point_width_default"], parameters["point_height_default"]
+    else:
+        point_width = point_height = 0.0
+
+    return {
+        "polygon_height": polygon_height,
+        "line_width": line_width,
+        "line_height": parameters["line_height_default"],
+        "point_width": point_width,
+        "point_height": point_height,
+    }
+
+
+# Buildings and parts with each source of an explicit height, flat infrastructure
+# and water, land, roads of every class, other segments, and points
+cases = [
+    {"subtype": "residential", "class": "house"},
+    {"subtype": "commercial", "class": "office", "height": 42.0},
+    {"subtype": "residential", "class": "apartments", "height_m": 4.5},
+    {"subtype": "industrial", "height_ft": 100.0},
+    {"subtype": "education", "num_floors": 1},
+    {"subtype": "civic", "num_floors": 12, "height_ft": 20.0},
+    {"height": 0.1},
+    {},
+    *[{"subtype": subtype, "class": "any", "height": 20.0} for subtype in rules.polygon_flat],
+    {"subtype": "park", "class": "forest"},
+    {"subtype": "land", "class": "grass"},
+    *[{"subtype": "road", "class": road_class} for road_class in rules.road_widths],
+    {"subtype": "road", "class": "alley"},
+    {"subtype": "rail", "class": "standard_gauge"},
+    {"subtype": "water", "class": "canal"},
+    *[dict(zip(["subtype", "class"], point.split("/"))) for point in rules.point_relevant],
+    {"subtype": "transit", "class": "railway_station"},
+    {"subtype": "BARRIER", "class": "Fence"},
+]
+
+
+@pytest.mark.parametrize("polygon_height_mode", ["f", "l", "h", "e"])
+def test_rule_table_matches_the_baseline(polygon_height_mode):
+    columns = rules.feature_columns([{"properties": properties} for properties in cases])
+    resolved = rules.resolve_dimensions(columns, parameters, polygon_height_mode)
+    for dimension in rules.dimensions:
+        expected = [baseline(properties, polygon_height_mode)[dimension] for properties in cases]
+        np.testing.assert_allclose(resolved[dimension], expected, err_msg=dimension)
+
+
+def test_feature_columns_treat_missing_attributes_as_empty():
+    columns = rules.feature_columns([{"properties": None}, {"properties": {"subtype": None, "height": "tall"}}])
+    assert columns["subtype"].tolist() == ["", ""]
+    assert columns["class"].tolist() == ["", ""]
+    assert np.isnan(columns["height"]).all()